@@ -0,0 +1,96 @@
+'''
+This file benchmarks the approximate IVF index against the exact k-d tree on the same data.
+
+Run 'python -m app.Test_files.benchmark_ann' from the Backend/ directory. Use --help to
+change the catalog size, dimensionality and the n_probe values to sweep.
+'''
+import argparse
+import json
+import time
+import numpy as np
+from tabulate import tabulate
+
+from app.services.ann_index import KDTreeIndex, IVFIndex
+
+def make_catalog(n_songs: int, n_features: int, n_clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Generate clustered synthetic features normalized to the [0,1] range like real songs"""
+    rng = np.random.default_rng(seed)
+    centers = rng.random((n_clusters, n_features))
+    labels = rng.integers(0, n_clusters, size=n_songs)
+    data = centers[labels] + rng.normal(scale=0.08, size=(n_songs, n_features))
+    data -= data.min(axis=0)
+    data /= data.max(axis=0)
+    return data
+
+def time_queries(index, queries: np.ndarray, k: int, **query_options):
+    """Run every query and return the neighbor positions and per-query latencies in ms"""
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        _, positions = index.query(query, k, **query_options)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(positions)
+    return results, np.array(latencies)
+
+def recall_at_k(approximate, exact, k: int) -> float:
+    """Average fraction of the exact top-k that the approximate search also returned"""
+    hits = [len(set(a.tolist()) & set(e.tolist())) for a, e in zip(approximate, exact)]
+    return float(np.mean(hits)) / k
+
+def run_benchmark(n_songs: int, n_features: int, k: int, n_queries: int, n_lists, n_probes):
+    data = make_catalog(n_songs, n_features)
+    rng = np.random.default_rng(1)
+    # Query with perturbed catalog songs, the same shape of query the service issues
+    queries = data[rng.choice(n_songs, size=n_queries)] + rng.normal(scale=0.01, size=(n_queries, n_features))
+
+    start = time.perf_counter()
+    kdtree = KDTreeIndex(data)
+    kdtree_build = time.perf_counter() - start
+    exact, kdtree_latency = time_queries(kdtree, queries, k)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(data, n_lists=n_lists)
+    ivf_build = time.perf_counter() - start
+
+    rows = [{
+        "backend": "kdtree",
+        "n_probe": "-",
+        "build_s": round(kdtree_build, 3),
+        f"recall@{k}": 1.0,
+        "p50_ms": round(float(np.percentile(kdtree_latency, 50)), 3),
+        "p99_ms": round(float(np.percentile(kdtree_latency, 99)), 3),
+    }]
+    for n_probe in n_probes:
+        approximate, latency = time_queries(ivf, queries, k, n_probe=n_probe)
+        rows.append({
+            "backend": f"ivf ({ivf.n_lists} lists)",
+            "n_probe": n_probe,
+            "build_s": round(ivf_build, 3),
+            f"recall@{k}": round(recall_at_k(approximate, exact, k), 4),
+            "p50_ms": round(float(np.percentile(latency, 50)), 3),
+            "p99_ms": round(float(np.percentile(latency, 99)), 3),
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the IVF index with the k-d tree")
+    parser.add_argument("--songs", type=int, default=200000, help="Number of synthetic songs")
+    parser.add_argument("--features", type=int, default=10, help="Feature vector dimensionality")
+    parser.add_argument("--k", type=int, default=10, help="Neighbors per query")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--lists", type=int, default=None, help="IVF cells (default 4*sqrt(n))")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="n_probe values to sweep")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = run_benchmark(args.songs, args.features, args.k, args.queries, args.lists, args.probes)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"\n{args.songs} songs x {args.features} features, k={args.k}, {args.queries} queries\n")
+        print(tabulate(rows, headers="keys", tablefmt="grid"))
+
+if __name__ == "__main__":
+    main()
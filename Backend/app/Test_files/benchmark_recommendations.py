@@ -0,0 +1,227 @@
+'''
+This file benchmarks RecommendationService on synthetic catalogs of increasing size.
+
+Each catalog is written to a temporary SQLite file with the real schema, so the service is
+measured end to end (index build, persistence, SQL lookups) without network or audio files.
+Run 'python -m app.Test_files.benchmark_recommendations' from the Backend/ directory; use
+--sizes to pick the catalog sizes (up to 1000000) and --output to save the JSON results.
+
+Memory is reported twice: Python allocations traced by tracemalloc, and the peak resident
+set size of a fresh process that only builds the service, which also counts NumPy, SQLite
+and memory-mapped pages that tracemalloc does not see.
+'''
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from tabulate import tabulate
+
+# Add the project root to the Python path for the Database package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+from Database.create_database import create_music_app_db
+from app.services.feature_store import FeatureStore
+from app.services.recommendation_service import RecommendationService, FEATURE_COLUMNS
+
+# Typical value and spread of every feature column, taken from analyzed songs
+FEATURE_SCALES = {
+    "duration": (210.0, 60.0),
+    "tempo": (120.0, 25.0),
+    "spectral_centroid": (2200.0, 600.0),
+    "spectral_rolloff": (4500.0, 1200.0),
+    "spectral_contrast": (22.0, 3.0),
+    "chroma_mean": (0.4, 0.08),
+    "chroma_std": (0.3, 0.03),
+    "onset_strength": (1.4, 0.3),
+    "zero_crossing_rate": (0.08, 0.03),
+    "rms_energy": (0.2, 0.07),
+}
+GENRES = ["rap", "pop", "rock", "indie", "country", "r&b", "jazz", "electronic", "metal", "folk"]
+
+def make_catalog_db(db_path: str, n_songs: int, songs_per_artist: int = 20, seed: int = 0):
+    """Write a synthetic catalog where each artist's songs cluster around their own style"""
+    rng = np.random.default_rng(seed)
+    n_artists = max(1, n_songs // songs_per_artist)
+    n_albums = n_artists * 2
+
+    mean = np.array([FEATURE_SCALES[column][0] for column in FEATURE_COLUMNS])
+    spread = np.array([FEATURE_SCALES[column][1] for column in FEATURE_COLUMNS])
+    artist_styles = mean + rng.normal(size=(n_artists, len(FEATURE_COLUMNS))) * spread
+    song_albums = rng.integers(0, n_albums, size=n_songs)
+    features = artist_styles[song_albums // 2] + rng.normal(scale=0.3, size=(n_songs, len(FEATURE_COLUMNS))) * spread
+    features = np.abs(features)
+
+    # Keep the schema script's progress output off stdout so --json stays parseable
+    with contextlib.redirect_stdout(sys.stderr):
+        create_music_app_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    conn.executemany("INSERT INTO Artist (artist_id, name) VALUES (?, ?)",
+                     ((i + 1, f"Artist {i + 1}") for i in range(n_artists)))
+    conn.executemany("INSERT INTO Album (album_id, name, artist_id, album_url) VALUES (?, ?, ?, ?)",
+                     ((i + 1, f"Album {i + 1}", i // 2 + 1, f"synthetic://album/{i + 1}") for i in range(n_albums)))
+    conn.executemany(
+        f"INSERT INTO Song (song_id, name, album_id, genre, {', '.join(FEATURE_COLUMNS)}) "
+        f"VALUES (?, ?, ?, ?, {', '.join('?' * len(FEATURE_COLUMNS))})",
+        (
+            (i + 1, f"Song {i + 1}", int(song_albums[i]) + 1, GENRES[(int(song_albums[i]) // 2) % len(GENRES)],
+             *features[i].tolist())
+            for i in range(n_songs)
+        )
+    )
+    conn.commit()
+    conn.close()
+    return n_artists
+
+def percentiles(latencies) -> dict:
+    """p50/p99 of latencies given in seconds, reported in milliseconds"""
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+def remove_saved_state(db_path: str):
+    """Delete the saved index and the feature store so the next construction starts cold"""
+    index_path = os.path.splitext(db_path)[0] + "_index.npz"
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    shutil.rmtree(FeatureStore.for_database(db_path).directory, ignore_errors=True)
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def measure_rss(db_path: str) -> dict:
+    """Build the service cold and report the process's resident memory before and after"""
+    remove_saved_state(db_path)
+    before = peak_rss_bytes()
+    service = RecommendationService(db_path=db_path, cache_size=0)
+    peak = peak_rss_bytes()
+    service.conn.close()
+    return {"rss_baseline_bytes": before, "rss_peak_bytes": peak}
+
+def construct(db_path: str) -> tuple:
+    """Build the service and time it"""
+    start = time.perf_counter()
+    service = RecommendationService(db_path=db_path, cache_size=0)
+    return service, time.perf_counter() - start
+
+async def time_queries(service: RecommendationService, n_songs: int, n_artists: int,
+                       n_queries: int, batch_size: int, limit: int, rng) -> dict:
+    """Time song, artist and batch queries with the response cache disabled"""
+    song_ids = rng.integers(1, n_songs + 1, size=n_queries)
+    artist_ids = rng.integers(1, n_artists + 1, size=n_queries)
+
+    song_latencies = []
+    for song_id in song_ids:
+        start = time.perf_counter()
+        await service.get_recommendations_by_song(str(song_id), limit)
+        song_latencies.append(time.perf_counter() - start)
+
+    artist_latencies = []
+    for artist_id in artist_ids:
+        start = time.perf_counter()
+        await service.get_recommendations_by_artist(int(artist_id), limit)
+        artist_latencies.append(time.perf_counter() - start)
+
+    batch_latencies = []
+    for batch in np.array_split(song_ids, max(1, n_queries // batch_size)):
+        start = time.perf_counter()
+        await asyncio.gather(*(service.get_recommendations_by_song(str(song_id), limit) for song_id in batch))
+        batch_latencies.append(time.perf_counter() - start)
+
+    return {
+        "song": percentiles(song_latencies),
+        "artist": percentiles(artist_latencies),
+        f"batch_of_{batch_size}": percentiles(batch_latencies),
+    }
+
+def run_benchmark(n_songs: int, n_queries: int, batch_size: int, limit: int, measure_memory: bool) -> dict:
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "music_app.db")
+        start = time.perf_counter()
+        n_artists = make_catalog_db(db_path, n_songs)
+        generate_s = time.perf_counter() - start
+
+        # Cold start builds the index from SQL, warm start loads the persisted index
+        service, cold_s = construct(db_path)
+        del service
+        service, warm_s = construct(db_path)
+        queries = asyncio.run(time_queries(service, n_songs, n_artists, n_queries, batch_size, limit, rng))
+        service.conn.close()
+        del service
+
+        result = {
+            "songs": n_songs,
+            "artists": n_artists,
+            "db_bytes": os.path.getsize(db_path),
+            "generate_s": round(generate_s, 3),
+            "construct_cold_s": round(cold_s, 3),
+            "construct_warm_s": round(warm_s, 3),
+            "queries": queries,
+        }
+
+        if measure_memory:
+            # Traced separately because tracemalloc slows construction down
+            remove_saved_state(db_path)
+            tracemalloc.start()
+            service = RecommendationService(db_path=db_path, cache_size=0)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            service.conn.close()
+            del service
+            result["memory"] = {"retained_bytes": current, "peak_bytes": peak}
+
+            # A fresh process, so the peak RSS belongs to this construction alone
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                result["memory"].update(pool.apply(measure_rss, (db_path,)))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure RecommendationService scaling on synthetic catalogs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Catalog sizes to benchmark (e.g. 1000 10000 100000 1000000)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per query type")
+    parser.add_argument("--batch", type=int, default=20, help="Song queries issued together per batch")
+    parser.add_argument("--limit", type=int, default=10, help="Recommendations per query")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the traced memory measurement")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = [
+        run_benchmark(n_songs, args.queries, args.batch, args.limit, not args.no_memory)
+        for n_songs in args.sizes
+    ]
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        rows = [{
+            "songs": result["songs"],
+            "cold_s": result["construct_cold_s"],
+            "warm_s": result["construct_warm_s"],
+            "peak_MB": round(result["memory"]["peak_bytes"] / 2**20, 1) if "memory" in result else "-",
+            "rss_MB": round(result["memory"]["rss_peak_bytes"] / 2**20, 1) if "memory" in result else "-",
+            **{f"{kind} p50/p99 ms": f"{stats['p50_ms']} / {stats['p99_ms']}" for kind, stats in result["queries"].items()},
+        } for result in results]
+        print(tabulate(rows, headers="keys", tablefmt="grid"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+'''
+This file checks that the trigger-maintained counters (migrations 5 and 8) always match a full recount.
+
+A fresh database is migrated and then hit with random inserts, moves, renames, analyses and
+deletes of artists, albums, songs and playlist entries; after every batch the counter
+tables are compared with COUNT(*) queries over the base tables. Songs added to one playlist
+from several connections at once must all get their own position.
+Run 'python -m app.Test_files.test_catalog_counters' from the Backend/ directory.
+'''
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+
+# Add the project root to the Python path for the Database package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+from Database.create_database import create_music_app_db
+from app.services.migrations import migrate
+from app.services.playlists import add_songs, get_playlist_id, place_song, playlist_song_ids, remove_songs, replace_songs
+
+RECOUNTS = {
+    "totals": ("""
+        SELECT artists, albums, songs, analyzed_songs FROM Catalog_Totals
+    """, """
+        SELECT (SELECT COUNT(*) FROM Artist), (SELECT COUNT(*) FROM Album),
+               (SELECT COUNT(*) FROM Song), (SELECT COUNT(*) FROM Song WHERE duration IS NOT NULL)
+    """),
+    "albums": ("""
+        SELECT a.album_id, COALESCE(st.song_count, 0) FROM Album a
+        LEFT JOIN Album_Stats st ON st.album_id = a.album_id ORDER BY a.album_id
+    """, """
+        SELECT a.album_id, (SELECT COUNT(*) FROM Song s WHERE s.album_id = a.album_id)
+        FROM Album a ORDER BY a.album_id
+    """),
+    "artists": ("""
+        SELECT ar.artist_id, COALESCE(st.album_count, 0), COALESCE(st.song_count, 0) FROM Artist ar
+        LEFT JOIN Artist_Stats st ON st.artist_id = ar.artist_id ORDER BY ar.artist_id
+    """, """
+        SELECT ar.artist_id,
+               (SELECT COUNT(*) FROM Album al WHERE al.artist_id = ar.artist_id),
+               (SELECT COUNT(*) FROM Album al JOIN Song s ON s.album_id = al.album_id
+                WHERE al.artist_id = ar.artist_id)
+        FROM Artist ar ORDER BY ar.artist_id
+    """),
+    "genres": ("""
+        SELECT genre, song_count, analyzed_songs FROM Genre_Stats WHERE song_count > 0 ORDER BY genre
+    """, """
+        SELECT COALESCE(genre, ''), COUNT(*), COUNT(duration) FROM Song GROUP BY COALESCE(genre, '') ORDER BY 1
+    """),
+    "playlists": ("""
+        SELECT p.playlist_id, COALESCE(st.song_count, 0) FROM Playlist p
+        LEFT JOIN Playlist_Stats st ON st.playlist_id = p.playlist_id ORDER BY p.playlist_id
+    """, """
+        SELECT p.playlist_id, (SELECT COUNT(*) FROM Playlist_Song ps WHERE ps.playlist_id = p.playlist_id)
+        FROM Playlist p ORDER BY p.playlist_id
+    """),
+}
+
+GENRES = [None, "rock", "jazz", "pop"]
+
+def mismatches(conn: sqlite3.Connection) -> list:
+    """Name every counter table that disagrees with a recount"""
+    return [
+        name for name, (counters, recount) in RECOUNTS.items()
+        if conn.execute(counters).fetchall() != conn.execute(recount).fetchall()
+    ]
+
+def random_write(conn: sqlite3.Connection, rng: random.Random):
+    """Apply one random catalog or playlist change"""
+    def pick(query):
+        rows = conn.execute(query).fetchall()
+        return rng.choice(rows)[0] if rows else None
+
+    artist, album, song = pick("SELECT artist_id FROM Artist"), pick("SELECT album_id FROM Album"), pick("SELECT song_id FROM Song")
+    action = rng.randrange(10)
+    if action == 0 or artist is None:
+        conn.execute("INSERT INTO Artist (name) VALUES (?)", (f"artist {rng.random()}",))
+    elif action == 1 or album is None:
+        conn.execute("INSERT INTO Album (name, artist_id) VALUES (?, ?)", (f"album {rng.random()}", artist))
+    elif action in (2, 3) or song is None:
+        duration = rng.choice([None, 180.0])
+        conn.execute("INSERT INTO Song (name, album_id, duration, genre) VALUES (?, ?, ?, ?)",
+                     (f"song {rng.random()}", album, duration, rng.choice(GENRES)))
+    elif action == 4:
+        conn.execute("UPDATE Song SET album_id = ?, duration = ?, genre = ? WHERE song_id = ?",
+                     (album, rng.choice([None, 200.0]), rng.choice(GENRES), song))
+    elif action == 5:
+        conn.execute("UPDATE Album SET artist_id = ? WHERE album_id = ?", (artist, album))
+    elif action == 6:
+        conn.execute("DELETE FROM Song WHERE song_id = ?", (song,))
+    elif action == 7:
+        conn.execute(rng.choice(["DELETE FROM Album WHERE album_id = ?", "DELETE FROM Artist WHERE artist_id = ?"]),
+                     (album if rng.random() < 0.5 else artist,))
+    elif action == 8:
+        playlist = f"mix {rng.randrange(3)}"
+        conn.execute("INSERT OR IGNORE INTO Playlist (user_id, name) VALUES (1, ?)", (playlist,))
+        add_songs(conn, get_playlist_id(conn, 1, playlist), [song])
+    else:
+        # Drop one playlist song, or a whole playlist the way DELETE /playlists does
+        if rng.random() < 0.8:
+            conn.execute("DELETE FROM Playlist_Song WHERE rowid IN (SELECT rowid FROM Playlist_Song LIMIT 1)")
+        else:
+            conn.execute("DELETE FROM Playlist WHERE user_id = 1 AND name = ?", (f"mix {rng.randrange(3)}",))
+
+def test_counters_match_recount(steps: int = 2000, seed: int = 7):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "music_app.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_music_app_db(db_path)
+            conn = sqlite3.connect(db_path)
+            # Counters are backfilled from data that existed before the migration
+            conn.execute("INSERT INTO Artist (name) VALUES ('existing')")
+            conn.execute("INSERT INTO Album (name, artist_id) VALUES ('existing', 1)")
+            conn.execute("INSERT INTO Song (name, album_id, duration) VALUES ('existing', 1, 1.0)")
+            conn.commit()
+            migrate(conn)
+        assert not mismatches(conn)
+        for step in range(steps):
+            random_write(conn, rng)
+            if step % 50 == 0:
+                problems = mismatches(conn)
+                assert not problems, f"counters drifted after step {step}: {problems}"
+        assert not mismatches(conn)
+        conn.close()
+
+def test_concurrent_playlist_adds(writers: int = 8, songs_each: int = 100):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "music_app.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_music_app_db(db_path)
+            conn = sqlite3.connect(db_path)
+            migrate(conn)
+        conn.execute("INSERT INTO Artist (name) VALUES ('artist')")
+        conn.execute("INSERT INTO Album (name, artist_id) VALUES ('album', 1)")
+        conn.executemany("INSERT INTO Song (name, album_id) VALUES (?, 1)", [(f"song {i}",) for i in range(writers * songs_each)])
+        conn.execute("INSERT INTO Playlist (user_id, name) VALUES (1, 'mix')")
+        conn.commit()
+        playlist_id = get_playlist_id(conn, 1, "mix")
+
+        # Every writer appends its own songs; each must read the end of the playlist under the write lock
+        start, errors = threading.Barrier(writers), []
+        def run(first: int):
+            writer = sqlite3.connect(db_path, timeout=30)
+            start.wait()
+            try:
+                for song_id in range(first, first + songs_each):
+                    add_songs(writer, playlist_id, [str(song_id)])
+                    writer.commit()
+            except sqlite3.Error as e:
+                errors.append(e)
+            writer.close()
+        threads = [threading.Thread(target=run, args=(1 + i * songs_each,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        positions = [row[0] for row in conn.execute("SELECT position FROM Playlist_Song WHERE playlist_id = ?", (playlist_id,))]
+        assert len(positions) == len(set(positions)) == writers * songs_each
+        assert not mismatches(conn)
+
+        # IDs that do not fit an SQLite INTEGER are reported, not raised
+        results = add_songs(conn, playlist_id, [str(2**63), "-" + str(2**64), "x", "1"])
+        assert [result["status"] for result in results] == ["invalid", "invalid", "invalid", "already_in_playlist"]
+        conn.rollback()
+
+        # An entry whose song was deleted without the cascade can still be removed or replaced away
+        conn.execute("DELETE FROM Song WHERE song_id IN (1, 2)")
+        results = remove_songs(conn, playlist_id, ["1"])
+        assert [result["status"] for result in results] == ["removed"]
+        results, dropped = replace_songs(conn, playlist_id, ["2", "3"])
+        assert [result["status"] for result in results] == ["not_found", "kept"]
+        assert dropped == writers * songs_each - 2 and playlist_song_ids(conn, playlist_id) == [3]
+        conn.rollback()
+
+        # Moving a song that is no longer in the playlist reports it and never inserts it
+        remove_songs(conn, playlist_id, ["5"])
+        assert not place_song(conn, playlist_id, 5, 0)
+        assert place_song(conn, playlist_id, 6, 0) and playlist_song_ids(conn, playlist_id)[0] == 6
+        assert 5 not in playlist_song_ids(conn, playlist_id)
+        conn.rollback()
+        conn.close()
+
+if __name__ == "__main__":
+    test_counters_match_recount()
+    print("✅ Catalog, artist, album, genre and playlist counters match a full recount")
+    test_concurrent_playlist_adds()
+    print("✅ Concurrent playlist adds give every song its own position")
@@ -0,0 +1,149 @@
+'''
+This file checks the columnar feature store (services/feature_store.py).
+
+A fresh, migrated database is exported to the store; songs are then inserted, changed,
+unanalyzed and deleted, and after every sync the memory-mapped store must hold exactly
+the analyzed songs the Song table holds. The time to export and to load the store is
+printed next to the time to read the same rows from SQLite. Catalog insights must read the
+store as last synced and never sync it on a request.
+Run 'python -m app.Test_files.test_feature_store' from the Backend/ directory.
+'''
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Add the project root to the Python path for the Database package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+from Database.create_database import create_music_app_db
+from app.services.migrations import migrate
+from app.services.feature_store import FEATURE_COLUMNS, FeatureStore, scan_feature_table
+from app.services.insights import CatalogInsights
+
+def make_database(directory: str, songs: int) -> str:
+    """A migrated database with songs spread over a few albums and genres"""
+    db_path = os.path.join(directory, "music_app.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_music_app_db(db_path)
+        conn = sqlite3.connect(db_path)
+        migrate(conn)
+    conn.execute("INSERT INTO Artist (artist_id, name) VALUES (1, 'artist')")
+    conn.executemany("INSERT INTO Album (album_id, name, artist_id) VALUES (?, ?, 1)", [(i, f"album {i}") for i in range(1, 11)])
+    rng = np.random.default_rng(7)
+    conn.executemany(
+        f"INSERT INTO Song (name, album_id, genre, {', '.join(FEATURE_COLUMNS)}) VALUES (?, ?, ?{', ?' * len(FEATURE_COLUMNS)})",
+        [(f"song {i}", 1 + i % 10, f"genre {i % 5}", *map(float, rng.random(len(FEATURE_COLUMNS)))) for i in range(songs)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+def assert_matches(store: FeatureStore, conn: sqlite3.Connection):
+    """The store's live rows equal a scan of the Song table"""
+    table, expected = store.load(), scan_feature_table(conn)
+    assert table.change_id == expected.change_id
+    order, expected_order = np.argsort(table.song_ids), np.argsort(expected.song_ids)
+    assert np.array_equal(table.song_ids[order], expected.song_ids[expected_order])
+    assert np.array_equal(table.artist_ids[order], expected.artist_ids[expected_order])
+    assert np.array_equal(table.album_ids[order], expected.album_ids[expected_order])
+    assert np.array_equal(table.features[order], expected.features[expected_order], equal_nan=True)
+    genres = [table.genre_labels[code] for code in table.genre_codes[order]]
+    assert genres == [expected.genre_labels[code] for code in expected.genre_codes[expected_order]]
+
+def test_sync_applies_changes(songs: int = 2000):
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(make_database(directory, songs))
+        store = FeatureStore.for_database(os.path.join(directory, "music_app.db"))
+        assert store.sync(conn)
+        assert_matches(store, conn)
+        assert not store.sync(conn)
+
+        conn.execute("INSERT INTO Song (name, album_id, genre, duration, tempo, spectral_centroid) VALUES ('new', 2, 'new genre', 1, 2, 3)")
+        conn.execute("UPDATE Song SET tempo = 99.5, genre = 'changed' WHERE song_id IN (5, 6)")
+        conn.execute("UPDATE Song SET duration = NULL WHERE song_id = 7")
+        conn.execute("DELETE FROM Song WHERE song_id = 8")
+        conn.commit()
+        rows = store.manifest()["rows"]
+        assert store.sync(conn)
+        assert_matches(store, conn)
+        # Only the new song was appended; the others were changed or marked dead in place
+        assert store.manifest()["rows"] == rows + 1 and store.manifest()["live"] == songs - 1
+
+        # Analyzing song 7 again brings it back, and deleting most songs compacts the store
+        conn.execute("UPDATE Song SET duration = 10 WHERE song_id = 7")
+        conn.execute("DELETE FROM Song WHERE song_id > 500")
+        conn.commit()
+        assert store.sync(conn)
+        assert_matches(store, conn)
+        assert store.manifest()["rows"] == store.manifest()["live"] == 499
+
+        # Moving an album to another artist changes the artist of every song on it
+        conn.execute("INSERT INTO Artist (artist_id, name) VALUES (2, 'other artist')")
+        conn.execute("UPDATE Album SET artist_id = 2 WHERE album_id = 3")
+        conn.commit()
+        assert store.sync(conn)
+        assert_matches(store, conn)
+        conn.close()
+
+def test_load_speed(songs: int = 200000):
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(make_database(directory, songs))
+        store = FeatureStore.for_database(os.path.join(directory, "music_app.db"))
+        start = time.perf_counter()
+        store.sync(conn)
+        exported = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scan_feature_table(conn)
+        scanned = time.perf_counter() - start
+        start = time.perf_counter()
+        table = store.load()
+        mean = table.features.mean(axis=0)
+        loaded = time.perf_counter() - start
+        assert len(table.song_ids) == songs and mean.shape == (len(FEATURE_COLUMNS),)
+        conn.close()
+        print(f"   {songs} songs: export {exported:.2f}s, SQLite scan {scanned * 1000:.0f} ms, "
+              f"store load + feature means {loaded * 1000:.1f} ms")
+
+def test_insights_leave_syncing_to_the_background(songs: int = 500):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = make_database(directory, songs)
+        conn = sqlite3.connect(db_path)
+        insights = CatalogInsights(db_path, check_interval=0)
+        # Not exported yet: counters only, and the sync thread is asked to catch up
+        first = insights.get(conn, top=5, bins=10)
+        assert first["feature_histograms"] is None and first["totals"]["songs"] == songs
+        assert insights._wake.is_set() and insights.store.manifest() is None
+
+        insights.sync_store()
+        synced = insights.get(conn, top=5, bins=10)
+        assert synced["feature_histograms"]["tempo"]["count"] == songs
+
+        # A new song shows in the totals at once; the histograms wait for the next sync
+        conn.execute(f"INSERT INTO Song (name, album_id, {', '.join(FEATURE_COLUMNS)}) VALUES ('new', 1{', 1.0' * len(FEATURE_COLUMNS)})")
+        conn.commit()
+        change_id = insights.store.manifest()["change_id"]
+        stale = insights.get(conn, top=5, bins=10)
+        assert stale["totals"]["songs"] == songs + 1 and stale["feature_histograms"]["tempo"]["count"] == songs
+        assert insights.store.manifest()["change_id"] == change_id
+
+        insights.start()
+        deadline = time.monotonic() + 10
+        while insights.get(conn, top=5, bins=10)["feature_histograms"]["tempo"]["count"] != songs + 1:
+            assert time.monotonic() < deadline, "the sync thread did not catch up"
+            time.sleep(0.05)
+        insights.close()
+        conn.close()
+
+if __name__ == "__main__":
+    test_sync_applies_changes()
+    print("✅ Syncing the feature store appends, updates and removes exactly the changed songs")
+    test_load_speed()
+    print("✅ The feature store loads without scanning the Song table")
+    test_insights_leave_syncing_to_the_background()
+    print("✅ Insights read the store as last synced and leave syncing to a background thread")
@@ -0,0 +1,108 @@
+'''
+This file checks the write-behind buffer for listening history (services/history.py).
+
+A fresh, migrated database receives bursts of play events that share one timestamp; every
+event must be written once the buffer closes, plays of unknown songs are dropped, and a
+full buffer refuses new events. Out-of-range IDs are refused, and a batch that fails for
+a reason other than the database does not stop the writer thread. The sustained ingestion
+rate is printed.
+Run 'python -m app.Test_files.test_history_buffer' from the Backend/ directory.
+'''
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Add the project root to the Python path for the Database package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+from Database.create_database import create_music_app_db
+from app.services.migrations import migrate
+from app.services.history import HistoryBuffer, format_played_at
+
+def make_database(directory: str, songs: int = 100) -> str:
+    """A migrated database with one user and a few songs"""
+    db_path = os.path.join(directory, "music_app.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_music_app_db(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO User (name) VALUES ('listener')")
+        conn.execute("INSERT INTO Artist (name) VALUES ('artist')")
+        conn.execute("INSERT INTO Album (name, artist_id) VALUES ('album', 1)")
+        conn.executemany("INSERT INTO Song (name, album_id) VALUES (?, 1)", [(f"song {i}",) for i in range(songs)])
+        conn.commit()
+        migrate(conn)
+        conn.close()
+    return db_path
+
+def test_burst_is_written_on_close(events: int = 50000):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = make_database(directory)
+        buffer = HistoryBuffer(db_path, max_pending=events + 1, batch_size=2000, flush_interval=0.05)
+        played_at = format_played_at()
+        start = time.perf_counter()
+        for i in range(0, events, 100):
+            # Every play shares one timestamp, which collided under the old primary key
+            assert buffer.submit([(1, 1 + (i + j) % 100, played_at) for j in range(100)])
+        buffer.submit([(1, 10**6, played_at)])  # Unknown song
+        buffer.close()
+        elapsed = time.perf_counter() - start
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM History").fetchone()[0] == events
+        conn.close()
+        assert buffer.stats["written"] == events and buffer.stats["unknown_songs"] == 1
+        print(f"   {events} plays written in {elapsed:.2f}s ({events / elapsed:,.0f} plays/s)")
+
+def test_full_buffer_refuses_events():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = make_database(directory)
+        # A long interval and large batch keep the writer from draining the buffer mid-test
+        buffer = HistoryBuffer(db_path, max_pending=10, batch_size=100, flush_interval=60)
+        played_at = format_played_at()
+        assert buffer.submit([(1, 1, played_at)] * 8)
+        assert not buffer.submit([(1, 2, played_at)] * 3)
+        assert buffer.pending() == 8 and buffer.stats["rejected"] == 3
+        buffer.close()
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM History").fetchone()[0] == 8
+        conn.close()
+
+def test_bad_batch_does_not_stop_the_writer():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = make_database(directory)
+        buffer = HistoryBuffer(db_path, batch_size=1, flush_interval=0.01)
+        played_at = format_played_at()
+        try:
+            buffer.submit([(1, 2**70, played_at)])
+            raise AssertionError("a song ID outside SQLite's range was queued")
+        except ValueError:
+            pass
+
+        # An unexpected, non-database error in one flush drops that batch only
+        write = buffer._write
+        def fail_once(batch):
+            buffer._write = write
+            raise OverflowError("bad batch")
+        buffer._write = fail_once
+        buffer.submit([(1, 1, played_at)])
+        deadline = time.monotonic() + 5
+        while buffer.stats["dropped"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        buffer.submit([(1, 2, played_at)])
+        while buffer.stats["written"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert buffer._thread.is_alive()
+        buffer.close()
+        assert buffer.stats["dropped"] == 1 and buffer.stats["written"] == 1
+
+if __name__ == "__main__":
+    test_burst_is_written_on_close()
+    print("✅ Bursts of plays with the same timestamp are all written when the buffer closes")
+    test_full_buffer_refuses_events()
+    print("✅ A full buffer refuses new plays")
+    test_bad_batch_does_not_stop_the_writer()
+    print("✅ Out-of-range IDs are refused and a bad batch does not stop the writer")
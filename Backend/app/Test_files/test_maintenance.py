@@ -0,0 +1,121 @@
+'''
+This file checks the batched maintenance command (Database/maintenance.py).
+
+A migrated database gets thousands of unanalyzed songs plus orphaned albums, artists,
+playlist entries and embeddings. Maintenance must delete exactly the orphans, keep
+unanalyzed songs that are in a playlist or the listening history, release the freed
+pages, and let another connection keep writing while it runs. The song change log is only
+pruned up to the oldest consumer checkpoint.
+Run 'python -m app.Test_files.test_maintenance' from the Backend/ directory.
+'''
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Add the project root to the Python path for the Database package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+from Database.create_database import create_music_app_db
+from Database.maintenance import run_maintenance
+from app.services.migrations import migrate
+from app.services.catalog_changes import changes_available, save_checkpoint
+
+def make_database(directory: str, unanalyzed: int) -> str:
+    """A migrated database with a kept catalog, and orphans for every cleanup"""
+    db_path = os.path.join(directory, "music_app.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_music_app_db(db_path)
+        conn = sqlite3.connect(db_path)
+        migrate(conn)
+    conn.executescript("""
+        INSERT INTO User (user_id, name) VALUES (1, 'listener');
+        INSERT INTO Artist (artist_id, name) VALUES (1, 'kept'), (2, 'no albums'), (3, 'only unanalyzed');
+        INSERT INTO Album (album_id, name, artist_id) VALUES (1, 'kept', 1), (2, 'empty', 1), (3, 'unanalyzed', 3);
+        INSERT INTO Song (song_id, name, album_id, duration) VALUES
+            (1, 'analyzed', 1, 200.0), (2, 'in a playlist', 1, NULL), (3, 'played', 1, NULL);
+        INSERT INTO Playlist (playlist_id, user_id, name) VALUES (1, 1, 'mix');
+        INSERT INTO Playlist_Song (playlist_id, song_id, position) VALUES (1, 2, 1024), (1, 999999, 2048);
+        INSERT INTO History (user_id, song_id) VALUES (1, 3);
+        INSERT INTO Song_Embedding (song_id, vector) VALUES (1, x'00'), (999999, x'00');
+    """)
+    conn.executemany(
+        "INSERT INTO Song (name, album_id, genre) VALUES (?, 3, ?)",
+        [(f"unanalyzed {i}", "x" * 500) for i in range(unanalyzed)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+def test_maintenance_deletes_orphans_in_batches(unanalyzed: int = 5000):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = make_database(directory, unanalyzed)
+
+        # Another connection keeps writing, with a short busy timeout, while maintenance runs
+        done, failures, writes = threading.Event(), [], [0]
+        def write_plays():
+            conn = sqlite3.connect(db_path, timeout=0.5)
+            while not done.is_set():
+                try:
+                    with conn:
+                        conn.execute("INSERT INTO History (user_id, song_id) VALUES (1, 1)")
+                    writes[0] += 1
+                except sqlite3.OperationalError as e:
+                    failures.append(e)
+                time.sleep(0.001)
+            conn.close()
+        writer = threading.Thread(target=write_plays)
+        writer.start()
+        try:
+            summary = run_maintenance(db_path, batch_size=200, delete_unanalyzed=True, pause=0.001, progress=lambda message: None)
+        finally:
+            done.set()
+            writer.join()
+
+        assert not failures, f"writer was blocked: {failures[:3]}"
+        assert writes[0] > 0
+        assert not summary["errors"]
+        assert summary["deleted"] == {
+            "unanalyzed songs": unanalyzed,
+            "playlist entries of missing songs or playlists": 1,
+            "embeddings of missing songs": 1,
+            "albums with no songs": 2,
+            "artists with no albums": 2,
+            "change log entries every consumer has saved": 0,
+        }
+        assert summary["released_pages"] > 0
+
+        conn = sqlite3.connect(db_path)
+        assert [row[0] for row in conn.execute("SELECT song_id FROM Song ORDER BY song_id")] == [1, 2, 3]
+        assert [row[0] for row in conn.execute("SELECT album_id FROM Album")] == [1]
+        assert [row[0] for row in conn.execute("SELECT artist_id FROM Artist")] == [1]
+        assert conn.execute("SELECT freelist_count FROM pragma_freelist_count").fetchone()[0] == 0
+        conn.close()
+
+def test_change_log_pruned_to_oldest_checkpoint(changes: int = 1000):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = make_database(directory, changes)
+        conn = sqlite3.connect(db_path)
+        # Song inserts logged changes 1-3 and then one per unanalyzed song
+        save_checkpoint(conn, "recommendation index", 600)
+        save_checkpoint(conn, "feature store", 400)
+        progress = lambda message: None
+        summary = run_maintenance(db_path, batch_size=100, pause=0, progress=progress)
+        # Every entry is newer than the retention period
+        assert summary["deleted"]["change log entries every consumer has saved"] == 0
+
+        summary = run_maintenance(db_path, batch_size=100, change_log_retention_days=0, pause=0, progress=progress)
+        assert summary["deleted"]["change log entries every consumer has saved"] == 399
+        assert conn.execute("SELECT MIN(change_id) FROM Song_Change_Log").fetchone()[0] == 400
+        assert changes_available(conn, 399) and not changes_available(conn, 398)
+        conn.close()
+
+if __name__ == "__main__":
+    test_maintenance_deletes_orphans_in_batches()
+    print("✅ Maintenance deletes orphans in batches, keeps referenced songs and never blocks writers")
+    test_change_log_pruned_to_oldest_checkpoint()
+    print("✅ The change log is pruned up to the oldest consumer checkpoint")
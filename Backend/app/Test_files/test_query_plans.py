@@ -0,0 +1,256 @@
+'''
+This file checks that the hot queries use indexes instead of scanning whole tables, and
+that migrated databases only hold REAL audio features.
+
+A fresh database is created with create_database.py and migrated, then EXPLAIN QUERY PLAN
+is asserted for every lookup and join the routes and services run on each request. Paging
+through the artists, albums and songs must return every row, including those without a name.
+Run 'python -m app.Test_files.test_query_plans' from the Backend/ directory.
+'''
+import contextlib
+import io
+import os
+import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+
+# Add the project root to the Python path for the Database package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+from Database.create_database import create_music_app_db
+from app.services.migrations import migrate, SCHEMA_VERSION
+from app.services.search import ARTIST_QUERY, ALBUM_QUERY, SONG_QUERY, encode_cursor
+from app.services.catalog_pages import fetch_page, page_query
+from app.services.insights import TOP_ARTISTS_QUERY, TOP_ALBUMS_QUERY
+
+# (description, query, parameters, index each scanned table must be searched with)
+HOT_QUERIES = [
+    ("songs of an album",
+     "SELECT s.song_id, s.name FROM Song s WHERE s.album_id = ?", (1,),
+     {"s": "idx_song_album_name"}),
+    ("song by name and album",
+     "SELECT song_id FROM Song WHERE name = ? AND album_id = ?", ("x", 1),
+     {"Song": "idx_song_album_name"}),
+    ("album by name and artist",
+     "SELECT album_id FROM Album WHERE name = ? AND artist_id = ?", ("x", 1),
+     {"Album": "idx_album_artist_name"}),
+    ("albums of an artist",
+     "SELECT album_id FROM Album WHERE artist_id = ?", (1,),
+     {"Album": "idx_album_artist_name"}),
+    ("artist by name",
+     "SELECT artist_id FROM Artist WHERE name = ?", ("x",),
+     {"Artist": "sqlite_autoindex_Artist_1"}),
+    ("user by name",
+     "SELECT user_id FROM User WHERE name = ?", ("x",),
+     {"User": "idx_user_name"}),
+    ("songs of a playlist",
+     """SELECT s.song_id, s.name, ar.name, al.name
+        FROM Playlist p
+        JOIN Playlist_Song ps ON ps.playlist_id = p.playlist_id
+        JOIN Song s ON ps.song_id = s.song_id
+        JOIN Album al ON s.album_id = al.album_id
+        JOIN Artist ar ON al.artist_id = ar.artist_id
+        WHERE p.user_id = ? AND p.name = ?
+        ORDER BY ps.position""", (1, "x"),
+     {"p": "sqlite_autoindex_Playlist", "ps": "idx_playlist_song_position",
+      "s": "PRIMARY KEY", "al": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+    ("playlists containing a song",
+     "SELECT playlist_id FROM Playlist_Song WHERE song_id = ?", (1,),
+     {"Playlist_Song": "idx_playlist_song_song"}),
+    ("recent plays of a user",
+     """SELECT h.song_id, s.name, h.played_at
+        FROM History h
+        JOIN Song s ON h.song_id = s.song_id
+        WHERE h.user_id = ?
+        ORDER BY h.played_at DESC
+        LIMIT 50""", (1,),
+     {"h": "idx_history_user_played", "s": "PRIMARY KEY"}),
+    ("album track list",
+     """SELECT s.song_id, ar.name, al.name
+        FROM Song s
+        JOIN Album al ON s.album_id = al.album_id
+        JOIN Artist ar ON al.artist_id = ar.artist_id
+        WHERE s.album_id = ?""", (1,),
+     {"s": "idx_song_album_name", "al": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+    ("artist song counts",
+     """SELECT COUNT(*) FROM Album al JOIN Song s ON s.album_id = al.album_id
+        WHERE al.artist_id = ?""", (1,),
+     {"al": "idx_album_artist_name", "s": "idx_song_album_name"}),
+    ("songs waiting for analysis",
+     """SELECT s.song_id, s.name, a.name
+        FROM Song s
+        JOIN Album al ON s.album_id = al.album_id
+        JOIN Artist a ON al.artist_id = a.artist_id
+        WHERE s.duration IS NULL""", (),
+     {"s": "idx_song_unanalyzed", "al": "PRIMARY KEY", "a": "PRIMARY KEY"}),
+    ("song page by ID",
+     *page_query("songs", 100, encode_cursor([], 100)),
+     {"s": "INTEGER PRIMARY KEY", "al": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+    ("song page by name",
+     *page_query("songs", 100, encode_cursor(["m"], 100), sort="name_desc"),
+     {"s": "idx_song_name (<expr><?)", "al": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+    ("artist page",
+     *page_query("artists", 100, encode_cursor(["m"], 100), fields=["id", "name", "album_count"]),
+     {"ar": "idx_artist_page (<expr>>?)", "Artist_Stats": "INTEGER PRIMARY KEY"}),
+    ("album page",
+     *page_query("albums", 100, encode_cursor(["m"], 100), fields=["id", "name", "artist", "song_count"]),
+     {"a": "idx_album_page (<expr>>?)", "ar": "PRIMARY KEY", "Album_Stats": "INTEGER PRIMARY KEY"}),
+    ("artist name search",
+     f"SELECT * FROM ({ARTIST_QUERY}) ORDER BY rank, id LIMIT 50", ('"lo"*',),
+     {"Artist_Search": "VIRTUAL TABLE INDEX", "ar": "PRIMARY KEY"}),
+    ("album name search",
+     f"SELECT * FROM ({ALBUM_QUERY}) ORDER BY rank, id LIMIT 50", ('"lo"*',),
+     {"Album_Search": "VIRTUAL TABLE INDEX", "a": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+    ("song name search",
+     f"SELECT * FROM ({SONG_QUERY}) ORDER BY rank, id LIMIT 50", ('"lo"*',),
+     {"Song_Search": "VIRTUAL TABLE INDEX", "s": "PRIMARY KEY", "al": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+    ("top artists by songs",
+     TOP_ARTISTS_QUERY, (10,),
+     {"st": "idx_artist_stats_song_count", "ar": "PRIMARY KEY"}),
+    ("top albums by songs",
+     TOP_ALBUMS_QUERY, (10,),
+     {"st": "idx_album_stats_song_count", "al": "PRIMARY KEY", "ar": "PRIMARY KEY"}),
+]
+
+def make_database(directory: str) -> sqlite3.Connection:
+    """Create an empty schema in a temporary directory and migrate it"""
+    db_path = os.path.join(directory, "music_app.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_music_app_db(db_path)
+        conn = sqlite3.connect(db_path)
+        migrate(conn)
+    return conn
+
+def query_plan(conn: sqlite3.Connection, query: str, params: tuple) -> list:
+    """The detail column of every EXPLAIN QUERY PLAN row"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+def uses_index(detail: str) -> bool:
+    """Whether a plan step reads through an index (for FTS5, a MATCH constraint)"""
+    return "USING" in detail or re.search(r"VIRTUAL TABLE INDEX \d+:M", detail) is not None
+
+def check_plan(plan: list, expected: dict) -> list:
+    """List the problems with a plan: full scans and tables searched without the expected index"""
+    problems = []
+    for detail in plan:
+        if detail.startswith("SCAN ") and not uses_index(detail):
+            problems.append(f"full table scan: {detail}")
+    for table, index in expected.items():
+        searches = [d for d in plan if d.split(" ")[1:2] == [table] and uses_index(d)]
+        if not any(index in d for d in searches):
+            problems.append(f"{table} not searched with {index}")
+    return problems
+
+def test_migration_sets_version():
+    with tempfile.TemporaryDirectory() as directory:
+        conn = make_database(directory)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        # Running again is a no-op
+        assert migrate(conn) == SCHEMA_VERSION
+        conn.close()
+
+def test_concurrent_migrations_apply_once(processes: int = 4):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "music_app.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_music_app_db(db_path)
+        # Several connections (like uvicorn workers) start migrating the same file at once
+        start, errors = threading.Barrier(processes), []
+        def run():
+            conn = sqlite3.connect(db_path, timeout=30)
+            start.wait()
+            try:
+                migrate(conn)
+            except sqlite3.Error as e:
+                errors.append(e)
+            conn.close()
+        threads = [threading.Thread(target=run) for _ in range(processes)]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        applied = output.getvalue().count("Migrating database to version")
+        assert not errors, errors
+        assert applied == SCHEMA_VERSION, f"{applied} steps applied for {SCHEMA_VERSION} migrations"
+
+def test_features_are_real():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "music_app.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_music_app_db(db_path)
+            conn = sqlite3.connect(db_path)
+            conn.execute("PRAGMA user_version = 2")
+            # A tempo written as the raw bytes of a NumPy float64, as older analyses did
+            conn.execute("INSERT INTO Song (name, album_id, tempo) VALUES ('Blob', 1, ?)", (struct.pack("<d", 117.5),))
+            conn.commit()
+            migrate(conn)
+        assert conn.execute("SELECT tempo, typeof(tempo) FROM Song").fetchone() == (117.5, "real")
+        try:
+            conn.execute("UPDATE Song SET tempo = ?", (b"\x00" * 8,))
+            raise AssertionError("a blob feature was written")
+        except sqlite3.IntegrityError:
+            pass
+        conn.close()
+
+def page_ids(conn: sqlite3.Connection, catalog: str, page_size: int, sort: str = None) -> list:
+    """The IDs of every row, paged through with the cursor"""
+    seen, cursor = [], None
+    while True:
+        rows, cursor = fetch_page(conn, catalog, page_size, cursor, sort=sort, fields=["id", "name"])
+        seen += [row["id"] for row in rows]
+        if cursor is None:
+            return seen
+
+def test_pages_include_every_row(rows: int = 250, page_size: int = 20):
+    with tempfile.TemporaryDirectory() as directory:
+        conn = make_database(directory)
+        # Shared names, empty names and missing names must neither repeat nor be skipped
+        names = [None if i % 7 == 0 else "" if i % 11 == 0 else f"name {i % 30}" for i in range(rows)]
+        # Artist names are unique, so only one can be empty
+        conn.executemany("INSERT INTO Artist (name) VALUES (?)",
+                         [(None if i % 7 == 0 else "" if i == 11 else f"artist {i}",) for i in range(rows)])
+        conn.executemany("INSERT INTO Album (name, artist_id) VALUES (?, 1)", [(name,) for name in names])
+        # Song.name is NOT NULL in this schema (older databases allow NULL, which pages like '')
+        conn.executemany("INSERT INTO Song (name, album_id) VALUES (?, 1)", [(name or "",) for name in names])
+        for catalog, sort in (("artists", None), ("albums", None), ("songs", "name_asc"), ("songs", "name_desc")):
+            seen = page_ids(conn, catalog, page_size, sort)
+            assert len(seen) == len(set(seen)) == rows, f"{len(set(seen))} of {rows} {catalog} paged ({sort})"
+        conn.close()
+
+def test_hot_queries_use_indexes():
+    with tempfile.TemporaryDirectory() as directory:
+        conn = make_database(directory)
+        failures = []
+        for description, query, params, expected in HOT_QUERIES:
+            problems = check_plan(query_plan(conn, query, params), expected)
+            if problems:
+                failures.append(f"{description}: {'; '.join(problems)}")
+        conn.close()
+        assert not failures, "\n".join(failures)
+
+if __name__ == "__main__":
+    test_migration_sets_version()
+    print("✅ Migrations bring a new database to the current schema version")
+    test_concurrent_migrations_apply_once()
+    print("✅ Migrations started together apply every step exactly once")
+    test_features_are_real()
+    print("✅ Blob features are migrated to REAL and rejected on write")
+    test_pages_include_every_row()
+    print("✅ Artist, album and song pages return every row once, named or not")
+    with tempfile.TemporaryDirectory() as directory:
+        conn = make_database(directory)
+        for description, query, params, expected in HOT_QUERIES:
+            plan = query_plan(conn, query, params)
+            problems = check_plan(plan, expected)
+            print(f"{'✅' if not problems else '❌'} {description}")
+            for detail in plan:
+                print(f"     {detail}")
+            for problem in problems:
+                print(f"     -> {problem}")
+        conn.close()
+    test_hot_queries_use_indexes()
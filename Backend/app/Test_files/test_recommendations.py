@@ -1,13 +1,28 @@
 import sys
 import os
 import asyncio
+import shutil
+import sqlite3
+import tempfile
 from typing import List
 
 # Add the Backend directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
+from app.services import recommendation_service
+from app.services.database import DEFAULT_DB_PATH
 from app.services.recommendation_service import RecommendationService
-from app.models.song import Song, RecommendationResponse
+from app.services.song_embeddings import EMBEDDING_COLUMNS, ensure_embedding_table, load_embeddings, save_embedding
+from app.models.song import Song, RecommendationResponse, RecommendationFilters
+from app.services.artist_centroids import NO_ARTIST
+from app.services.ann_index import IncrementalIndex, KDTreeIndex, brute_force_query
+import numpy as np
+
+def copy_database(directory: str) -> str:
+    """Copy the tracked database, so migrations, checkpoints and saved indexes never touch it"""
+    db_path = os.path.join(directory, "music_app.db")
+    shutil.copy(DEFAULT_DB_PATH, db_path)
+    return db_path
 
 def print_recommendations(recommendations: RecommendationResponse):
     """Helper function to print recommendation results"""
@@ -29,12 +44,12 @@ def print_recommendations(recommendations: RecommendationResponse):
         print(f"   Zero Crossing Rate: {song.zero_crossing_rate:.2f}")
         print(f"   RMS Energy: {song.rms_energy:.2f}")
 
-async def test_song_recommendations():
+async def test_song_recommendations(db_path: str):
     """Test getting recommendations based on a specific song"""
     print("\n🎵 Testing Song-Based Recommendations")
     print("=====================================")
     
-    service = RecommendationService()
+    service = RecommendationService(db_path=db_path)
     
     try:
         # First, find Pride by Kendrick Lamar in the database
@@ -69,12 +84,12 @@ async def test_song_recommendations():
     finally:
         service.conn.close()
 
-async def test_artist_recommendations():
+async def test_artist_recommendations(db_path: str):
     """Test getting recommendations based on an artist's songs"""
     print("\n👨‍🎤 Testing Artist-Based Recommendations")
     print("=======================================")
     
-    service = RecommendationService()
+    service = RecommendationService(db_path=db_path)
     
     try:
         # First, find Kendrick Lamar's artist ID
@@ -107,13 +122,203 @@ async def test_artist_recommendations():
     finally:
         service.conn.close()
 
+async def test_single_recommendation(db_path: str):
+    """A limit of 1 with a filter mask returns exactly one song"""
+    print("\n1️⃣ Testing A Single Filtered Recommendation")
+    print("===========================================")
+
+    # Every row allowed and k=1 once made cKDTree return scalars
+    index = KDTreeIndex(np.random.default_rng(0).random((100, 3)))
+    distances, positions = index.query(np.zeros(3), k=1, exclude=np.zeros(100, dtype=bool))
+    assert distances.shape == positions.shape == (1,)
+
+    service = RecommendationService(db_path=db_path)
+    try:
+        artist_id = int(service.song_artist_ids[0])
+        recommendations = await service.get_recommendations_by_artist(
+            artist_id=artist_id,
+            limit=1,
+            filters=RecommendationFilters(min_duration=0)
+        )
+        assert len(recommendations.recommendations) == 1
+        print("\n✅ Successfully got a single filtered recommendation")
+    finally:
+        service.conn.close()
+
+async def test_unknown_artists_are_capped_apart(db_path: str):
+    """Songs without an artist are not one artist for max_per_artist"""
+    print("\n👤 Testing The Artist Cap Without Artists")
+    print("=========================================")
+
+    service = RecommendationService(db_path=db_path, cache_size=0)
+    try:
+        service.song_artist_ids[:] = NO_ARTIST
+        recommendations = await service.get_recommendations_by_song(
+            str(service.song_ids[0]), limit=5, diversity=0.3, max_per_artist=1
+        )
+        assert len(recommendations.recommendations) == 5
+        print("\n✅ Every song without an artist was capped on its own")
+    finally:
+        service.conn.close()
+
+async def test_calls_leave_the_event_loop_free(db_path: str):
+    """Service calls wait on a worker thread, so the event loop keeps running"""
+    print("\n🔁 Testing That Recommendations Run Off The Event Loop")
+    print("=====================================================")
+
+    service = RecommendationService(db_path=db_path)
+    try:
+        song_id = str(int(service.song_ids[0]))
+        # While this thread holds the service lock, a call made on the loop's thread would
+        # re-enter it and finish at once; a call on the worker thread has to wait
+        with service._lock:
+            call = asyncio.create_task(service.get_recommendations_by_song(song_id, limit=5))
+            await asyncio.sleep(0.2)
+            assert not call.done()
+        assert len((await call).recommendations) == 5
+
+        # Radio batches are produced wherever the station is iterated, here on another thread
+        batches = await service.generate_radio(song_id, length=30, batch_size=10)
+        songs = await asyncio.to_thread(lambda: [song for batch in batches for song in batch])
+        assert len(songs) == 30 and song_id not in [song.id for song in songs]
+        print("\n✅ The event loop stayed free while recommendations were built")
+    finally:
+        service.conn.close()
+
+async def test_incremental_index():
+    """Added, changed and removed rows are searched exactly until the background rebuild"""
+    print("\n🧩 Testing The Incremental Index")
+    print("================================")
+
+    rng = np.random.default_rng(1)
+    data = rng.random((2000, 10))
+    # Probing every IVF cell makes it exact too
+    for backend, options in (("kdtree", {}), ("ivf", {"n_probe": 1000})):
+        index = IncrementalIndex(data, backend, min_rebuild_rows=300, **options)
+        rows = data.copy()
+        removed = np.zeros(len(rows), dtype=bool)
+        for step in range(10):
+            changed = rng.choice(len(rows), size=20, replace=False)
+            rows[changed] = rng.random((20, 10))
+            index.update(changed, rows[changed])
+            added = rng.random((20, 10))
+            assert list(index.add(added)) == list(range(len(rows), len(rows) + 20))
+            rows = np.concatenate([rows, added])
+            removed = np.concatenate([removed, np.zeros(20, dtype=bool)])
+            gone = rng.choice(len(rows), size=5, replace=False)
+            index.remove(gone)
+            removed[gone] = True
+
+            exclude = rng.random(len(rows)) < 0.1
+            query = rng.random(10)
+            distances, positions = index.query(query, k=10, exclude=exclude)
+            _, expected = brute_force_query(rows, query, 10, np.flatnonzero(~exclude & ~removed))
+            assert list(positions) == list(expected), (backend, step)
+        # 300 writes made a rebuild due; it was started in the background and lands here
+        index.rebuild()
+        assert index.rebuilds >= 1 and index.pending_rows() == 0
+        _, positions = index.query(query, k=10, exclude=exclude)
+        assert list(positions) == list(expected)
+    print("\n✅ The incremental index matches an exact search before and after rebuilding")
+
+async def test_refresh_without_rebuilding():
+    """Song changes reach the index without a rebuild, and the saved index is reloaded"""
+    print("\n🔄 Testing Incremental Refresh")
+    print("==============================")
+
+    with tempfile.TemporaryDirectory() as directory:
+        # A copy of its own, so the test can change songs freely
+        db_path = copy_database(directory)
+
+        service = RecommendationService(db_path=db_path)
+        built = service.feature_index.built
+        old_id, gone_id = int(service.song_ids[0]), int(service.song_ids[1])
+        conn = service.conn
+        conn.execute(
+            "INSERT INTO Song (name, album_id, genre, duration, tempo, spectral_centroid, spectral_rolloff, "
+            "spectral_contrast, chroma_mean, chroma_std, onset_strength, zero_crossing_rate, rms_energy) "
+            "SELECT 'Copy', album_id, genre, duration, tempo, spectral_centroid, spectral_rolloff, "
+            "spectral_contrast, chroma_mean, chroma_std, onset_strength, zero_crossing_rate, rms_energy "
+            "FROM Song WHERE song_id = ?", (old_id,)
+        )
+        new_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.execute("UPDATE Song SET duration = NULL WHERE song_id = ?", (gone_id,))
+        conn.commit()
+        assert service.refresh(force=True)
+        # Three changes are searched exactly; the built index was kept
+        assert service.feature_index.built is built and service.feature_index.pending_rows() == 1
+
+        recommendations = (await service.get_recommendations_by_song(str(old_id), limit=5)).recommendations
+        ids = [int(song.id) for song in recommendations]
+        assert ids[0] == new_id and gone_id not in ids
+
+        # The saved index holds the live songs only and is loaded again without rebuilding
+        reloaded = RecommendationService(db_path=db_path)
+        assert sorted(reloaded.positions) == sorted(service.positions)
+        assert gone_id not in reloaded.positions and new_id in reloaded.positions
+        reloaded.conn.close()
+
+        # An index saved for another database is not loaded
+        conn.execute("UPDATE Database_Identity SET database_id = 'recreated'")
+        conn.commit()
+        service.database_id = "recreated"
+        assert not service._load_index()
+        service.conn.close()
+    print("\n✅ Refresh applied the changes without rebuilding the index")
+
+async def test_refresh_reads_changed_embeddings():
+    """In cascade mode a refresh reads the embeddings of the changed songs only"""
+    print("\n🧬 Testing Cascade Embedding Refresh")
+    print("===================================")
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = copy_database(directory)
+
+        rng = np.random.default_rng(3)
+        conn = sqlite3.connect(db_path)
+        ensure_embedding_table(conn)
+        song_ids = [row[0] for row in conn.execute("SELECT song_id FROM Song WHERE duration IS NOT NULL LIMIT 50")]
+        for song_id in song_ids[:40]:
+            save_embedding(conn.cursor(), song_id, rng.random(len(EMBEDDING_COLUMNS)))
+        conn.commit()
+        conn.close()
+
+        service = RecommendationService(db_path=db_path, cascade=True)
+        mean, std = service.embedding_scale
+        conn = service.conn
+        changed, added = song_ids[40], rng.random(len(EMBEDDING_COLUMNS)).astype(np.float32)
+        save_embedding(conn.cursor(), changed, added)
+        conn.execute("UPDATE Song SET tempo = tempo + 1 WHERE song_id = ?", (changed,))
+        conn.commit()
+
+        full_loads = []
+        recommendation_service.load_embeddings = lambda *args: full_loads.append(args)
+        try:
+            assert service.refresh(force=True)
+        finally:
+            recommendation_service.load_embeddings = load_embeddings
+        assert not full_loads
+        position = service.positions[changed]
+        assert service.has_embedding[position] and service.has_embedding.sum() == 41
+        assert np.allclose(service.embeddings[position], (added - mean) / std, atol=1e-5)
+        service.conn.close()
+    print("\n✅ Refresh read the changed song's embedding without reloading the table")
+
 async def run_tests():
     """Run all recommendation tests"""
     print("🎧 Starting Recommendation Service Tests")
     print("======================================")
     
-    await test_song_recommendations()
-    await test_artist_recommendations()
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = copy_database(directory)
+        await test_song_recommendations(db_path)
+        await test_artist_recommendations(db_path)
+        await test_single_recommendation(db_path)
+        await test_unknown_artists_are_capped_apart(db_path)
+        await test_calls_leave_the_event_loop_free(db_path)
+    await test_incremental_index()
+    await test_refresh_without_rebuilding()
+    await test_refresh_reads_changed_embeddings()
     
     print("\n🏁 Finished Running All Tests")
 
@@ -4,10 +4,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from typing import List, Optional
 from dotenv import load_dotenv
+import asyncio
 import os
 
 from .services.spotify_import_service import SpotifyImportService
 from .services.recommendation_service import RecommendationService
+from .services.database import close_pools, get_read_executor
+from .services.history import close_history_buffers
+from .services.insights import get_catalog_insights, close_catalog_insights
 
 load_dotenv()
 
@@ -43,15 +47,21 @@ async def startup_event():
     try:
         spotify_service = SpotifyImportService(temp_dir="temp_audio")
         recommendation_service = RecommendationService()
+        # Migrate the database and take the first read snapshot now, off the event loop,
+        # rather than inside the first request that touches the database
+        await asyncio.to_thread(get_read_executor)
+        # Starts syncing the feature store for /database/insights in the background
+        get_catalog_insights()
         
         # Import and include routers after services are initialized
-        from .routes import database_route, recommendations, spotify_import
+        from .routes import database_route, recommendations, spotify_import, history
         
         # Include all routers
         app.include_router(account.router, prefix="/account", tags=["account"])
         app.include_router(database_route.router, prefix="/database", tags=["database"])
         app.include_router(recommendations.router, prefix="/api/v1", tags=["recommendations"])
         app.include_router(spotify_import.router, prefix="/api/v1/spotify", tags=["spotify"])
+        app.include_router(history.router, prefix="/history", tags=["history"])
         
     except Exception as e:
         print(f"Error during startup: {str(e)}")
@@ -61,6 +71,10 @@ async def shutdown_event():
     """Clean up resources when the application shuts down"""
     if spotify_service:
         spotify_service.cleanup()
+    # Write buffered plays before the connections close
+    close_history_buffers()
+    close_catalog_insights()
+    close_pools()
 
 @app.get("/")
 async def root():
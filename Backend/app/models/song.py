@@ -21,17 +21,33 @@ class Song(BaseModel):
     zero_crossing_rate: float
     rms_energy: float
 
-class SongBasedRequest(BaseModel):
+class DiversityOptions(BaseModel):
+    """Optional diversity reranking applied to recommendations"""
+    diversity: Optional[float] = Field(default=None, ge=0, le=1, description="0 = most similar, 1 = most varied")
+    max_per_artist: Optional[int] = Field(default=None, ge=1)
+    max_per_album: Optional[int] = Field(default=None, ge=1)
+
+class RecommendationFilters(BaseModel):
+    """Restrict recommendations to songs matching every given predicate"""
+    genres: Optional[List[str]] = Field(default=None, description="Match any of these genres")
+    min_duration: Optional[float] = Field(default=None, ge=0, description="Seconds")
+    max_duration: Optional[float] = Field(default=None, ge=0, description="Seconds")
+    min_tempo: Optional[float] = Field(default=None, ge=0, description="BPM")
+    max_tempo: Optional[float] = Field(default=None, ge=0, description="BPM")
+
+class SongBasedRequest(DiversityOptions):
     """Request for song-based recommendations"""
     type: Literal["song"] = "song"
     song_id: str
     limit: int = Field(default=10, ge=1, le=50)
+    filters: Optional[RecommendationFilters] = None
 
-class ArtistBasedRequest(BaseModel):
+class ArtistBasedRequest(DiversityOptions):
     """Request for artist-based recommendations"""
     type: Literal["artist"] = "artist"
     artist_id: int
     limit: int = Field(default=10, ge=1, le=50)
+    filters: Optional[RecommendationFilters] = None
 
 class RecommendationRequest(BaseModel):
     """Union type that accepts either song-based or artist-based recommendation requests"""
@@ -39,4 +55,14 @@ class RecommendationRequest(BaseModel):
 
 class RecommendationResponse(BaseModel):
     recommendations: List[Song]
-    metadata: dict 
\ No newline at end of file
+    metadata: dict
+
+class SimilarArtist(BaseModel):
+    id: int
+    name: str
+    song_count: int
+    distance: float
+
+class SimilarArtistsResponse(BaseModel):
+    artists: List[SimilarArtist]
+    metadata: dict
@@ -2,7 +2,6 @@ from fastapi import APIRouter, HTTPException, Query
 from typing import List, Any, Optional
 from pydantic import BaseModel
 import sqlite3
-import os
 from app.services.propagateDB import fetch_and_store_songs
 from app.services.display_database import (
     display_all_artists,
@@ -29,7 +28,7 @@ from fastapi import APIRouter, HTTPException
 from typing import Optional
 from pydantic import BaseModel
 import sqlite3
-import os
+from app.services.database import run_db
 
 router = APIRouter()
 
@@ -44,12 +43,7 @@ class UserResponse(BaseModel):
 
 @router.post("/create", response_model=UserResponse)
 async def create_user(request: UserCreateRequest):
-    conn = None
-    try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-
-        conn = sqlite3.connect(db_path)
+    def create(conn: sqlite3.Connection) -> int:
         cursor = conn.cursor()
 
         cursor.execute("SELECT user_id FROM User WHERE name = ?", (request.name,))
@@ -62,15 +56,14 @@ async def create_user(request: UserCreateRequest):
             (request.name, request.age)
         )
         conn.commit()
+        return cursor.lastrowid
 
-        user_id = cursor.lastrowid
+    try:
+        user_id = await run_db(create)
         return UserResponse(user_id=user_id, name=request.name, age=request.age)
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
@@ -2,11 +2,18 @@
 This file creates the routes for the database.
 '''
 from fastapi import APIRouter, HTTPException, Query, Body, Form, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+import json
 import sqlite3
 import os
 from app.services.propagateDB import fetch_and_store_songs
+from app.services.database import run_db, run_read, fetch_all, fetch_one, read_connection
+from app.services.search import build_match_query, search_artists, search_albums, search_songs
+from app.services.catalog_pages import CATALOGS, fetch_page, iter_catalog, parse_fields
+from app.services.playlists import get_playlist_id, add_songs, remove_songs, replace_songs, place_song
+from app.services.insights import get_catalog_insights
 from app.services.display_database import (
     display_all_artists,
     display_all_albums,
@@ -37,6 +44,8 @@ class SongResponse(BaseModel):
 
 class SongsResponse(BaseModel):
     songs: List[SongResponse]
+    # Cursor of the next page when paginating, None on the last page
+    next_cursor: Optional[str] = None
 
 class ArtistResponse(BaseModel):
     id: str
@@ -46,6 +55,7 @@ class ArtistResponse(BaseModel):
 
 class ArtistsResponse(BaseModel):
     artists: List[ArtistResponse]
+    next_cursor: Optional[str] = None
 
 class AlbumResponse(BaseModel):
     id: str
@@ -58,6 +68,7 @@ class AlbumResponse(BaseModel):
 
 class AlbumsResponse(BaseModel):
     albums: List[AlbumResponse]
+    next_cursor: Optional[str] = None
 
 class DatabaseSummaryResponse(BaseModel):
     total_songs: int
@@ -67,6 +78,41 @@ class DatabaseSummaryResponse(BaseModel):
     average_songs_per_artist: float
     average_songs_per_album: float
 
+class InsightsTotals(BaseModel):
+    artists: int
+    albums: int
+    songs: int
+    analyzed_songs: int
+    average_songs_per_artist: float
+    average_songs_per_album: float
+
+class TopAlbum(BaseModel):
+    id: str
+    name: str
+    artist: Optional[str] = None
+    song_count: int
+
+class GenreCount(BaseModel):
+    genre: Optional[str] = None  # None for songs without a genre
+    song_count: int
+    analyzed_songs: int
+
+class FeatureHistogram(BaseModel):
+    count: int
+    min: Optional[float] = None
+    max: Optional[float] = None
+    mean: Optional[float] = None
+    edges: List[float]  # len(counts) + 1 bin edges
+    counts: List[int]
+
+class InsightsResponse(BaseModel):
+    totals: InsightsTotals
+    top_artists: List[ArtistResponse]
+    top_albums: List[TopAlbum]
+    genres: List[GenreCount]
+    feature_histograms: Optional[Dict[str, FeatureHistogram]] = None  # None until the feature store is exported
+    generated_at: str
+
 class AllDataResponse(BaseModel):
     summary: DatabaseSummaryResponse
     artists: List[ArtistResponse]
@@ -78,6 +124,8 @@ class SearchResults(BaseModel):
     artists: List[ArtistResponse] = []
     albums: List[AlbumResponse] = []
     songs: List[SongResponse] = []
+    # Cursor for the next page of each entity type, None once it is exhausted
+    next_cursors: Dict[str, Optional[str]] = {}
 
 class PlaylistInfo(BaseModel):
     name: str
@@ -89,6 +137,23 @@ class UserPlaylistsResponse(BaseModel):
     username: str
     playlists: List[PlaylistInfo]
 
+MAX_PAGE_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+PAGE_SIZE_DESCRIPTION = "Page size; setting limit, cursor or fields switches to paginated results"
+CURSOR_DESCRIPTION = "next_cursor from the previous page"
+FIELDS_DESCRIPTION = "Comma-separated fields to return, e.g. 'id,name,tempo'"
+
+async def catalog_page(key: str, limit: Optional[int], cursor: Optional[str], fields: Optional[str],
+                       sort_by: Optional[str] = None) -> JSONResponse:
+    """Serve one keyset page of a catalog, skipping per-row response models"""
+    try:
+        rows, next_cursor = await run_read(
+            fetch_page, key, limit or DEFAULT_PAGE_SIZE, cursor, sort_by, parse_fields(key, fields)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({key: rows, "next_cursor": next_cursor})
+
 # Routes
 @router.post("/display_database")
 async def display_database():
@@ -102,16 +167,37 @@ async def display_database():
 async def get_database_summary():
     """Get a summary of the database contents"""
     try:
-        summary = display_database_summary()
+        summary = await run_read(display_database_summary)
         return DatabaseSummaryResponse(**summary)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/insights", response_model=InsightsResponse)
+async def get_insights(
+    top: int = Query(10, ge=1, le=100, description="Number of top artists and albums"),
+    bins: int = Query(20, ge=2, le=200, description="Histogram bins per audio feature")
+):
+    """Catalog insights for dashboards, cached until the catalog changes or INSIGHTS_TTL expires"""
+    insights = get_catalog_insights()
+    cached = insights.cached(top, bins)
+    if cached is not None:
+        return cached
+    try:
+        return await run_db(insights.get, top, bins)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/artists", response_model=ArtistsResponse)
-async def get_all_artists() -> ArtistsResponse:
-    """Get all artists in the database"""
+async def get_all_artists(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description=PAGE_SIZE_DESCRIPTION),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+) -> ArtistsResponse:
+    """Get all artists in the database, or one page of them"""
+    if limit is not None or cursor is not None or fields is not None:
+        return await catalog_page("artists", limit, cursor, fields)
     try:
-        artists_data = display_all_artists()
+        artists_data = await run_read(display_all_artists)
         # Map the database fields to our model fields
         artists = [
             ArtistResponse(
@@ -126,10 +212,16 @@ async def get_all_artists() -> ArtistsResponse:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/albums", response_model=AlbumsResponse)
-async def get_all_albums() -> AlbumsResponse:
-    """Get all albums in the database"""
+async def get_all_albums(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description=PAGE_SIZE_DESCRIPTION),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+) -> AlbumsResponse:
+    """Get all albums in the database, or one page of them"""
+    if limit is not None or cursor is not None or fields is not None:
+        return await catalog_page("albums", limit, cursor, fields)
     try:
-        albums_data = display_all_albums()
+        albums_data = await run_read(display_all_albums)
         # Map the database fields to our model fields
         albums = []
         for album in albums_data:
@@ -153,18 +245,16 @@ async def get_all_albums() -> AlbumsResponse:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/songs", response_model=SongsResponse)
-async def get_songs(sort_by: Optional[str] = Query(None, description="Sort by: 'name_asc', 'name_desc'")):
-    """Get all songs from the database"""
+async def get_songs(
+    sort_by: Optional[str] = Query(None, description="Sort by: 'name_asc', 'name_desc'"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description=PAGE_SIZE_DESCRIPTION),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """Get all songs from the database, or one page of them"""
+    if limit is not None or cursor is not None or fields is not None:
+        return await catalog_page("songs", limit, cursor, fields, sort_by if sort_by in ("name_asc", "name_desc") else None)
     try:
-        # Get the database path
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        
-        # Connect to the database
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Base query
         query = """
             SELECT s.song_id, s.name as song_name, 
@@ -189,26 +279,10 @@ async def get_songs(sort_by: Optional[str] = Query(None, description="Sort by: '
         else:
             query += " ORDER BY s.song_id ASC"  # Default sorting by ID
 
-        cursor.execute(query)
-        
         # Fetch all results
-        songs = cursor.fetchall()
-        
-        def convert_to_float(value):
-            if value is None:
-                return None
-            if isinstance(value, bytes):
-                try:
-                    # Try to convert binary data to float
-                    return float.fromhex(value.hex())
-                except (ValueError, AttributeError):
-                    return None
-            try:
-                return float(value)
-            except (ValueError, TypeError):
-                return None
+        songs = await fetch_all(query, snapshot=True)
         
-        # Convert to list of dictionaries, handling binary data
+        # Convert to list of dictionaries
         result = []
         for song in songs:
             song_dict = {
@@ -217,16 +291,16 @@ async def get_songs(sort_by: Optional[str] = Query(None, description="Sort by: '
                 "artist": song['artist_name'].decode('utf-8', errors='replace') if isinstance(song['artist_name'], bytes) else song['artist_name'],
                 "album": song['album_name'].decode('utf-8', errors='replace') if isinstance(song['album_name'], bytes) else song['album_name'],
                 "album_url": song['album_url'],
-                "duration": convert_to_float(song['duration']),
-                "tempo": convert_to_float(song['tempo']),
-                "spectral_centroid": convert_to_float(song['spectral_centroid']),
-                "spectral_rolloff": convert_to_float(song['spectral_rolloff']),
-                "spectral_contrast": convert_to_float(song['spectral_contrast']),
-                "chroma_mean": convert_to_float(song['chroma_mean']),
-                "chroma_std": convert_to_float(song['chroma_std']),
-                "onset_strength": convert_to_float(song['onset_strength']),
-                "zero_crossing_rate": convert_to_float(song['zero_crossing_rate']),
-                "rms_energy": convert_to_float(song['rms_energy'])
+                "duration": song['duration'],
+                "tempo": song['tempo'],
+                "spectral_centroid": song['spectral_centroid'],
+                "spectral_rolloff": song['spectral_rolloff'],
+                "spectral_contrast": song['spectral_contrast'],
+                "chroma_mean": song['chroma_mean'],
+                "chroma_std": song['chroma_std'],
+                "onset_strength": song['onset_strength'],
+                "zero_crossing_rate": song['zero_crossing_rate'],
+                "rms_energy": song['rms_energy']
             }
             result.append(SongResponse(**song_dict))
         
@@ -234,9 +308,6 @@ async def get_songs(sort_by: Optional[str] = Query(None, description="Sort by: '
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @router.post("/populate")
 async def populate_database():
@@ -251,10 +322,10 @@ async def populate_database():
 async def get_all_data():
     """Get all database contents"""
     try:
-        summary = display_database_summary()
-        artists_data = display_all_artists()
-        albums_data = display_all_albums()
-        songs_data = display_all_songs()
+        summary = await run_read(display_database_summary)
+        artists_data = await run_read(display_all_artists)
+        albums_data = await run_read(display_all_albums)
+        songs_data = await run_read(display_all_songs)
         
         return AllDataResponse(
             summary=DatabaseSummaryResponse(**summary),
@@ -265,161 +336,113 @@ async def get_all_data():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/export")
+async def export_catalog(
+    entities: str = Query("artists,albums,songs", description="Comma-separated catalogs to export, in order")
+) -> StreamingResponse:
+    """Stream the catalog as NDJSON, one {"type": ..., ...fields} object per line"""
+    requested = [entity.strip() for entity in entities.split(",") if entity.strip()]
+    unknown = [entity for entity in requested if entity not in CATALOGS]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"Unknown catalogs {unknown}; choose from {list(CATALOGS)}")
+
+    def stream():
+        # A plain generator is iterated in a worker thread, so reads never block the event loop
+        with read_connection() as conn:
+            # One read transaction, so every catalog comes from the same snapshot
+            conn.execute("BEGIN")
+            for entity in requested:
+                row_type = entity[:-1]
+                for rows in iter_catalog(conn, entity):
+                    yield "".join(json.dumps({"type": row_type, **row}) + "\n" for row in rows)
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="music_catalog.ndjson"'}
+    )
 
 @router.get("/search", response_model=SearchResults)
 async def search_database(
     q: str = Query(..., description="Search query"),
     min_songs: Optional[int] = Query(None, description="Minimum number of songs for artists"),
-    sort_by: Optional[str] = Query(None, description="Sort by: 'song_count_asc', 'song_count_desc', 'name_asc', 'name_desc'"),
-    album_sort: Optional[str] = Query(None, description="Sort albums by: 'song_count_asc', 'song_count_desc', 'name_asc', 'name_desc'"),
-    song_sort: Optional[str] = Query(None, description="Sort songs by: 'name_asc', 'name_desc'")
+    sort_by: Optional[str] = Query(None, description="Sort by: 'relevance' (default), 'song_count_asc', 'song_count_desc', 'name_asc', 'name_desc'"),
+    album_sort: Optional[str] = Query(None, description="Sort albums by: 'relevance' (default), 'song_count_asc', 'song_count_desc', 'name_asc', 'name_desc'"),
+    song_sort: Optional[str] = Query(None, description="Sort songs by: 'relevance' (default), 'name_asc', 'name_desc'"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum results per entity type"),
+    artist_cursor: Optional[str] = Query(None, description="next_cursors.artists from the previous page"),
+    album_cursor: Optional[str] = Query(None, description="next_cursors.albums from the previous page"),
+    song_cursor: Optional[str] = Query(None, description="next_cursors.songs from the previous page")
 ):
-    """Search for matching artists, albums, and songs by name."""
-    try:
-        query = q.lower()
+    """Search for matching artists, albums, and songs by name, matching every word as a prefix."""
+    match = build_match_query(q)
+    if match is None:
+        return SearchResults()
 
-        # Get the database path
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        
-        # Connect to the database
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    # A page that was asked for through its cursor skips the other entity types
+    paging = artist_cursor or album_cursor or song_cursor
 
-        # Get matching artists with song counts
-        artist_query = """
-            SELECT ar.artist_id, ar.name,
-                   COUNT(DISTINCT s.song_id) as song_count
-            FROM Artist ar
-            LEFT JOIN Album al ON ar.artist_id = al.artist_id
-            LEFT JOIN Song s ON al.album_id = s.album_id
-            WHERE LOWER(ar.name) LIKE ?
-            GROUP BY ar.artist_id, ar.name
-        """
-        
-        # Add HAVING clause if min_songs is specified
-        if min_songs is not None:
-            artist_query += f" HAVING song_count >= {min_songs}"
-        
-        # Add ORDER BY clause based on sort_by parameter
-        if sort_by == "song_count_desc":
-            artist_query += " ORDER BY song_count DESC, ar.artist_id ASC"
-        elif sort_by == "song_count_asc":
-            artist_query += " ORDER BY song_count ASC, ar.artist_id ASC"
-        elif sort_by == "name_desc":
-            artist_query += " ORDER BY ar.name DESC, ar.artist_id ASC"
-        elif sort_by == "name_asc":
-            artist_query += " ORDER BY ar.name ASC, ar.artist_id ASC"
-        else:
-            artist_query += " ORDER BY ar.artist_id ASC"  # Default sorting by ID
-        
-        cursor.execute(artist_query, (f"%{query}%",))
-        artists_rows = cursor.fetchall()
-        matching_artists = [
-            ArtistResponse(
-                id=str(row["artist_id"]),
-                name=row["name"],
-                song_count=row["song_count"]
-            )
-            for row in artists_rows
-        ]
+    def search(conn: sqlite3.Connection) -> SearchResults:
+        next_cursors = {}
 
-        # Get matching albums with URLs
-        album_query = """
-            SELECT a.album_id, a.name, ar.name as artist_name, a.album_url,
-                   COUNT(s.song_id) as song_count
-            FROM Album a
-            JOIN Artist ar ON a.artist_id = ar.artist_id
-            LEFT JOIN Song s ON a.album_id = s.album_id
-            WHERE LOWER(a.name) LIKE ?
-            GROUP BY a.album_id, a.name, ar.name, a.album_url
-        """
-
-        # Add ORDER BY clause based on album_sort parameter
-        if album_sort == "song_count_desc":
-            album_query += " ORDER BY song_count DESC, a.album_id ASC"
-        elif album_sort == "song_count_asc":
-            album_query += " ORDER BY song_count ASC, a.album_id ASC"
-        elif album_sort == "name_desc":
-            album_query += " ORDER BY a.name DESC, a.album_id ASC"
-        elif album_sort == "name_asc":
-            album_query += " ORDER BY a.name ASC, a.album_id ASC"
-        else:
-            album_query += " ORDER BY a.album_id ASC"  # Default sorting by ID
-
-        cursor.execute(album_query, (f"%{query}%",))
-        albums_rows = cursor.fetchall()
-        matching_albums = [
-            AlbumResponse(
-                id=str(row["album_id"]),
-                name=row["name"],
-                artist=row["artist_name"],
-                url=row["album_url"],
-                song_count=row["song_count"]
+        matching_artists = []
+        if not paging or artist_cursor:
+            rows, next_cursors["artists"] = search_artists(
+                conn, match, limit, artist_cursor, sort_by, min_songs
             )
-            for row in albums_rows
-        ]
-
-        # Get matching songs with album URLs
-        song_query = """
-            SELECT s.song_id, s.name as song_name, 
-                   ar.name as artist_name, 
-                   al.name as album_name,
-                   al.album_url as album_url,
-                   s.duration
-            FROM Song s
-            JOIN Album al ON s.album_id = al.album_id
-            JOIN Artist ar ON al.artist_id = ar.artist_id
-            WHERE LOWER(s.name) LIKE ?
-        """
-
-        # Add ORDER BY clause based on song_sort parameter
-        if song_sort == "name_desc":
-            song_query += " ORDER BY s.name DESC, s.song_id ASC"
-        elif song_sort == "name_asc":
-            song_query += " ORDER BY s.name ASC, s.song_id ASC"
-        else:
-            song_query += " ORDER BY s.song_id ASC"  # Default sorting by ID
-
-        cursor.execute(song_query, (f"%{query}%",))
-        songs_rows = cursor.fetchall()
-        matching_songs = [
-            SongResponse(
-                id=str(row["song_id"]),
-                name=row["song_name"],
-                artist=row["artist_name"],
-                album=row["album_name"],
-                album_url=row["album_url"],
-                duration=row["duration"]
-            )
-            for row in songs_rows
-        ]
+            matching_artists = [
+                ArtistResponse(id=str(row["id"]), name=row["name"], song_count=row["song_count"])
+                for row in rows
+            ]
+
+        matching_albums = []
+        if not paging or album_cursor:
+            rows, next_cursors["albums"] = search_albums(conn, match, limit, album_cursor, album_sort)
+            matching_albums = [
+                AlbumResponse(
+                    id=str(row["id"]),
+                    name=row["name"],
+                    artist=row["artist_name"],
+                    url=row["album_url"],
+                    song_count=row["song_count"]
+                )
+                for row in rows
+            ]
+
+        matching_songs = []
+        if not paging or song_cursor:
+            rows, next_cursors["songs"] = search_songs(conn, match, limit, song_cursor, song_sort)
+            matching_songs = [
+                SongResponse(
+                    id=str(row["id"]),
+                    name=row["name"],
+                    artist=row["artist_name"],
+                    album=row["album_name"],
+                    album_url=row["album_url"],
+                    duration=row["duration"]
+                )
+                for row in rows
+            ]
 
         return SearchResults(
             artists=matching_artists,
             albums=matching_albums,
-            songs=matching_songs
+            songs=matching_songs,
+            next_cursors=next_cursors
         )
 
+    try:
+        return await run_read(search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if 'conn' in locals():
-            conn.close()
     
 @router.get("/albums/{album_id}/songs", response_model=AlbumResponse)
 async def get_songs_by_album(album_id: int):
     """Get all songs that belong to a specific album by album ID"""
     try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("""
+        songs = await fetch_all("""
             SELECT s.song_id, s.name as song_name, 
                    ar.name as artist_name, 
                    al.name as album_name,
@@ -433,22 +456,7 @@ async def get_songs_by_album(album_id: int):
             JOIN Album al ON s.album_id = al.album_id
             JOIN Artist ar ON al.artist_id = ar.artist_id
             WHERE s.album_id = ?
-        """, (album_id,))
-
-        songs = cursor.fetchall()
-
-        def convert_to_float(value):
-            if value is None:
-                return None
-            if isinstance(value, bytes):
-                try:
-                    return float.fromhex(value.hex())
-                except Exception:
-                    return None
-            try:
-                return float(value)
-            except Exception:
-                return None
+        """, (album_id,), snapshot=True)
 
         result = []
         for row in songs:
@@ -458,16 +466,16 @@ async def get_songs_by_album(album_id: int):
                 "album": row["album_name"],
                 "artist": row["artist_name"],
                 "album_url": row["album_url"],
-                "duration": convert_to_float(row["duration"]),
-                "tempo": convert_to_float(row["tempo"]),
-                "spectral_centroid": convert_to_float(row["spectral_centroid"]),
-                "spectral_rolloff": convert_to_float(row["spectral_rolloff"]),
-                "spectral_contrast": convert_to_float(row["spectral_contrast"]),
-                "chroma_mean": convert_to_float(row["chroma_mean"]),
-                "chroma_std": convert_to_float(row["chroma_std"]),
-                "onset_strength": convert_to_float(row["onset_strength"]),
-                "zero_crossing_rate": convert_to_float(row["zero_crossing_rate"]),
-                "rms_energy": convert_to_float(row["rms_energy"])
+                "duration": row["duration"],
+                "tempo": row["tempo"],
+                "spectral_centroid": row["spectral_centroid"],
+                "spectral_rolloff": row["spectral_rolloff"],
+                "spectral_contrast": row["spectral_contrast"],
+                "chroma_mean": row["chroma_mean"],
+                "chroma_std": row["chroma_std"],
+                "onset_strength": row["onset_strength"],
+                "zero_crossing_rate": row["zero_crossing_rate"],
+                "rms_energy": row["rms_energy"]
             }
             result.append(SongResponse(**song_dict))
 
@@ -481,40 +489,28 @@ async def get_songs_by_album(album_id: int):
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.get("/playlists", response_model=UserPlaylistsResponse)
 async def get_user_playlists(username: str = Query(..., description="Username to look up playlists")):
-    conn = None
     try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
         # First check if user exists
-        cursor.execute("SELECT user_id FROM User WHERE name = ?", (username,))
-        user_row = cursor.fetchone()
+        user_row = await fetch_one("SELECT user_id FROM User WHERE name = ?", (username,))
         if not user_row:
             raise HTTPException(status_code=404, detail=f"User '{username}' not found")
 
         user_id = user_row["user_id"]
 
         # Get all playlists for the user
-        cursor.execute("""
-            SELECT p.name, p.date_created, p.image_url, COUNT(ps.song_id) as song_count
+        rows = await fetch_all("""
+            SELECT p.name, p.date_created, p.image_url, COALESCE(st.song_count, 0) as song_count
             FROM Playlist p
-            LEFT JOIN Playlist_Song ps ON p.user_id = ps.user_id AND p.name = ps.playlist_name
+            LEFT JOIN Playlist_Stats st ON st.playlist_id = p.playlist_id
             WHERE p.user_id = ?
-            GROUP BY p.name, p.date_created, p.image_url
             ORDER BY p.date_created DESC
         """, (user_id,))
 
         playlists = []
-        for row in cursor.fetchall():
+        for row in rows:
             try:
                 playlist = PlaylistInfo(
                     name=row["name"],
@@ -533,9 +529,6 @@ async def get_user_playlists(username: str = Query(..., description="Username to
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching playlists: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
 @router.get("/playlists/songs", response_model=List[SongResponse])
 async def get_songs_from_playlist(
@@ -544,29 +537,23 @@ async def get_songs_from_playlist(
 ):
     """Fetch all songs from a given playlist for a user"""
     try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT user_id FROM User WHERE name = ?", (username,))
-        user_row = cursor.fetchone()
+        user_row = await fetch_one("SELECT user_id FROM User WHERE name = ?", (username,))
         if not user_row:
             raise HTTPException(status_code=404, detail="User not found")
         user_id = user_row["user_id"]
 
-        cursor.execute("""
+        rows = await fetch_all("""
             SELECT s.song_id, s.name AS song_name, ar.name AS artist_name, 
                    al.name AS album_name, al.album_url AS album_url, s.duration
-            FROM Playlist_Song ps
+            FROM Playlist p
+            JOIN Playlist_Song ps ON ps.playlist_id = p.playlist_id
             JOIN Song s ON ps.song_id = s.song_id
             JOIN Album al ON s.album_id = al.album_id
             JOIN Artist ar ON al.artist_id = ar.artist_id
-            WHERE ps.user_id = ? AND ps.playlist_name = ?
+            WHERE p.user_id = ? AND p.name = ?
+            ORDER BY ps.position
         """, (user_id, playlist_name))
 
-        rows = cursor.fetchall()
         songs = [
             SongResponse(
                 id=str(row["song_id"]),
@@ -583,8 +570,6 @@ async def get_songs_from_playlist(
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.delete("/playlists")
 async def delete_playlist(
@@ -592,11 +577,7 @@ async def delete_playlist(
     playlist_name: str = Query(..., description="Name of the playlist to delete")
 ):
     """Delete a playlist and all its songs"""
-    conn = None
-    try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        conn = sqlite3.connect(db_path)
+    def delete(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # Get user_id
@@ -606,13 +587,7 @@ async def delete_playlist(
             raise HTTPException(status_code=404, detail=f"User '{username}' not found")
         user_id = user_row[0]
 
-        # Delete playlist songs first (due to foreign key constraint)
-        cursor.execute("""
-            DELETE FROM Playlist_Song 
-            WHERE user_id = ? AND playlist_name = ?
-        """, (user_id, playlist_name))
-
-        # Delete playlist
+        # Delete playlist (a trigger removes its songs)
         cursor.execute("""
             DELETE FROM Playlist 
             WHERE user_id = ? AND name = ?
@@ -622,62 +597,112 @@ async def delete_playlist(
             raise HTTPException(status_code=404, detail="Playlist not found")
 
         conn.commit()
+
+    try:
+        await run_db(delete)
         return {"message": "Playlist deleted successfully"}
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting playlist: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+
+def find_playlist(conn: sqlite3.Connection, username: str, playlist_name: str) -> int:
+    """The playlist_id of a user's playlist, or a 404"""
+    user_row = conn.execute("SELECT user_id FROM User WHERE name = ?", (username,)).fetchone()
+    if not user_row:
+        raise HTTPException(status_code=404, detail=f"User '{username}' not found")
+    playlist_id = get_playlist_id(conn, user_row[0], playlist_name)
+    if playlist_id is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return playlist_id
+
+def count_statuses(results: List[Dict[str, str]]) -> Dict[str, int]:
+    """How many requested IDs ended with each status"""
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return counts
 
 @router.post("/playlists/songs")
 async def add_songs_to_playlist(
     username: str = Query(..., description="Username of the playlist owner"),
     playlist_name: str = Query(..., description="Name of the playlist"),
-    song_ids: List[str] = Body(..., description="List of song IDs to add")
+    song_ids: List[str] = Body(..., description="List of song IDs to add"),
+    position: Optional[int] = Query(None, ge=0, description="Insert the songs at this index instead of at the end")
 ):
-    """Add songs to an existing playlist"""
-    conn = None
+    """Add songs to an existing playlist, reporting what happened to each ID"""
+    def add(conn: sqlite3.Connection):
+        results = add_songs(conn, find_playlist(conn, username, playlist_name), song_ids, position)
+        conn.commit()
+        return results
+
     try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        results = await run_db(add)
+        counts = count_statuses(results)
+        return {
+            "message": f"Added {counts.get('added', 0)} songs to playlist successfully",
+            "counts": counts,
+            "results": results
+        }
 
-        # Get user_id
-        cursor.execute("SELECT user_id FROM User WHERE name = ?", (username,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            raise HTTPException(status_code=404, detail=f"User '{username}' not found")
-        user_id = user_row[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding songs to playlist: {str(e)}")
 
-        # Verify playlist exists
-        cursor.execute("""
-            SELECT 1 FROM Playlist 
-            WHERE user_id = ? AND name = ?
-        """, (user_id, playlist_name))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Playlist not found")
+@router.delete("/playlists/songs")
+async def remove_songs_from_playlist(
+    username: str = Query(..., description="Username of the playlist owner"),
+    playlist_name: str = Query(..., description="Name of the playlist"),
+    song_ids: List[str] = Body(..., description="List of song IDs to remove")
+):
+    """Remove songs from a playlist, reporting what happened to each ID"""
+    def remove(conn: sqlite3.Connection):
+        results = remove_songs(conn, find_playlist(conn, username, playlist_name), song_ids)
+        conn.commit()
+        return results
 
-        # Add each song to the playlist
-        for song_id in song_ids:
-            cursor.execute("""
-                INSERT OR IGNORE INTO Playlist_Song (user_id, playlist_name, song_id)
-                VALUES (?, ?, ?)
-            """, (user_id, playlist_name, song_id))
+    try:
+        results = await run_db(remove)
+        counts = count_statuses(results)
+        return {
+            "message": f"Removed {counts.get('removed', 0)} songs from playlist successfully",
+            "counts": counts,
+            "results": results
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error removing songs from playlist: {str(e)}")
 
+@router.put("/playlists/songs")
+async def replace_playlist_songs(
+    username: str = Query(..., description="Username of the playlist owner"),
+    playlist_name: str = Query(..., description="Name of the playlist"),
+    song_ids: List[str] = Body(..., description="The playlist's new songs, in order")
+):
+    """Replace the songs of a playlist, reporting what happened to each ID"""
+    def replace(conn: sqlite3.Connection):
+        results = replace_songs(conn, find_playlist(conn, username, playlist_name), song_ids)
         conn.commit()
-        return {"message": f"Added {len(song_ids)} songs to playlist successfully"}
+        return results
+
+    try:
+        results, dropped = await run_db(replace)
+        counts = count_statuses(results)
+        return {
+            "message": f"Playlist now has {counts.get('added', 0) + counts.get('kept', 0)} songs",
+            "counts": counts,
+            "removed": dropped,
+            "results": results
+        }
 
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error adding songs to playlist: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+        raise HTTPException(status_code=500, detail=f"Error replacing playlist songs: {str(e)}")
 
 @router.put("/playlists/rename")
 async def rename_playlist(
@@ -686,11 +711,7 @@ async def rename_playlist(
     new_name: str = Query(..., description="New playlist name")
 ):
     """Rename an existing playlist"""
-    conn = None
-    try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        conn = sqlite3.connect(db_path)
+    def rename(conn: sqlite3.Connection):
         cursor = conn.cursor()
 
         # Get user_id
@@ -708,30 +729,48 @@ async def rename_playlist(
         if cursor.fetchone():
             raise HTTPException(status_code=400, detail=f"Playlist name '{new_name}' already exists")
 
-        # Update playlist name
+        # Update playlist name (songs reference the playlist by playlist_id)
         cursor.execute("""
             UPDATE Playlist 
             SET name = ?
             WHERE user_id = ? AND name = ?
         """, (new_name, user_id, old_name))
 
-        # Also update the name in Playlist_Song table
-        cursor.execute("""
-            UPDATE Playlist_Song 
-            SET playlist_name = ?
-            WHERE user_id = ? AND playlist_name = ?
-        """, (new_name, user_id, old_name))
-
         conn.commit()
+
+    try:
+        await run_db(rename)
         return {"message": f"Playlist renamed from '{old_name}' to '{new_name}'"}
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error renaming playlist: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+
+@router.put("/playlists/songs/move")
+async def move_playlist_song(
+    username: str = Query(..., description="Username of the playlist owner"),
+    playlist_name: str = Query(..., description="Name of the playlist"),
+    song_id: str = Query(..., description="Song to move"),
+    position: int = Query(..., ge=0, description="New index of the song (0 = first)")
+):
+    """Move a song of a playlist to a new index"""
+    def move(conn: sqlite3.Connection):
+        playlist_id = find_playlist(conn, username, playlist_name)
+        # place_song checks membership under the write lock and never inserts
+        if not place_song(conn, playlist_id, song_id, position):
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="Song is not in the playlist")
+        conn.commit()
+
+    try:
+        await run_db(move)
+        return {"message": f"Moved song {song_id} to position {position}"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error moving playlist song: {str(e)}")
 
 @router.post("/playlists/image")
 async def upload_playlist_image(
@@ -740,11 +779,9 @@ async def upload_playlist_image(
     image: UploadFile = File(...)
 ):
     """Upload an image for a playlist"""
-    conn = None
-    try:
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        conn = sqlite3.connect(db_path)
+    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+    def save_image(conn: sqlite3.Connection, content: bytes) -> str:
         cursor = conn.cursor()
 
         # Get user_id
@@ -773,7 +810,6 @@ async def upload_playlist_image(
         
         # Save the file
         with open(file_path, "wb") as buffer:
-            content = await image.read()
             buffer.write(content)
         
         # Update the playlist with the image URL
@@ -785,12 +821,14 @@ async def upload_playlist_image(
         """, (image_url, user_id, playlist_name))
         
         conn.commit()
+        return image_url
+
+    try:
+        content = await image.read()
+        image_url = await run_db(save_image, content)
         return {"image_url": image_url}
 
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading playlist image: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error uploading playlist image: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,77 @@
+'''
+This file creates the routes for listening history.
+'''
+from fastapi import APIRouter, HTTPException, Query, Body
+from pydantic import BaseModel
+from typing import List, Optional, Union
+from datetime import datetime
+from app.services.database import fetch_one, fetch_all, fits_sqlite_integer
+from app.services.history import get_history_buffer, format_played_at
+
+router = APIRouter()
+
+class PlayEvent(BaseModel):
+    song_id: str
+    played_at: Optional[datetime] = None  # Defaults to the time the event is received
+
+class RecordPlaysResponse(BaseModel):
+    accepted: int
+    pending: int
+
+class PlayResponse(BaseModel):
+    song_id: str
+    name: str
+    played_at: str
+
+@router.post("/plays", response_model=RecordPlaysResponse, status_code=202)
+async def record_plays(
+    username: str = Query(..., description="Username of the listener"),
+    events: Union[PlayEvent, List[PlayEvent]] = Body(..., description="One play event or a list of them")
+):
+    """Queue play events; they are written to History within about a second"""
+    events = events if isinstance(events, list) else [events]
+    user_row = await fetch_one("SELECT user_id FROM User WHERE name = ?", (username,))
+    if not user_row:
+        raise HTTPException(status_code=404, detail=f"User '{username}' not found")
+
+    rows = []
+    for event in events:
+        try:
+            song_id = int(event.song_id)
+        except ValueError:
+            song_id = None
+        if song_id is None or not fits_sqlite_integer(song_id):
+            raise HTTPException(status_code=422, detail=f"Invalid song ID '{event.song_id}'")
+        rows.append((user_row["user_id"], song_id, format_played_at(event.played_at)))
+
+    buffer = get_history_buffer()
+    if not buffer.submit(rows):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many plays are waiting to be written, retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    return RecordPlaysResponse(accepted=len(rows), pending=buffer.pending())
+
+@router.get("/plays", response_model=List[PlayResponse])
+async def get_recent_plays(
+    username: str = Query(..., description="Username of the listener"),
+    limit: int = Query(50, ge=1, le=500, description="Number of plays to return")
+):
+    """A user's most recent plays that have been written, newest first"""
+    user_row = await fetch_one("SELECT user_id FROM User WHERE name = ?", (username,))
+    if not user_row:
+        raise HTTPException(status_code=404, detail=f"User '{username}' not found")
+
+    rows = await fetch_all("""
+        SELECT h.song_id, s.name, h.played_at
+        FROM History h
+        JOIN Song s ON h.song_id = s.song_id
+        WHERE h.user_id = ?
+        ORDER BY h.played_at DESC
+        LIMIT ?
+    """, (user_row["user_id"], limit))
+    return [
+        PlayResponse(song_id=str(row["song_id"]), name=row["name"], played_at=str(row["played_at"]))
+        for row in rows
+    ]
@@ -1,22 +1,27 @@
 '''
 This file creates the routes for the recommendations and song retrieval.
 '''
-from fastapi import APIRouter, HTTPException, Query, Body
+from fastapi import APIRouter, HTTPException, Query, Body, Depends
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import sqlite3
 import random
-import os
 from typing import Dict, Any
 from datetime import datetime
 from app.models.song import (
     Song,
     RecommendationRequest,
     RecommendationResponse,
+    RecommendationFilters,
+    SimilarArtistsResponse,
     SongBasedRequest,
     ArtistBasedRequest
 )
 from app.services.recommendation_service import RecommendationService
+from app.services.database import run_db, fetch_one
+from app.services.playlists import add_songs
 
 router = APIRouter()
 
@@ -37,6 +42,23 @@ class GenerateArtistPlaylistRequest(BaseModel):
     name: str
     limit: Optional[int] = 10
 
+def recommendation_filters(
+    genre: Optional[List[str]] = Query(None, description="Only recommend songs of these genres"),
+    min_duration: Optional[float] = Query(None, ge=0),
+    max_duration: Optional[float] = Query(None, ge=0),
+    min_tempo: Optional[float] = Query(None, ge=0),
+    max_tempo: Optional[float] = Query(None, ge=0)
+) -> Optional[RecommendationFilters]:
+    """Collect the filter query parameters shared by the GET recommendation routes"""
+    filters = RecommendationFilters(
+        genres=genre,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        min_tempo=min_tempo,
+        max_tempo=max_tempo
+    )
+    return filters if filters.model_dump(exclude_none=True) else None
+
 @router.post("/recommendations", response_model=RecommendationResponse)
 async def get_recommendations(request: RecommendationRequest):
     """Get recommendations based on either a song or an artist"""
@@ -47,12 +69,20 @@ async def get_recommendations(request: RecommendationRequest):
         if isinstance(request.request, SongBasedRequest):
             recommendations = await recommendation_service.get_recommendations_by_song(
                 song_id=request.request.song_id,
-                limit=request.request.limit
+                limit=request.request.limit,
+                diversity=request.request.diversity,
+                max_per_artist=request.request.max_per_artist,
+                max_per_album=request.request.max_per_album,
+                filters=request.request.filters
             )
         else:  # ArtistBasedRequest
             recommendations = await recommendation_service.get_recommendations_by_artist(
                 artist_id=request.request.artist_id,
-                limit=request.request.limit
+                limit=request.request.limit,
+                diversity=request.request.diversity,
+                max_per_artist=request.request.max_per_artist,
+                max_per_album=request.request.max_per_album,
+                filters=request.request.filters
             )
         return recommendations
     except ValueError as e:
@@ -62,6 +92,17 @@ async def get_recommendations(request: RecommendationRequest):
         # For unexpected errors
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/recommendations/cache")
+async def get_recommendation_cache_stats() -> Dict[str, Any]:
+    """Get the hit ratio and memory size of the recommendation cache"""
+    if not recommendation_service:
+        raise HTTPException(status_code=503, detail="Recommendation service not initialized")
+
+    return {
+        "index_version": recommendation_service.index_version,
+        **recommendation_service.cache.stats()
+    }
+
 @router.get("/songs/{song_id}", response_model=Song)
 async def get_song(song_id: str):
     """Get a specific song by ID"""
@@ -77,13 +118,22 @@ async def get_song(song_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/song/{song_id}")
-async def get_song_recommendations(song_id: str, limit: Optional[int] = 10) -> RecommendationResponse:
+async def get_song_recommendations(
+    song_id: str,
+    limit: Optional[int] = 10,
+    diversity: Optional[float] = Query(None, ge=0, le=1, description="0 = most similar, 1 = most varied"),
+    max_per_artist: Optional[int] = Query(None, ge=1),
+    max_per_album: Optional[int] = Query(None, ge=1),
+    filters: Optional[RecommendationFilters] = Depends(recommendation_filters)
+) -> RecommendationResponse:
     """Get recommendations based on a specific song"""
     if not recommendation_service:
         raise HTTPException(status_code=503, detail="Recommendation service not initialized")
     
     try:
-        result = await recommendation_service.get_recommendations_by_song(song_id, limit)
+        result = await recommendation_service.get_recommendations_by_song(
+            song_id, limit, diversity, max_per_artist, max_per_album, filters
+        )
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -91,19 +141,88 @@ async def get_song_recommendations(song_id: str, limit: Optional[int] = 10) -> R
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/artist/{artist_id}")
-async def get_artist_recommendations(artist_id: int, limit: Optional[int] = 10) -> RecommendationResponse:
+async def get_artist_recommendations(
+    artist_id: int,
+    limit: Optional[int] = 10,
+    diversity: Optional[float] = Query(None, ge=0, le=1, description="0 = most similar, 1 = most varied"),
+    max_per_artist: Optional[int] = Query(None, ge=1),
+    max_per_album: Optional[int] = Query(None, ge=1),
+    filters: Optional[RecommendationFilters] = Depends(recommendation_filters)
+) -> RecommendationResponse:
     """Get recommendations based on an artist's style"""
     if not recommendation_service:
         raise HTTPException(status_code=503, detail="Recommendation service not initialized")
     
     try:
-        result = await recommendation_service.get_recommendations_by_artist(artist_id, limit)
+        result = await recommendation_service.get_recommendations_by_artist(
+            artist_id, limit, diversity, max_per_artist, max_per_album, filters
+        )
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/playlist/recommendations")
+async def get_playlist_recommendations(
+    username: str = Query(..., description="Username of the playlist owner"),
+    playlist_name: str = Query(..., description="Name of the playlist to continue"),
+    limit: int = Query(10, ge=1, le=100),
+    centroids: int = Query(1, ge=1, le=10, description="Number of style clusters to seed from"),
+    filters: Optional[RecommendationFilters] = Depends(recommendation_filters)
+) -> RecommendationResponse:
+    """Get songs that continue a playlist, never repeating songs already in it"""
+    if not recommendation_service:
+        raise HTTPException(status_code=503, detail="Recommendation service not initialized")
+
+    try:
+        return await recommendation_service.get_recommendations_by_playlist(
+            username, playlist_name, limit, centroids, filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/radio/{song_id}")
+async def get_radio_station(
+    song_id: str,
+    length: int = Query(100, ge=1, le=5000),
+    seed_weight: float = Query(0.3, ge=0, le=1, description="0 = free walk, 1 = stay close to the seed"),
+    artist_spacing: int = Query(0, ge=0, le=50, description="Songs before an artist may repeat"),
+    filters: Optional[RecommendationFilters] = Depends(recommendation_filters)
+) -> StreamingResponse:
+    """Stream a long radio station seeded by a song, one JSON song per line"""
+    if not recommendation_service:
+        raise HTTPException(status_code=503, detail="Recommendation service not initialized")
+
+    try:
+        batches = await recommendation_service.generate_radio(
+            song_id, length, seed_weight, artist_spacing, filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def stream():
+        # Each batch walks the index and reads SQLite, so it is produced on a worker thread
+        async for songs in iterate_in_threadpool(batches):
+            yield "".join(song.model_dump_json() + "\n" for song in songs)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/artist/{artist_id}/similar")
+async def get_similar_artists(artist_id: int, limit: Optional[int] = 10) -> SimilarArtistsResponse:
+    """Get the artists most similar to an artist's style"""
+    if not recommendation_service:
+        raise HTTPException(status_code=503, detail="Recommendation service not initialized")
+
+    try:
+        return await recommendation_service.get_similar_artists(artist_id, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/songs/generate")
 async def make_song_recommendations(
     request: GenerateSongPlaylistRequest
@@ -114,7 +233,6 @@ async def make_song_recommendations(
     name = request.name
     limit = request.limit
 
-    conn = None
     try:
         # Get recommendations and base song
         recommendations_response = await recommendation_service.get_recommendations_by_song(song_id, limit=limit)
@@ -125,47 +243,43 @@ async def make_song_recommendations(
 
         songs = [base_song] + recommendations_response.recommendations
 
-        # Connect to DB
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Get user_id
-        cursor.execute("SELECT user_id FROM User WHERE name = ?", (username,))
-        row = cursor.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail=f"User '{username}' not found")
-        
-        user_id = row[0]
-
-        # Check if playlist name already exists and generate a unique name if needed
-        original_name = name
-        counter = 1
-        while True:
-            cursor.execute("""
-                SELECT 1 FROM Playlist 
-                WHERE user_id = ? AND name = ?
-            """, (user_id, name))
-            if not cursor.fetchone():
-                break
-            name = f"{original_name} ({counter})"
-            counter += 1
-
-        # Insert playlist
-        cursor.execute("""
-            INSERT INTO Playlist (user_id, name, date_created)
-            VALUES (?, ?, ?)
-        """, (user_id, name, datetime.now()))
-
-        # Insert songs into playlist
-        for song in songs:
+        def store(conn: sqlite3.Connection, name: str):
+            cursor = conn.cursor()
+
+            # Get user_id
+            cursor.execute("SELECT user_id FROM User WHERE name = ?", (username,))
+            row = cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail=f"User '{username}' not found")
+            
+            user_id = row[0]
+
+            # Check if playlist name already exists and generate a unique name if needed
+            original_name = name
+            counter = 1
+            while True:
+                cursor.execute("""
+                    SELECT 1 FROM Playlist 
+                    WHERE user_id = ? AND name = ?
+                """, (user_id, name))
+                if not cursor.fetchone():
+                    break
+                name = f"{original_name} ({counter})"
+                counter += 1
+
+            # Insert playlist
             cursor.execute("""
-                INSERT INTO Playlist_Song (user_id, playlist_name, song_id)
+                INSERT INTO Playlist (user_id, name, date_created)
                 VALUES (?, ?, ?)
-            """, (user_id, name, song.id))
-        
-        conn.commit()
+            """, (user_id, name, datetime.now()))
+
+            # Insert songs into playlist, in recommendation order
+            add_songs(conn, cursor.lastrowid, [song.id for song in songs])
+            
+            conn.commit()
+            return user_id, name
+
+        user_id, name = await run_db(store, name)
 
         return {
             "playlist": {
@@ -183,9 +297,6 @@ async def make_song_recommendations(
         raise HTTPException(status_code=400, detail=f"Failed to store playlist: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating playlist: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
 
 @router.post("/artists/generate")
 async def make_artist_recommendations(request: GenerateArtistPlaylistRequest):
@@ -196,18 +307,11 @@ async def make_artist_recommendations(request: GenerateArtistPlaylistRequest):
         raise HTTPException(status_code=503, detail="Recommendation service not initialized")
 
     try:
-        # Connect to DB
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
         playlist_name = f"{request.name} #{random.randint(1000, 9999)}"
-        print("Connecting to DB:", db_path)
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
 
         # Get artist_id
         print("Looking up artist:", request.artist_name)
-        cursor.execute("SELECT artist_id FROM Artist WHERE name = ?", (request.artist_name,))
-        artist_row = cursor.fetchone()
+        artist_row = await fetch_one("SELECT artist_id FROM Artist WHERE name = ?", (request.artist_name,))
         if not artist_row:
             print("Artist not found:", request.artist_name)
             raise ValueError("Artist not found")
@@ -216,8 +320,7 @@ async def make_artist_recommendations(request: GenerateArtistPlaylistRequest):
 
         # Get user_id
         print("Looking up user:", request.username)
-        cursor.execute("SELECT user_id FROM User WHERE name = ?", (request.username,))
-        user_row = cursor.fetchone()
+        user_row = await fetch_one("SELECT user_id FROM User WHERE name = ?", (request.username,))
         if not user_row:
             print("User not found:", request.username)
             raise ValueError("Username not found")
@@ -232,18 +335,18 @@ async def make_artist_recommendations(request: GenerateArtistPlaylistRequest):
 
         # Store playlist
         print("Inserting playlist...")
-        cursor.execute("""
-            INSERT INTO Playlist (user_id, name, date_created)
-            VALUES (?, ?, ?)
-        """, (user_id, request.name, datetime.now()))
-
-        for song in songs:
+        def store(conn: sqlite3.Connection):
+            cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO Playlist_Song (user_id, playlist_name, song_id)
+                INSERT INTO Playlist (user_id, name, date_created)
                 VALUES (?, ?, ?)
-            """, (user_id, request.name, song.id))
+            """, (user_id, request.name, datetime.now()))
+
+            add_songs(conn, cursor.lastrowid, [song.id for song in songs])
+
+            conn.commit()
 
-        conn.commit()
+        await run_db(store)
         print("Playlist inserted successfully.")
 
     except sqlite3.IntegrityError as e:
@@ -255,8 +358,6 @@ async def make_artist_recommendations(request: GenerateArtistPlaylistRequest):
     except Exception as e:
         print("Unhandled Exception:", e)
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
     return {
         "playlist": {
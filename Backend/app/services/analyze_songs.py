@@ -2,7 +2,6 @@
 This file is used to analyze the songs and add features to the database.
 '''
 import os
-import sqlite3
 import time
 import yt_dlp
 from typing import Optional
@@ -14,11 +13,14 @@ os.sys.path.append(project_root)
 
 from Backend.app.services.youtube_downloader import YouTubeDownloader
 from Backend.app.services.audio_analyzer import AudioAnalyzer
+from Backend.app.services.database import connect
+from Backend.app.services.song_embeddings import ensure_embedding_table, embedding_from_features, save_embedding
 
 # Get database connection
 DB_PATH = os.path.join(project_root, "Database/music_app.db")
-conn = sqlite3.connect(DB_PATH)
+conn = connect(DB_PATH)
 cur = conn.cursor()
+ensure_embedding_table(conn)
 
 def get_youtube_url(song_name: str, artist_name: str) -> Optional[str]:
     search_query = f"{song_name} {artist_name} Audio"
@@ -66,6 +68,11 @@ def update_song_features(song_id: int, features: dict):
         zero_crossing_rate = safe_float(features.get('zero_crossing_rate', 0))
         rms_energy = safe_float(features.get('rms_energy', 0))
 
+        # Store the MFCC/chroma embedding first so the Song update below marks the song changed
+        embedding = embedding_from_features(features)
+        if embedding is not None:
+            save_embedding(cur, song_id, embedding)
+
         cur.execute("""
             UPDATE Song SET
                 duration = ?,
@@ -0,0 +1,419 @@
+'''
+This file defines the nearest neighbor index backends used by the recommendation service.
+
+Every backend takes a (n_songs, n_features) matrix of normalized features and answers
+query(vector, k) with (distances, positions) arrays sorted by distance, where a position
+is a row index into the matrix it was built from. An optional boolean exclude mask over
+positions removes songs from the search itself (e.g. the songs already in a playlist), so
+callers get k usable results without over-fetching and filtering afterwards.
+
+IncrementalIndex wraps a backend so songs can be added, changed and removed without
+rebuilding it on every change.
+'''
+from typing import Dict, Optional, Tuple, Type
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+
+def _empty_result() -> Tuple[np.ndarray, np.ndarray]:
+    return np.empty(0), np.empty(0, dtype=np.intp)
+
+def brute_force_query(
+    data: np.ndarray,
+    vector: np.ndarray,
+    k: int,
+    positions: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact k nearest neighbors among the given positions only"""
+    k = min(k, len(positions))
+    if k <= 0:
+        return _empty_result()
+    diff = data[positions] - vector
+    squared = np.einsum("ij,ij->i", diff, diff)
+    top = np.argpartition(squared, k - 1)[:k] if len(positions) > k else np.arange(len(positions))
+    top = top[np.argsort(squared[top])]
+    return np.sqrt(squared[top]), positions[top]
+
+def kmeans(data: np.ndarray, n_clusters: int, n_iter: int = 15, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster the rows of data with Lloyd's k-means.
+
+    Returns:
+        The (n_clusters, n_features) centroids and the cluster label of every row
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(n_clusters, data.shape[0]))
+    centroids = data[rng.choice(data.shape[0], size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(data, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.stack([
+            np.bincount(labels, weights=data[:, j], minlength=n_clusters)
+            for j in range(data.shape[1])
+        ], axis=1)
+        filled = counts > 0
+        # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids, _assign(data, centroids)
+
+def _assign(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 2048) -> np.ndarray:
+    """Return the index of the closest centroid for every row of data"""
+    if data.shape[1] <= 16:
+        # In low dimensions a k-d tree over the centroids beats the dense distance matrix
+        _, labels = cKDTree(centroids).query(data, k=1)
+        return labels
+
+    centroids_t = np.ascontiguousarray(centroids.T, dtype=np.float32)
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids).astype(np.float32)
+    labels = np.empty(data.shape[0], dtype=np.intp)
+    for start in range(0, data.shape[0], chunk_size):
+        # ||x - c||^2 without the ||x||^2 term, which is constant per row
+        scores = data[start:start + chunk_size].astype(np.float32) @ centroids_t
+        scores *= -2.0
+        scores += centroid_norms
+        labels[start:start + chunk_size] = scores.argmin(axis=1)
+    return labels
+
+
+class KDTreeIndex:
+    """Exact nearest neighbor search backed by scipy's k-d tree"""
+
+    name = "k-d tree nearest neighbors"
+    exact = True
+
+    def __init__(self, data: np.ndarray, brute_force_fraction: float = 0.05):
+        self.data = np.ascontiguousarray(data, dtype=np.float64)
+        self.tree = cKDTree(self.data)
+        # Once a masked query would walk this fraction of the tree, scan the allowed rows instead
+        self.brute_force_fraction = brute_force_fraction
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def query(
+        self,
+        vector: np.ndarray,
+        k: int,
+        exclude: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the k nearest positions not in exclude and their euclidean distances"""
+        n = len(self)
+        if exclude is None:
+            k = min(k, n)
+            if k <= 0:
+                return _empty_result()
+            distances, positions = self.tree.query(vector, k=k, p=2)
+            return np.atleast_1d(distances), np.atleast_1d(positions)
+
+        excluded = int(np.count_nonzero(exclude))
+        k = min(k, n - excluded)
+        if k <= 0:
+            return _empty_result()
+
+        # The k + excluded nearest neighbors always hold k allowed ones, so grow k
+        # geometrically from a small guess up to that bound
+        sufficient_k = k + excluded
+        brute_force_k = int(n * self.brute_force_fraction)
+        k_try = min(2 * k, sufficient_k)
+        while k_try < brute_force_k:
+            distances, positions = self.tree.query(vector, k=k_try, p=2)
+            # cKDTree returns scalars for k=1
+            distances, positions = np.atleast_1d(distances), np.atleast_1d(positions)
+            keep = ~exclude[positions]
+            if np.count_nonzero(keep) >= k:
+                return distances[keep][:k], positions[keep][:k]
+            k_try = min(4 * k_try, sufficient_k)
+
+        # The mask removes most of the neighborhood; scanning the allowed rows is cheaper
+        return brute_force_query(self.data, vector, k, np.flatnonzero(~exclude))
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbor search using an inverted file (IVF) index.
+
+    The vectors are clustered with k-means into n_lists cells and stored grouped by
+    cell. A query only scans the n_probe cells whose centroids are closest to it, so
+    n_probe is the recall/latency knob: n_probe == n_lists is an exact brute-force scan.
+    """
+
+    name = "IVF approximate nearest neighbors"
+    exact = False
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        n_iter: int = 15,
+        sample_size: int = 50000,
+        seed: int = 0
+    ):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        n = data.shape[0]
+        if n_lists is None:
+            # ~4 * sqrt(n) cells keeps both the centroid scan and the cell scans small
+            n_lists = int(4 * np.sqrt(n))
+        self.n_lists = max(1, min(n_lists, n))
+        self.n_probe = max(1, n_probe)
+        self.size = n
+
+        self.centroids = self._train_centroids(data, n_iter, sample_size, seed)
+        assignments = _assign(data, self.centroids)
+
+        # Store vectors grouped by cell so each probe is one contiguous slice
+        self.order = np.argsort(assignments, kind="stable")
+        self.vectors = data[self.order]
+        self.norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _train_centroids(self, data: np.ndarray, n_iter: int, sample_size: int, seed: int) -> np.ndarray:
+        """Run k-means on a random sample of the data"""
+        rng = np.random.default_rng(seed)
+        n = data.shape[0]
+        if n > sample_size:
+            data = data[rng.choice(n, size=max(sample_size, self.n_lists), replace=False)]
+        centroids, _ = kmeans(data, self.n_lists, n_iter=n_iter, seed=seed)
+        return centroids
+
+    def query(
+        self,
+        vector: np.ndarray,
+        k: int,
+        exclude: Optional[np.ndarray] = None,
+        n_probe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the (approximate) k nearest positions not in exclude and their euclidean distances"""
+        allowed = self.size if exclude is None else self.size - int(np.count_nonzero(exclude))
+        k = min(k, allowed)
+        if k <= 0:
+            return _empty_result()
+        vector = np.asarray(vector, dtype=np.float64)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+
+        cell_distances = np.einsum("ij,ij->i", self.centroids - vector, self.centroids - vector)
+        cells = np.argsort(cell_distances)
+        sizes = self.offsets[cells + 1] - self.offsets[cells]
+
+        # Probe the closest cells, widening the search until they hold k usable vectors
+        n_probe = max(n_probe, int(np.searchsorted(np.cumsum(sizes), k)) + 1)
+        while True:
+            candidates = np.concatenate([
+                np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells[:n_probe]
+            ])
+            if exclude is not None:
+                candidates = candidates[~exclude[self.order[candidates]]]
+            if candidates.size >= k or n_probe >= self.n_lists:
+                break
+            n_probe = min(self.n_lists, n_probe * 2)
+
+        squared = self.norms[candidates] - 2.0 * self.vectors[candidates] @ vector + vector @ vector
+        if candidates.size > k:
+            top = np.argpartition(squared, k - 1)[:k]
+        else:
+            top = np.arange(candidates.size)
+        top = top[np.argsort(squared[top])]
+        distances = np.sqrt(np.maximum(squared[top], 0.0))
+        return distances, self.order[candidates[top]]
+
+
+INDEX_BACKENDS: Dict[str, Type] = {
+    "kdtree": KDTreeIndex,
+    "ivf": IVFIndex,
+}
+
+
+def build_index(data: np.ndarray, backend: str = "kdtree", **options):
+    """Build a nearest neighbor index over data using the named backend"""
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(
+            f"Unknown index backend '{backend}'. Choose one of: {', '.join(INDEX_BACKENDS)}"
+        )
+    if len(data) == 0:
+        # Nothing to cluster yet; an empty k-d tree answers every query with no results
+        return KDTreeIndex(data)
+    return INDEX_BACKENDS[backend](data, **options)
+
+
+class IncrementalIndex:
+    """
+    A nearest neighbor index that takes added, changed and removed rows without a rebuild.
+
+    The backend index covers the rows as they were when it was built. Rows added or changed
+    since then are pending: the backend skips them, and removed rows, through its exclude
+    mask, while pending rows are searched exactly and merged in. Once pending rows pass
+    rebuild_fraction of the index, a new backend index is built over a copy of the rows on
+    a background thread and swapped in; rows written while it builds stay pending.
+    Positions never move, so removed rows keep theirs until the caller starts a new index.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        backend: str = "kdtree",
+        rebuild_fraction: float = 0.05,
+        min_rebuild_rows: int = 256,
+        background: bool = True,
+        **options
+    ):
+        self.backend = backend
+        self.options = options
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild_rows = min_rebuild_rows
+        # Without background, rebuilds run in the call that made them due (for scripts and tests)
+        self.background = background
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        self.size = data.shape[0]
+        self._rows = data.copy()
+        self._removed = np.zeros(self.size, dtype=bool)
+        self._pending = np.zeros(self.size, dtype=bool)
+        # Rows written since the running rebuild copied them
+        self._dirty = np.zeros(self.size, dtype=bool)
+        # The backend gets its own copy, because rows are overwritten here in place
+        self.built = build_index(self._rows.copy(), backend, **options)
+        self.name, self.exact = self.built.name, self.built.exact
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+        self._builder: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def data(self) -> np.ndarray:
+        """The current rows (a view; it stops following the index once the index grows)"""
+        return self._rows[:self.size]
+
+    @property
+    def removed(self) -> np.ndarray:
+        """Mask of the removed positions"""
+        return self._removed[:self.size]
+
+    def pending_rows(self) -> int:
+        """How many rows are searched exactly because the backend index predates them"""
+        with self._lock:
+            return int(np.count_nonzero(self._pending[:self.size] & ~self._removed[:self.size]))
+
+    def _grow(self, size: int):
+        """Make room for size rows, doubling the capacity so appends stay amortized O(1)"""
+        capacity = self._rows.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        for name in ("_rows", "_removed", "_pending", "_dirty"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, vectors: np.ndarray) -> np.ndarray:
+        """Append rows; returns their positions"""
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, self._rows.shape[1])
+        with self._lock:
+            start, end = self.size, self.size + vectors.shape[0]
+            self._grow(end)
+            self._rows[start:end] = vectors
+            self._removed[start:end] = False
+            self._pending[start:end] = self._dirty[start:end] = True
+            self.size = end
+        self._rebuild_if_due()
+        return np.arange(start, end)
+
+    def update(self, positions: np.ndarray, vectors: np.ndarray):
+        """Overwrite the rows at positions"""
+        positions = np.asarray(positions, dtype=np.intp)
+        with self._lock:
+            self._rows[positions] = vectors
+            self._pending[positions] = self._dirty[positions] = True
+        self._rebuild_if_due()
+
+    def replace(self, data: np.ndarray):
+        """Overwrite every row (e.g. after renormalizing); all are searched exactly until the rebuild"""
+        with self._lock:
+            self._rows[:self.size] = data
+            self._pending[:self.size] = self._dirty[:self.size] = True
+        self._rebuild_if_due()
+
+    def remove(self, positions: np.ndarray):
+        """Leave the rows at positions out of every search from now on"""
+        with self._lock:
+            self._removed[np.asarray(positions, dtype=np.intp)] = True
+
+    def query(
+        self,
+        vector: np.ndarray,
+        k: int,
+        exclude: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the k nearest positions not in exclude and their euclidean distances.
+
+        Rows added after exclude was made (past its end) are excluded too, so a caller
+        holding on to an older mask never sees positions it does not know.
+        """
+        with self._lock:
+            n = self.size
+            skip = self._removed[:n].copy()
+            if exclude is not None:
+                skip[:len(exclude)] |= exclude[:n]
+                skip[len(exclude):] = True
+            pending = self._pending[:n]
+            built_skip = (skip | pending)[:len(self.built)]
+            distances, positions = self.built.query(vector, k, exclude=built_skip if built_skip.any() else None)
+            extra = np.flatnonzero(pending & ~skip)
+            if not len(extra):
+                return distances, positions
+            extra_distances, extra_positions = brute_force_query(self._rows, vector, k, extra)
+
+        distances = np.concatenate([distances, extra_distances])
+        positions = np.concatenate([positions, extra_positions])
+        order = np.argsort(distances, kind="stable")[:k]
+        return distances[order], positions[order]
+
+    def _rebuild_if_due(self):
+        with self._lock:
+            pending = int(np.count_nonzero(self._pending[:self.size]))
+            if self._builder is not None or pending < max(self.min_rebuild_rows, self.rebuild_fraction * self.size):
+                return
+        self.rebuild(wait=not self.background)
+
+    def rebuild(self, wait: bool = True):
+        """
+        Build a new backend index over the current rows and swap it in on a background thread.
+
+        With wait, returns once an index over every row written before the call is in use
+        (after a rebuild that was already running, a second one is needed).
+        """
+        while True:
+            with self._lock:
+                builder, started = self._builder, self._builder is None
+                if started:
+                    snapshot = self._rows[:self.size].copy()
+                    self._dirty[:] = False
+                    builder = threading.Thread(target=self._build, args=(snapshot,), name="index-rebuild", daemon=True)
+                    self._builder = builder
+                    builder.start()
+            if not wait:
+                return
+            builder.join()
+            if started:
+                return
+
+    def _build(self, snapshot: np.ndarray):
+        try:
+            built = build_index(snapshot, self.backend, **self.options)
+        except Exception as e:
+            print(f"Index rebuild failed, still searching the previous index: {e}")
+            built = None
+        with self._lock:
+            self._builder = None
+            if built is None:
+                return
+            self.built = built
+            # Rows written while building are not in the new index yet
+            self._pending[:self.size] = self._dirty[:self.size]
+            self.rebuilds += 1
@@ -0,0 +1,129 @@
+'''
+This file maintains the per-artist centroid matrix used for artist-based recommendations.
+
+Each artist keeps the sum of its songs' raw feature vectors and its song count, so adding,
+updating or removing one song is O(1) and the centroid (mean vector) is always current.
+The arrays keep spare rows and double their capacity when a new artist needs one, so
+adding artists one at a time is amortized O(1) too. A k-d tree over the normalized
+centroids answers "similar artists" queries.
+'''
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Songs whose album has no artist are stored with this artist ID and never get a centroid
+NO_ARTIST = -1
+
+class ArtistCentroids:
+    def __init__(self, n_features: int):
+        self._artist_ids = np.empty(0, dtype=np.int64)
+        self._sums = np.empty((0, n_features))
+        self._counts = np.empty(0, dtype=np.int64)
+        self.size = 0
+        self.rows: Dict[int, int] = {}
+        self.tree: Optional[cKDTree] = None
+        self.tree_rows = np.empty(0, dtype=np.intp)
+
+    @property
+    def artist_ids(self) -> np.ndarray:
+        return self._artist_ids[:self.size]
+
+    @property
+    def sums(self) -> np.ndarray:
+        return self._sums[:self.size]
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self._counts[:self.size]
+
+    def _grow(self, size: int):
+        """Make room for size artists, doubling the capacity so new artists are amortized O(1)"""
+        capacity = self._artist_ids.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        for name in ("_artist_ids", "_sums", "_counts"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    @classmethod
+    def from_songs(cls, song_artist_ids: np.ndarray, features: np.ndarray) -> "ArtistCentroids":
+        """Group a whole feature matrix by artist in one vectorized pass"""
+        centroids = cls(features.shape[1])
+        has_artist = song_artist_ids != NO_ARTIST
+        artist_ids, groups = np.unique(song_artist_ids[has_artist], return_inverse=True)
+        centroids.size = len(artist_ids)
+        centroids._artist_ids = artist_ids.astype(np.int64)
+        centroids._counts = np.bincount(groups, minlength=len(artist_ids)).astype(np.int64)
+        centroids._sums = np.stack([
+            np.bincount(groups, weights=features[has_artist, j], minlength=len(artist_ids))
+            for j in range(features.shape[1])
+        ], axis=1).reshape(len(artist_ids), features.shape[1])
+        centroids.rows = {int(artist_id): row for row, artist_id in enumerate(centroids.artist_ids)}
+        return centroids
+
+    def add(self, artist_id: int, vector: np.ndarray):
+        """Include one song in its artist's centroid"""
+        if artist_id == NO_ARTIST:
+            return
+        row = self.rows.get(artist_id)
+        if row is None:
+            row = self.size
+            self._grow(row + 1)
+            self.size += 1
+            self.rows[artist_id] = row
+            self._artist_ids[row] = artist_id
+        self._sums[row] += vector
+        self._counts[row] += 1
+
+    def remove(self, artist_id: int, vector: np.ndarray):
+        """Remove one song from its artist's centroid"""
+        row = self.rows.get(artist_id)
+        if row is None:
+            return
+        self._sums[row] -= vector
+        self._counts[row] -= 1
+        if self._counts[row] <= 0:
+            # Keep the row so positions stay stable; empty artists are skipped by the tree
+            self._sums[row] = 0.0
+            self._counts[row] = 0
+
+    def centroid(self, artist_id: int) -> Optional[Tuple[np.ndarray, int]]:
+        """Get an artist's mean feature vector and song count"""
+        row = self.rows.get(artist_id)
+        if row is None or self.counts[row] == 0:
+            return None
+        return self.sums[row] / self.counts[row], int(self.counts[row])
+
+    def rebuild_tree(self, normalize: Callable[[np.ndarray], np.ndarray]):
+        """Rebuild the k-d tree over the normalized centroids of every non-empty artist"""
+        self.tree_rows = np.flatnonzero(self.counts > 0)
+        means = self.sums[self.tree_rows] / self.counts[self.tree_rows, None]
+        self.tree = cKDTree(normalize(means)) if len(self.tree_rows) else None
+
+    def similar(
+        self,
+        artist_id: int,
+        limit: int,
+        normalize: Callable[[np.ndarray], np.ndarray]
+    ) -> List[Tuple[int, float, int]]:
+        """
+        Find the artists whose centroids are closest to the given artist's.
+
+        Returns:
+            (artist_id, distance, song_count) tuples, closest first, excluding the artist itself
+        """
+        found = self.centroid(artist_id)
+        if found is None or self.tree is None:
+            return []
+        k = min(limit + 1, len(self.tree_rows))
+        distances, indices = self.tree.query(normalize(found[0]), k=k)
+        results = []
+        for distance, index in zip(np.atleast_1d(distances), np.atleast_1d(indices)):
+            row = self.tree_rows[index]
+            if self.artist_ids[row] == artist_id:
+                continue
+            results.append((int(self.artist_ids[row]), float(distance), int(self.counts[row])))
+        return results[:limit]
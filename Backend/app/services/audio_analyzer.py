@@ -47,6 +47,8 @@ class AudioAnalyzer:
             chroma = librosa.feature.chroma_stft(y=y, sr=sr)
             features['chroma_mean'] = np.mean(chroma)
             features['chroma_std'] = np.std(chroma)
+            for i, pitch_class in enumerate(chroma):
+                features[f'chroma_{i+1}'] = np.mean(pitch_class)
 
             # 5. Onset Strength
             onset_env = librosa.onset.onset_strength(y=y, sr=sr)
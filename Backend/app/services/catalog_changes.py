@@ -0,0 +1,92 @@
+'''
+This file defines the Song change log that lets in-memory indexes refresh incrementally.
+
+Triggers append one row to Song_Change_Log for every insert, update or delete on Song (and
+an update for every song of an album that moves to another artist), so a consumer only has
+to remember the last change_id it applied and can fetch exactly the songs that changed
+since then instead of rescanning the Song table.
+
+Consumers that persist their state (the recommendation index, the feature store) save the
+change they stopped at with save_checkpoint, and maintenance.py prunes the log up to the
+oldest checkpoint. A consumer whose changes were pruned, or whose state was saved for
+another database (database_id), rebuilds from the Song table instead of catching up.
+'''
+import sqlite3
+from typing import List, Tuple
+
+CHANGE_LOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Song_Change_Log (
+        change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        song_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TRIGGER IF NOT EXISTS song_change_log_insert AFTER INSERT ON Song
+    BEGIN
+        INSERT INTO Song_Change_Log (song_id, op) VALUES (NEW.song_id, 'insert');
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS song_change_log_update AFTER UPDATE ON Song
+    BEGIN
+        INSERT INTO Song_Change_Log (song_id, op) VALUES (NEW.song_id, 'update');
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS song_change_log_delete AFTER DELETE ON Song
+    BEGIN
+        INSERT INTO Song_Change_Log (song_id, op) VALUES (OLD.song_id, 'delete');
+    END;
+
+    -- A song's artist comes from its album, so moving an album changes every song on it
+    CREATE TRIGGER IF NOT EXISTS song_change_log_album_artist AFTER UPDATE OF artist_id ON Album
+    WHEN OLD.artist_id IS NOT NEW.artist_id
+    BEGIN
+        INSERT INTO Song_Change_Log (song_id, op)
+        SELECT song_id, 'update' FROM Song WHERE album_id = NEW.album_id;
+    END;
+"""
+
+def ensure_change_log(conn: sqlite3.Connection):
+    """Create the change log table and its triggers if the database does not have them yet"""
+    conn.executescript(CHANGE_LOG_SCHEMA)
+    conn.commit()
+
+def latest_change_id(conn: sqlite3.Connection) -> int:
+    """Get the id of the most recent change, or 0 if nothing changed yet"""
+    row = conn.execute("SELECT MAX(change_id) FROM Song_Change_Log").fetchone()
+    return row[0] or 0
+
+def fetch_changes(conn: sqlite3.Connection, since: int) -> Tuple[List[int], int]:
+    """
+    Get the distinct song IDs changed after the given change_id.
+
+    Returns:
+        The changed song IDs and the change_id to resume from next time
+    """
+    rows = conn.execute("""
+        SELECT song_id, MAX(change_id)
+        FROM Song_Change_Log
+        WHERE change_id > ?
+        GROUP BY song_id
+    """, (since,)).fetchall()
+    if not rows:
+        return [], since
+    return [row[0] for row in rows], max(row[1] for row in rows)
+
+def database_id(conn: sqlite3.Connection) -> str:
+    """Get the random ID the database was given when it was created (migration 10)"""
+    row = conn.execute("SELECT database_id FROM Database_Identity").fetchone()
+    return row[0] if row else ""
+
+def changes_available(conn: sqlite3.Connection, since: int) -> bool:
+    """Whether every change after the given change_id is still in the log (none were pruned)"""
+    row = conn.execute("SELECT MIN(change_id) FROM Song_Change_Log").fetchone()
+    return row[0] is None or since >= row[0] - 1
+
+def save_checkpoint(conn: sqlite3.Connection, consumer: str, change_id: int):
+    """Record the last change a consumer has saved, so older changes can be pruned"""
+    with conn:
+        conn.execute("""
+            INSERT INTO Change_Log_Consumer (name, change_id) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET change_id = excluded.change_id, updated_at = CURRENT_TIMESTAMP
+        """, (consumer, change_id))
@@ -0,0 +1,169 @@
+'''
+This file pages through the artist, album and song catalogs for the list endpoints.
+
+Pages are read with keyset pagination: rows are ordered by the sort columns plus the ID,
+and each page starts strictly after the (sort key, ID) of the previous page's last row, so
+every page costs the same no matter how deep it is. Sort columns must be covered by an
+index, and nullable ones are wrapped in COALESCE: a row value comparison with NULL is never
+true, so rows with a NULL key would otherwise be skipped. Only the requested fields are
+selected, and rows are returned as plain dicts.
+
+Full exports stream each catalog in ID order with fetchmany, holding one batch at a time.
+'''
+import sqlite3
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from app.services.migrations import FEATURE_COLUMNS
+from app.services.search import encode_cursor, decode_cursor
+
+class Catalog(NamedTuple):
+    source: str                     # FROM clause
+    id_column: str                  # Unique tie-breaker for the sort
+    fields: Dict[str, str]          # Response field -> SQL expression
+    default_fields: List[str]       # Fields returned when none are requested
+    sorts: Dict[Optional[str], Tuple[List[str], bool]]  # sort_by -> (columns, descending)
+
+CATALOGS = {
+    "songs": Catalog(
+        source="""Song s
+            JOIN Album al ON s.album_id = al.album_id
+            JOIN Artist ar ON al.artist_id = ar.artist_id""",
+        id_column="s.song_id",
+        fields={
+            "id": "CAST(s.song_id AS TEXT)",
+            "name": "s.name",
+            "artist": "ar.name",
+            "album": "al.name",
+            "album_url": "al.album_url",
+            "genre": "s.genre",
+            **{field: f"s.{field}" for field in FEATURE_COLUMNS}
+        },
+        default_fields=["id", "name", "artist", "album", "album_url", "genre"] + FEATURE_COLUMNS,
+        sorts={
+            None: ([], False),
+            "name_asc": (["COALESCE(s.name, '')"], False),
+            "name_desc": (["COALESCE(s.name, '')"], True),
+        }
+    ),
+    "albums": Catalog(
+        source="Album a JOIN Artist ar ON a.artist_id = ar.artist_id",
+        id_column="a.album_id",
+        fields={
+            "id": "CAST(a.album_id AS TEXT)",
+            "name": "a.name",
+            "artist": "ar.name",
+            "url": "a.album_url",
+            "release_date": "a.date_created",
+            "song_count": "COALESCE((SELECT song_count FROM Album_Stats WHERE album_id = a.album_id), 0)",
+        },
+        default_fields=["id", "name", "artist", "url", "release_date"],
+        # Album name only, so pages come straight from idx_album_page; the unpaginated listing
+        # groups by artist instead
+        sorts={None: (["COALESCE(a.name, '')"], False)}
+    ),
+    "artists": Catalog(
+        source="Artist ar",
+        id_column="ar.artist_id",
+        fields={
+            "id": "CAST(ar.artist_id AS TEXT)",
+            "name": "ar.name",
+            "album_count": "COALESCE((SELECT album_count FROM Artist_Stats WHERE artist_id = ar.artist_id), 0)",
+            "song_count": "COALESCE((SELECT song_count FROM Artist_Stats WHERE artist_id = ar.artist_id), 0)",
+        },
+        default_fields=["id", "name"],
+        sorts={None: (["COALESCE(ar.name, '')"], False)}
+    ),
+}
+
+EXPORT_BATCH_SIZE = 500
+
+def parse_fields(catalog_name: str, fields: Optional[str]) -> List[str]:
+    """Split a comma-separated fields parameter, rejecting fields the catalog does not have"""
+    catalog = CATALOGS[catalog_name]
+    if not fields:
+        return list(catalog.default_fields)
+    requested = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in requested if field not in catalog.fields]
+    if unknown or not requested:
+        raise ValueError(f"Unknown fields {unknown}; choose from {list(catalog.fields)}")
+    return requested
+
+def page_query(
+    catalog_name: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[str, list]:
+    """Build the SQL and parameters for one page (limit + 1 rows, to detect a next page)"""
+    catalog = CATALOGS[catalog_name]
+    if sort not in catalog.sorts:
+        raise ValueError(f"Unknown sort order '{sort}'")
+    sort_columns, descending = catalog.sorts[sort]
+    keys = sort_columns + [catalog.id_column]
+    fields = fields or catalog.default_fields
+
+    # Sort keys are selected under private aliases after the fields, to build the next cursor
+    select = [f"{catalog.fields[field]} AS {field}" for field in fields]
+    select += [f"{key} AS _key{i}" for i, key in enumerate(keys)]
+    sql = f"SELECT {', '.join(select)} FROM {catalog.source}"
+    params: list = []
+    if cursor:
+        last_keys, last_id = decode_cursor(cursor)
+        if not isinstance(last_keys, list) or len(last_keys) != len(sort_columns):
+            raise ValueError("Invalid page cursor")
+        # Row value comparison: strictly after the last row in (sort key, ID) order
+        conditions = [f"({', '.join(keys)}) {'<' if descending else '>'} ({', '.join('?' * len(keys))})"]
+        params = last_keys + [last_id]
+        if sort_columns:
+            # SQLite only seeks an expression index on a plain bound of its first column
+            conditions.insert(0, f"{sort_columns[0]} {'<=' if descending else '>='} ?")
+            params.insert(0, last_keys[0])
+        sql += f" WHERE {' AND '.join(conditions)}"
+    direction = "DESC" if descending else "ASC"
+    sql += f" ORDER BY {', '.join(f'{key} {direction}' for key in keys)} LIMIT ?"
+    params.append(limit + 1)
+    return sql, params
+
+def fetch_page(
+    conn: sqlite3.Connection,
+    catalog_name: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Read one page of a catalog.
+
+    Returns:
+        The rows as dicts of the requested fields, and the cursor of the next page
+        (None on the last page)
+    """
+    fields = fields or CATALOGS[catalog_name].default_fields
+    sql, params = page_query(catalog_name, limit, cursor, sort, fields)
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_keys = tuple(rows[-1])[len(fields):]
+        next_cursor = encode_cursor(list(last_keys[:-1]), last_keys[-1])
+    return [dict(zip(fields, row)) for row in rows], next_cursor
+
+def iter_catalog(
+    conn: sqlite3.Connection,
+    catalog_name: str,
+    fields: Optional[List[str]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[List[dict]]:
+    """Yield a whole catalog in ID order, batch_size rows at a time"""
+    catalog = CATALOGS[catalog_name]
+    fields = fields or catalog.default_fields
+    cursor = conn.execute(
+        f"SELECT {', '.join(f'{catalog.fields[field]} AS {field}' for field in fields)} "
+        f"FROM {catalog.source} ORDER BY {catalog.id_column}"
+    )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [dict(zip(fields, row)) for row in rows]
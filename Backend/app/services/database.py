@@ -0,0 +1,440 @@
+'''
+This file is the shared SQLite access layer used by the routes and services.
+
+Connections are opened once, tuned with pragmas (WAL journaling so readers never wait on a
+writer, synchronous=NORMAL, a larger page cache, memory-mapped reads, a busy timeout and
+a per-connection statement cache) and then reused from a bounded pool instead of being
+opened and closed for every request.
+
+Async route handlers await run_db instead of calling sqlite3 on the event loop. The work
+runs on a dedicated, bounded set of worker threads that borrow a connection from the pool
+for each call, with a timeout; if the awaiting request times out or is cancelled, the
+running statement is interrupted.
+
+With DATABASE_SNAPSHOT_INTERVAL set, catalog reads (run_read, fetch_all/fetch_one with
+snapshot=True, read_connection) are served from a read-only copy of the database instead.
+The copy is made with the online backup API every interval seconds, and readers switch to
+a new copy atomically, so ingestion writing to the primary does not slow them down.
+Writes, and reads that must see them (users, playlists, history), stay on the primary.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from urllib.request import pathname2url
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+# Relative, so analyze_songs.py can import this module as Backend.app.services.database
+from .migrations import migrate
+
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+    "Database/music_app.db"
+))
+
+BUSY_TIMEOUT_MS = 5000
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -32000,        # Negative means KiB: 32 MB of page cache per connection
+    "mmap_size": 268435456,      # Read up to 256 MB of the file through mmap
+    "busy_timeout": BUSY_TIMEOUT_MS,
+    "temp_store": "MEMORY",
+}
+STATEMENT_CACHE_SIZE = 256
+QUERY_TIMEOUT_S = float(os.getenv("DATABASE_QUERY_TIMEOUT", "30"))
+# Seconds between read snapshots; 0 serves every read from the primary
+SNAPSHOT_INTERVAL_S = float(os.getenv("DATABASE_SNAPSHOT_INTERVAL", "0"))
+
+# SQLite INTEGER is a signed 64-bit value; binding anything outside raises OverflowError
+SQLITE_INT_MIN = -2**63
+SQLITE_INT_MAX = 2**63 - 1
+
+T = TypeVar("T")
+
+def fits_sqlite_integer(value: int) -> bool:
+    """Whether an int can be bound as an SQLite INTEGER"""
+    return SQLITE_INT_MIN <= value <= SQLITE_INT_MAX
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Open a tuned connection that returns sqlite3.Row rows"""
+    conn = sqlite3.connect(
+        db_path or DEFAULT_DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # Pooled connections move between worker threads
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+def connect_read_only(db_path: str) -> sqlite3.Connection:
+    """Open a snapshot file read-only; it never changes, so SQLite skips locking entirely"""
+    conn = sqlite3.connect(
+        f"file:{pathname2url(db_path)}?mode=ro&immutable=1",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in ("cache_size", "mmap_size", "temp_store"):
+        conn.execute(f"PRAGMA {pragma} = {PRAGMAS[pragma]}")
+    return conn
+
+class ConnectionPool:
+    def __init__(self, db_path: Optional[str] = None, max_size: int = 8, acquire_timeout: float = 30.0):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._opened: List[sqlite3.Connection] = []
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening one if the pool is below max_size"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No database connection free after {self.acquire_timeout}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = connect(self.db_path)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._opened.append(conn)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection, rolling back anything its user left uncommitted"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of a with block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every connection the pool opened"""
+        with self._lock:
+            for conn in self._opened:
+                conn.close()
+            self._opened.clear()
+        self._idle = queue.LifoQueue()
+
+    def stats(self) -> Dict[str, int]:
+        """Report how many connections are open and idle"""
+        return {"max_size": self.max_size, "open": len(self._opened), "idle": self._idle.qsize()}
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    """Get the shared pool for a database file, creating it on first use"""
+    db_path = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = ConnectionPool(db_path, max_size=int(os.getenv("DATABASE_POOL_SIZE", "8")))
+            # Bring the schema up to date once, before any request uses the database
+            with pool.connection() as conn:
+                migrate(conn)
+            _pools[db_path] = pool
+        return pool
+
+def acquire_connection(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Borrow a pooled connection; hand it back with release_connection"""
+    return get_pool(db_path).acquire()
+
+def release_connection(conn: sqlite3.Connection, db_path: Optional[str] = None):
+    """Hand a connection from acquire_connection back to its pool"""
+    get_pool(db_path).release(conn)
+
+def get_connection(db_path: Optional[str] = None):
+    """Borrow a pooled connection for a with block"""
+    return get_pool(db_path).connection()
+
+class _Job:
+    """One call on a worker thread, and the connection it is running on"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop the call: skip it if it has not started, interrupt its statement if it has"""
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+class DatabaseExecutor:
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_workers: int = 8,
+        timeout: float = QUERY_TIMEOUT_S,
+        pool: Optional[ConnectionPool] = None
+    ):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self.timeout = timeout
+        # Taken from get_pool on the first call that needs a connection
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sqlite")
+
+    def _acquire(self) -> sqlite3.Connection:
+        """A connection for one call"""
+        if self.pool is None:
+            self.pool = get_pool(self.db_path)
+        return self.pool.acquire()
+
+    def _release(self, conn: sqlite3.Connection):
+        """Hand a call's connection back; the pool rolls back anything left uncommitted"""
+        self.pool.release(conn)
+
+    def _call(self, job: _Job, fn: Callable, args: tuple, with_connection: bool):
+        if job.cancelled:
+            return None
+        if not with_connection:
+            return fn(*args)
+        conn = self._acquire()
+        try:
+            with job.lock:
+                if job.cancelled:
+                    return None
+                job.conn = conn
+            return fn(conn, *args)
+        finally:
+            with job.lock:
+                job.conn = None
+            self._release(conn)
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, with_connection: bool = True):
+        """Await fn(conn, *args) on a worker thread (fn(*args) if with_connection is False)"""
+        timeout = self.timeout if timeout is None else timeout
+        job = _Job()
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._call, job, fn, args, with_connection
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            job.cancel()
+            raise TimeoutError(f"Database call took longer than {timeout}s") from None
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    def close(self):
+        """Wait for running calls (their connections go back to the pool)"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+class DatabaseSnapshots:
+    """Read-only copies of a database, refreshed every interval seconds on a background thread"""
+    def __init__(self, db_path: str, interval: float, directory: Optional[str] = None):
+        self.db_path = db_path
+        self.interval = interval
+        self.directory = directory or os.path.join(os.path.dirname(db_path), "snapshots")
+        # Several app processes can share the directory, so file names carry the process ID
+        self._prefix = f"{os.path.splitext(os.path.basename(db_path))[0]}.{os.getpid()}."
+        self.generation = 0
+        self.path: Optional[str] = None
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def current(self) -> Tuple[int, str]:
+        """The generation and file of the snapshot readers should use"""
+        with self._lock:
+            return self.generation, self.path
+
+    def refresh(self) -> str:
+        """Copy the primary into a new snapshot file and switch readers to it"""
+        with self._refresh_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            generation = self.generation + 1
+            path = os.path.join(self.directory, f"{self._prefix}{generation}.db")
+            source, target = connect(self.db_path), sqlite3.connect(path)
+            try:
+                # Copy in one step: it reads a single WAL snapshot of the primary and never blocks
+                # its writers, whereas a stepped copy restarts whenever the primary is written
+                source.backup(target)
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                source.close()
+                target.close()
+            with self._lock:
+                self.generation, self.path = generation, path
+                self.refreshed_at = time.time()
+            self._remove_old(keep={path, os.path.join(self.directory, f"{self._prefix}{generation - 1}.db")})
+            return path
+
+    def _remove_old(self, keep: set):
+        """Delete this process's older snapshot files (the previous one may still be in use)"""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(self._prefix) and path not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Still open on Windows; removed after a later refresh
+
+    def start(self):
+        """Take the first snapshot now and keep refreshing in the background"""
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="sqlite-snapshots", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except sqlite3.Error as e:
+                print(f"Database snapshot refresh failed, still serving generation {self.generation}: {e}")
+
+    def close(self):
+        """Stop refreshing and delete this process's snapshot files"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if os.path.isdir(self.directory):
+            self._remove_old(keep=set())
+
+class SnapshotExecutor(DatabaseExecutor):
+    """Worker threads that each keep a read-only connection following the current snapshot"""
+    def __init__(self, snapshots: DatabaseSnapshots, max_workers: int = 8, timeout: float = QUERY_TIMEOUT_S):
+        super().__init__(snapshots.db_path, max_workers, timeout)
+        self.snapshots = snapshots
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: List[sqlite3.Connection] = []
+
+    def _release(self, conn: sqlite3.Connection):
+        """Snapshot connections stay with their worker thread"""
+
+    def _acquire(self) -> sqlite3.Connection:
+        generation, path = self.snapshots.current()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == generation:
+            return conn
+        if conn is not None:
+            # A newer snapshot was swapped in: move this worker over to it
+            with self._lock:
+                self._opened.remove(conn)
+            conn.close()
+        conn = connect_read_only(path)
+        self._local.conn, self._local.generation = conn, generation
+        with self._lock:
+            self._opened.append(conn)
+        return conn
+
+    def close(self):
+        super().close()
+        with self._lock:
+            for conn in self._opened:
+                conn.close()
+            self._opened.clear()
+        self.snapshots.close()
+
+_executors: Dict[str, DatabaseExecutor] = {}
+_read_executors: Dict[str, DatabaseExecutor] = {}
+_snapshots_lock = threading.Lock()
+
+def get_executor(db_path: Optional[str] = None) -> DatabaseExecutor:
+    """Get the shared worker threads for a database file, creating them on first use"""
+    db_path = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    # Creating the pool first also migrates the schema
+    pool = get_pool(db_path)
+    with _pools_lock:
+        executor = _executors.get(db_path)
+        if executor is None:
+            executor = DatabaseExecutor(db_path, max_workers=int(os.getenv("DATABASE_THREADS", "8")), pool=pool)
+            _executors[db_path] = executor
+        return executor
+
+def get_read_executor(db_path: Optional[str] = None) -> DatabaseExecutor:
+    """The worker threads for catalog reads: the snapshot ones in snapshot mode, else get_executor"""
+    if SNAPSHOT_INTERVAL_S <= 0:
+        return get_executor(db_path)
+    db_path = os.path.abspath(db_path or DEFAULT_DB_PATH)
+    with _pools_lock:
+        executor = _read_executors.get(db_path)
+    if executor is not None:
+        return executor
+    # The primary is migrated before it is copied
+    get_pool(db_path)
+    # The first copy can take a while, so it is made outside _pools_lock (routes that only
+    # need the primary keep going); _snapshots_lock just stops two copies being made at once
+    with _snapshots_lock:
+        with _pools_lock:
+            executor = _read_executors.get(db_path)
+        if executor is None:
+            snapshots = DatabaseSnapshots(db_path, SNAPSHOT_INTERVAL_S)
+            snapshots.start()
+            executor = SnapshotExecutor(snapshots, max_workers=int(os.getenv("DATABASE_THREADS", "8")))
+            with _pools_lock:
+                _read_executors[db_path] = executor
+        return executor
+
+async def run_db(fn: Callable[..., T], *args, timeout: Optional[float] = None, db_path: Optional[str] = None) -> T:
+    """Await fn(conn, *args) on the database worker threads; raises TimeoutError after timeout seconds"""
+    return await get_executor(db_path).run(fn, *args, timeout=timeout)
+
+async def run_blocking(fn: Callable[..., T], *args, timeout: Optional[float] = None, db_path: Optional[str] = None) -> T:
+    """Await a blocking function that opens its own connection, on the database worker threads"""
+    return await get_executor(db_path).run(fn, *args, timeout=timeout, with_connection=False)
+
+async def run_read(fn: Callable[..., T], *args, timeout: Optional[float] = None, db_path: Optional[str] = None) -> T:
+    """Await a read-only fn(conn, *args), on the read snapshot in snapshot mode"""
+    return await get_read_executor(db_path).run(fn, *args, timeout=timeout)
+
+async def fetch_all(sql: str, params: tuple = (), timeout: Optional[float] = None, snapshot: bool = False) -> List[sqlite3.Row]:
+    """Await every row of a query (from the read snapshot if snapshot is set and snapshot mode is on)"""
+    run = run_read if snapshot else run_db
+    return await run(lambda conn: conn.execute(sql, params).fetchall(), timeout=timeout)
+
+async def fetch_one(sql: str, params: tuple = (), timeout: Optional[float] = None, snapshot: bool = False) -> Optional[sqlite3.Row]:
+    """Await the first row of a query (from the read snapshot if snapshot is set and snapshot mode is on)"""
+    run = run_read if snapshot else run_db
+    return await run(lambda conn: conn.execute(sql, params).fetchone(), timeout=timeout)
+
+@contextmanager
+def read_connection(db_path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """A connection for one long read: on the current snapshot in snapshot mode, else pooled"""
+    if SNAPSHOT_INTERVAL_S <= 0:
+        with get_connection(db_path) as conn:
+            yield conn
+        return
+    executor = get_read_executor(db_path)
+    conn = connect_read_only(executor.snapshots.current()[1])
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def close_pools():
+    """Close every pooled and worker connection (on application shutdown)"""
+    with _pools_lock:
+        for executor in list(_executors.values()) + list(_read_executors.values()):
+            executor.close()
+        _executors.clear()
+        _read_executors.clear()
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -2,17 +2,13 @@
 This file is used to display the contents of the database.
 '''
 import sqlite3
-import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from tabulate import tabulate
+from app.services.database import acquire_connection, release_connection
 
 def get_db_connection():
-    """Get a connection to the SQLite database"""
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-    db_path = os.path.join(root_dir, "Database/music_app.db")
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled connection to the SQLite database"""
+    return acquire_connection()
 
 def check_database_tables():
     """Check if tables exist and have data"""
@@ -29,10 +25,11 @@ def check_database_tables():
         count = cursor.fetchone()[0]
         print(f"Table: {table_name}, Row count: {count}")
     
-    conn.close()
+    release_connection(conn)
 
-def display_all_artists() -> List[Dict[str, Any]]:
-    conn = get_db_connection()
+def display_all_artists(conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     cursor = conn.cursor()
 
     try:
@@ -51,10 +48,13 @@ def display_all_artists() -> List[Dict[str, Any]]:
         print(f"Error accessing artists table: {e}")
         return []
     finally:
-        conn.close()
+        # A connection passed in (e.g. by run_read) belongs to the caller
+        if owned:
+            release_connection(conn)
 
-def display_all_albums() -> List[Dict[str, Any]]:
-    conn = get_db_connection()
+def display_all_albums(conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     cursor = conn.cursor()
 
     try:
@@ -87,25 +87,14 @@ def display_all_albums() -> List[Dict[str, Any]]:
         print(f"Error accessing albums table: {e}")
         return []
     finally:
-        conn.close()
+        if owned:
+            release_connection(conn)
 
-def display_all_songs() -> List[Dict[str, Any]]:
-    conn = get_db_connection()
+def display_all_songs(conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+    owned = conn is None
+    conn = conn or get_db_connection()
     cursor = conn.cursor()
 
-    def convert_to_float(value):
-        if value is None:
-            return None
-        if isinstance(value, bytes):
-            try:
-                return float.fromhex(value.hex())
-            except Exception:
-                return None
-        try:
-            return float(value)
-        except Exception:
-            return None
-
     try:
         cursor.execute("""
             SELECT s.song_id, s.name as song_name, al.name as album_name, 
@@ -128,16 +117,16 @@ def display_all_songs() -> List[Dict[str, Any]]:
                 "album": row["album_name"].decode("utf-8", errors="replace") if isinstance(row["album_name"], bytes) else row["album_name"],
                 "artist": row["artist_name"].decode("utf-8", errors="replace") if isinstance(row["artist_name"], bytes) else row["artist_name"],
                 "genre": row["genre"],
-                "duration": convert_to_float(row["duration"]),
-                "tempo": convert_to_float(row["tempo"]),
-                "spectral_centroid": convert_to_float(row["spectral_centroid"]),
-                "spectral_rolloff": convert_to_float(row["spectral_rolloff"]),
-                "spectral_contrast": convert_to_float(row["spectral_contrast"]),
-                "chroma_mean": convert_to_float(row["chroma_mean"]),
-                "chroma_std": convert_to_float(row["chroma_std"]),
-                "onset_strength": convert_to_float(row["onset_strength"]),
-                "zero_crossing_rate": convert_to_float(row["zero_crossing_rate"]),
-                "rms_energy": convert_to_float(row["rms_energy"]),
+                "duration": row["duration"],
+                "tempo": row["tempo"],
+                "spectral_centroid": row["spectral_centroid"],
+                "spectral_rolloff": row["spectral_rolloff"],
+                "spectral_contrast": row["spectral_contrast"],
+                "chroma_mean": row["chroma_mean"],
+                "chroma_std": row["chroma_std"],
+                "onset_strength": row["onset_strength"],
+                "zero_crossing_rate": row["zero_crossing_rate"],
+                "rms_energy": row["rms_energy"],
             }
             song_list.append(song)
 
@@ -147,45 +136,43 @@ def display_all_songs() -> List[Dict[str, Any]]:
         print("🔥 Error in display_all_songs:", e)
         return []
     finally:
-        conn.close()
+        if owned:
+            release_connection(conn)
 
 
-def display_database_summary():
-    conn = get_db_connection()
+def display_database_summary(conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+    """Read the catalog totals kept up to date by triggers (see migrations.py)"""
+    owned = conn is None
+    conn = conn or get_db_connection()
     cursor = conn.cursor()
 
     try:
-        cursor.execute("SELECT COUNT(*) FROM Artist")
-        artist_count = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM Album")
-        album_count = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM Song")
-        song_count = cursor.fetchone()[0]
-
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_songs,
-                COUNT(CASE WHEN duration IS NOT NULL THEN 1 END) as songs_with_duration,
-                COUNT(CASE WHEN tempo IS NOT NULL THEN 1 END) as songs_with_tempo
-            FROM Song
-        """)
-        stats = cursor.fetchone()
+        cursor.execute("SELECT artists, albums, songs, analyzed_songs FROM Catalog_Totals")
+        totals = cursor.fetchone()
+        artist_count, album_count, song_count, analyzed_count = tuple(totals) if totals else (0, 0, 0, 0)
 
         print("\n=== Database Summary ===\n")
         summary = [
             {"Category": "Artists", "Count": artist_count},
             {"Category": "Albums", "Count": album_count},
             {"Category": "Songs", "Count": song_count},
-            {"Category": "Songs with Duration", "Count": stats["songs_with_duration"]},
-            {"Category": "Songs with Tempo", "Count": stats["songs_with_tempo"]}
+            {"Category": "Songs with Features", "Count": analyzed_count}
         ]
         print(tabulate(summary, headers="keys", tablefmt="grid"))
+        return {
+            "total_songs": song_count,
+            "total_artists": artist_count,
+            "total_albums": album_count,
+            "songs_with_features": analyzed_count,
+            "average_songs_per_artist": song_count / artist_count if artist_count else 0.0,
+            "average_songs_per_album": song_count / album_count if album_count else 0.0
+        }
     except sqlite3.OperationalError as e:
         print(f"Error accessing database tables: {e}")
+        raise
     finally:
-        conn.close()
+        if owned:
+            release_connection(conn)
 
 if __name__ == "__main__":
     check_database_tables()
@@ -0,0 +1,87 @@
+'''
+This file reranks recommendation candidates for diversity.
+
+Maximal marginal relevance (MMR) picks candidates one at a time, trading closeness to the
+query against closeness to what was already picked, so near-duplicates (several versions
+of one track, a whole album) do not crowd out the rest. Optional per-artist and per-album
+caps are applied during the same pass. The Gram matrix of the candidate pool is computed
+once up front, so each pick only turns one of its rows into distances.
+'''
+from typing import Optional
+import numpy as np
+
+def _capped_groups(groups: Optional[np.ndarray], cap: Optional[int]):
+    """Compact group codes for a cap, or None if the cap is not used"""
+    if groups is None or cap is None:
+        return None
+    _, codes = np.unique(groups, return_inverse=True)
+    return codes
+
+def mmr_rerank(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    limit: int,
+    diversity: float = 0.0,
+    artist_ids: Optional[np.ndarray] = None,
+    album_ids: Optional[np.ndarray] = None,
+    max_per_artist: Optional[int] = None,
+    max_per_album: Optional[int] = None
+) -> np.ndarray:
+    """
+    Pick up to limit candidates balancing relevance and diversity.
+
+    Args:
+        query: Normalized query vector
+        candidates: Normalized candidate vectors, one per row
+        limit: Number of candidates to pick
+        diversity: 0 ranks purely by distance to the query, 1 purely by distance from
+            the candidates already picked
+        artist_ids, album_ids: Group of every candidate, used by the caps
+        max_per_artist, max_per_album: Maximum picks from one artist / album
+
+    Returns:
+        Indices into candidates, in pick order
+    """
+    n = candidates.shape[0]
+    limit = min(limit, n)
+    if limit <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    relevance = np.sqrt(np.einsum("ij,ij->i", candidates - query, candidates - query))
+    if diversity > 0:
+        # Pairwise squared distances are norms[i] + norms[j] - 2 * gram[i, j]
+        gram = candidates @ candidates.T
+        norms = np.diagonal(gram).copy()
+
+    caps = [
+        (codes, cap, np.zeros(codes.max() + 1, dtype=np.int64))
+        for codes, cap in (
+            (_capped_groups(artist_ids, max_per_artist), max_per_artist),
+            (_capped_groups(album_ids, max_per_album), max_per_album),
+        )
+        if codes is not None
+    ]
+
+    available = np.ones(n, dtype=bool)
+    # Distance from each candidate to the closest one picked so far
+    nearest_picked = np.full(n, np.inf)
+    picked = []
+    for _ in range(limit):
+        if diversity > 0 and picked:
+            scores = (1.0 - diversity) * relevance - diversity * nearest_picked
+        else:
+            scores = relevance
+        scores = np.where(available, scores, np.inf)
+        best = int(np.argmin(scores))
+        if not np.isfinite(scores[best]):
+            break
+        picked.append(best)
+        available[best] = False
+        if diversity > 0:
+            squared = norms + norms[best] - 2.0 * gram[best]
+            np.minimum(nearest_picked, np.sqrt(np.maximum(squared, 0.0)), out=nearest_picked)
+        for codes, cap, counts in caps:
+            counts[codes[best]] += 1
+            if counts[codes[best]] >= cap:
+                available &= codes != codes[best]
+    return np.array(picked, dtype=np.intp)
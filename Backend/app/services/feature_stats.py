@@ -0,0 +1,76 @@
+'''
+This file keeps running normalization statistics for the song feature vectors.
+
+The mean and variance of every feature are maintained with Welford's algorithm, so songs
+can be added and removed one at a time without rescanning the catalog, and removing a
+song exactly undoes adding it (unlike a running min/max).
+'''
+from typing import Dict
+import numpy as np
+
+class FeatureStats:
+    def __init__(self, n_features: int):
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)  # Sum of squared deviations from the mean
+
+    @classmethod
+    def from_matrix(cls, features: np.ndarray) -> "FeatureStats":
+        """Compute the statistics of a whole feature matrix at once"""
+        stats = cls(features.shape[1])
+        stats.count = features.shape[0]
+        if stats.count:
+            stats.mean = features.mean(axis=0)
+            stats.m2 = ((features - stats.mean) ** 2).sum(axis=0)
+        return stats
+
+    def add(self, vector: np.ndarray):
+        """Include one song's features in the statistics"""
+        self.count += 1
+        delta = vector - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (vector - self.mean)
+
+    def remove(self, vector: np.ndarray):
+        """Remove one song's features from the statistics"""
+        if self.count <= 1:
+            self.count = 0
+            self.mean = np.zeros_like(self.mean)
+            self.m2 = np.zeros_like(self.m2)
+            return
+        old_mean = self.mean
+        self.count -= 1
+        self.mean = old_mean - (vector - old_mean) / self.count
+        self.m2 = np.maximum(self.m2 - (vector - old_mean) * (vector - self.mean), 0.0)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Standard deviation per feature; constant features get 1 so they never divide by zero"""
+        if self.count == 0:
+            return np.ones_like(self.mean)
+        std = np.sqrt(self.m2 / self.count)
+        return np.where(std > 1e-12, std, 1.0)
+
+    def drift(self, mean: np.ndarray, std: np.ndarray) -> float:
+        """
+        Measure how far these statistics moved away from a previous (mean, std) projection.
+
+        Returns the largest per-feature shift of the mean, in units of the old standard
+        deviation, or relative change of the standard deviation.
+        """
+        mean_shift = np.abs(self.mean - mean) / std
+        std_shift = np.abs(self.std / std - 1.0)
+        return float(max(mean_shift.max(initial=0.0), std_shift.max(initial=0.0)))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Serialize the statistics for np.savez"""
+        return {"stats_count": np.array(self.count), "stats_mean": self.mean, "stats_m2": self.m2}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "FeatureStats":
+        """Restore statistics saved with to_arrays"""
+        stats = cls(arrays["stats_mean"].shape[0])
+        stats.count = int(arrays["stats_count"])
+        stats.mean = np.array(arrays["stats_mean"], dtype=np.float64)
+        stats.m2 = np.array(arrays["stats_m2"], dtype=np.float64)
+        return stats
@@ -0,0 +1,349 @@
+'''
+This file exports the analyzed songs' features to a columnar store on disk.
+
+Reading the Song table row by row through Python is the slowest part of building the
+recommendation index or computing catalog-wide statistics. The store keeps one NumPy
+.npy file per field next to the database (<db>_features/):
+
+    song_id, artist_id, album_id, genre_code   int64, one value per row
+    live                                       bool, False once a song is deleted or loses its features
+    features                                   float64, one row of FEATURE_COLUMNS per song
+
+plus manifest.json with the row count, the genre labels, the database_id and the
+Song_Change_Log change_id the files are current with. load() memory-maps the files, so
+millions of rows are available without parsing anything.
+
+sync() only reads the songs changed since the manifest's change_id: new songs are appended
+to the end of each file, changed songs are overwritten in place and removed songs are
+marked dead. The manifest is replaced last, so a sync that is interrupted is simply
+applied again; the change_id is then saved as the store's change log checkpoint. Once too
+many rows are dead, the store is exported again from scratch.
+Syncs within one process take turns; only one process should sync a store at a time.
+'''
+import argparse
+import io
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from numpy.lib import format as npy_format
+from app.services.artist_centroids import NO_ARTIST
+from app.services.catalog_changes import (
+    changes_available, database_id, ensure_change_log, fetch_changes, latest_change_id, save_checkpoint
+)
+from app.services.migrations import FEATURE_COLUMNS, migrate
+
+ID_FIELDS = ["song_id", "artist_id", "album_id", "genre_code"]
+STORE_VERSION = 1
+EXPORT_BATCH_SIZE = 50000
+# Export again once this share of the rows is dead
+COMPACT_RATIO = 0.25
+
+# The recommendation service and the insights both sync the store from their own threads
+_sync_lock = threading.RLock()
+
+class FeatureRows(NamedTuple):
+    song_ids: np.ndarray
+    artist_ids: np.ndarray      # NO_ARTIST if unknown
+    album_ids: np.ndarray
+    genres: List[str]
+    features: np.ndarray        # One row of FEATURE_COLUMNS per song
+
+class FeatureTable(NamedTuple):
+    change_id: int              # Last Song_Change_Log entry the table includes
+    song_ids: np.ndarray
+    artist_ids: np.ndarray
+    album_ids: np.ndarray
+    genre_codes: np.ndarray     # Index into genre_labels
+    genre_labels: List[str]
+    features: np.ndarray
+
+def read_feature_rows(conn: sqlite3.Connection, where: str = "", params: tuple = ()) -> FeatureRows:
+    """Read the analyzed songs matching an extra WHERE condition (starting with AND)"""
+    rows = conn.execute(f"""
+        SELECT s.song_id, COALESCE(al.artist_id, {NO_ARTIST}) AS artist_id, s.album_id, s.genre,
+               {", ".join("s." + column for column in FEATURE_COLUMNS)}
+        FROM Song s
+        LEFT JOIN Album al ON s.album_id = al.album_id
+        WHERE s.duration IS NOT NULL
+          AND s.tempo IS NOT NULL
+          AND s.spectral_centroid IS NOT NULL
+          {where}
+    """, params).fetchall()
+    return FeatureRows(
+        song_ids=np.array([row[0] for row in rows], dtype=np.int64),
+        artist_ids=np.array([row[1] for row in rows], dtype=np.int64),
+        album_ids=np.array([row[2] for row in rows], dtype=np.int64),
+        genres=[row[3] or "" for row in rows],
+        # Features are native REALs (migration 3), so rows go straight into NumPy
+        features=np.array([tuple(row)[4:] for row in rows], dtype=np.float64).reshape(len(rows), len(FEATURE_COLUMNS))
+    )
+
+def scan_feature_table(conn: sqlite3.Connection) -> FeatureTable:
+    """Read every analyzed song straight from the Song table, for when no store can be used"""
+    change_id = latest_change_id(conn)
+    rows = read_feature_rows(conn)
+    genre_labels = list(dict.fromkeys(rows.genres))
+    codes = {label: code for code, label in enumerate(genre_labels)}
+    return FeatureTable(
+        change_id, rows.song_ids, rows.artist_ids, rows.album_ids,
+        np.array([codes[genre] for genre in rows.genres], dtype=np.int64), genre_labels, rows.features
+    )
+
+def _append(path: str, values: np.ndarray, rows: int):
+    """Write values after the first rows entries of an .npy file, creating it if needed"""
+    if not os.path.exists(path):
+        npy_format.open_memmap(path, mode="w+", dtype=values.dtype, shape=(0,) + values.shape[1:]).flush()
+    with open(path, "r+b") as f:
+        npy_format.read_magic(f)
+        npy_format.read_array_header_1_0(f)
+        header_size = f.tell()
+        header = {
+            "descr": npy_format.dtype_to_descr(values.dtype),
+            "fortran_order": False,
+            "shape": (rows + len(values),) + values.shape[1:]
+        }
+        # NumPy pads headers so the first dimension can grow without moving the data
+        new_header = io.BytesIO()
+        npy_format.write_array_header_1_0(new_header, header)
+        if new_header.tell() == header_size:
+            f.seek(0)
+            f.write(new_header.getvalue())
+            row_size = values.dtype.itemsize * int(np.prod(values.shape[1:], dtype=np.int64))
+            f.seek(header_size + rows * row_size)
+            f.write(np.ascontiguousarray(values).tobytes())
+            f.truncate()
+            return
+    # The header outgrew its padding, so the file is written again
+    existing = np.load(path)[:rows]
+    np.save(path, np.concatenate([existing, values]))
+
+class FeatureStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @classmethod
+    def for_database(cls, db_path: str) -> "FeatureStore":
+        """The store kept next to a database file"""
+        return cls(os.path.splitext(db_path)[0] + "_features")
+
+    def _path(self, field: str) -> str:
+        return os.path.join(self.directory, field + ".npy")
+
+    def manifest(self) -> Optional[dict]:
+        """The current manifest, or None if the store has not been exported"""
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != STORE_VERSION or manifest.get("columns") != FEATURE_COLUMNS:
+            return None
+        return manifest
+
+    def _write_manifest(self, directory: str, manifest: dict):
+        """Replace the manifest in one step"""
+        path = os.path.join(directory, "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _append_rows(self, directory: str, rows: FeatureRows, manifest: dict):
+        """Append rows to every file and update the manifest in memory"""
+        codes = {label: code for code, label in enumerate(manifest["genres"])}
+        genre_codes = []
+        for genre in rows.genres:
+            if genre not in codes:
+                codes[genre] = len(manifest["genres"])
+                manifest["genres"].append(genre)
+            genre_codes.append(codes[genre])
+        columns = {
+            "song_id": rows.song_ids,
+            "artist_id": rows.artist_ids,
+            "album_id": rows.album_ids,
+            "genre_code": np.array(genre_codes, dtype=np.int64),
+            "live": np.ones(len(rows.song_ids), dtype=bool),
+            "features": rows.features
+        }
+        for field, values in columns.items():
+            _append(os.path.join(directory, field + ".npy"), values, manifest["rows"])
+        manifest["rows"] += len(rows.song_ids)
+        manifest["live"] = int(np.count_nonzero(np.load(os.path.join(directory, "live.npy"), mmap_mode="r")[:manifest["rows"]]))
+
+    def export(self, conn: sqlite3.Connection) -> dict:
+        """Write every analyzed song to a new store, then swap it in; returns the manifest"""
+        with _sync_lock:
+            return self._export(conn)
+
+    def _export(self, conn: sqlite3.Connection) -> dict:
+        ensure_change_log(conn)
+        # Remember where the change log stands before reading, so nothing is missed
+        manifest = {
+            "version": STORE_VERSION, "database_id": database_id(conn), "change_id": latest_change_id(conn),
+            "rows": 0, "live": 0, "columns": FEATURE_COLUMNS, "genres": []
+        }
+        temp_directory = self.directory + ".tmp"
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        os.makedirs(temp_directory)
+        last = None
+        while True:
+            # Keyset batches keep memory bounded for very large catalogs
+            where, params = ("", ()) if last is None else ("AND s.song_id > ?", (last,))
+            rows = read_feature_rows(conn, f"{where} ORDER BY s.song_id LIMIT ?", params + (EXPORT_BATCH_SIZE,))
+            if not len(rows.song_ids) and manifest["rows"]:
+                break
+            self._append_rows(temp_directory, rows, manifest)
+            if len(rows.song_ids) < EXPORT_BATCH_SIZE:
+                break
+            last = int(rows.song_ids[-1])
+        self._write_manifest(temp_directory, manifest)
+
+        # Readers that already mapped the old files keep them until they let go
+        old_directory = self.directory + ".old"
+        shutil.rmtree(old_directory, ignore_errors=True)
+        if os.path.exists(self.directory):
+            os.replace(self.directory, old_directory)
+        os.replace(temp_directory, self.directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+        save_checkpoint(conn, "feature store", manifest["change_id"])
+        return manifest
+
+    def sync(self, conn: sqlite3.Connection) -> bool:
+        """
+        Bring the store up to date with the database.
+
+        Returns:
+            True if the store changed
+        """
+        with _sync_lock:
+            return self._sync(conn)
+
+    def _sync(self, conn: sqlite3.Connection) -> bool:
+        ensure_change_log(conn)
+        manifest = self.manifest()
+        if (manifest is None
+                or manifest.get("database_id") != database_id(conn)
+                or manifest["change_id"] > latest_change_id(conn)
+                or not changes_available(conn, manifest["change_id"])):
+            # Missing, from an older layout, for another (or a recreated) database, or the
+            # changes since were pruned
+            self._export(conn)
+            return True
+
+        changed_ids, change_id = fetch_changes(conn, manifest["change_id"])
+        if not changed_ids:
+            return False
+
+        song_ids = np.load(self._path("song_id"), mmap_mode="r")[:manifest["rows"]]
+        live = np.load(self._path("live"), mmap_mode="r+")
+        changed = np.array(changed_ids, dtype=np.int64)
+        positions = {int(song_ids[pos]): int(pos) for pos in np.flatnonzero(np.isin(song_ids, changed) & live[:manifest["rows"]])}
+
+        # Drop every changed song, then append or rewrite the ones that still have features
+        current = []
+        for start in range(0, len(changed_ids), 500):
+            chunk = changed_ids[start:start + 500]
+            current.append(read_feature_rows(conn, f"AND s.song_id IN ({', '.join('?' * len(chunk))})", tuple(chunk)))
+        current = FeatureRows(
+            np.concatenate([rows.song_ids for rows in current]),
+            np.concatenate([rows.artist_ids for rows in current]),
+            np.concatenate([rows.album_ids for rows in current]),
+            [genre for rows in current for genre in rows.genres],
+            np.concatenate([rows.features for rows in current])
+        )
+        for pos in positions.values():
+            live[pos] = False
+
+        updated = np.array([int(song_id) in positions for song_id in current.song_ids], dtype=bool)
+        if updated.any():
+            # Rows of songs that changed in place are rewritten where they are
+            codes = {label: code for code, label in enumerate(manifest["genres"])}
+            artist_ids = np.load(self._path("artist_id"), mmap_mode="r+")
+            album_ids = np.load(self._path("album_id"), mmap_mode="r+")
+            genre_codes = np.load(self._path("genre_code"), mmap_mode="r+")
+            features = np.load(self._path("features"), mmap_mode="r+")
+            for i in np.flatnonzero(updated):
+                genre = current.genres[i]
+                if genre not in codes:
+                    codes[genre] = len(manifest["genres"])
+                    manifest["genres"].append(genre)
+                pos = positions[int(current.song_ids[i])]
+                artist_ids[pos] = current.artist_ids[i]
+                album_ids[pos] = current.album_ids[i]
+                genre_codes[pos] = codes[genre]
+                features[pos] = current.features[i]
+                live[pos] = True
+            for array in (artist_ids, album_ids, genre_codes, features):
+                array.flush()
+        live.flush()
+        del live
+
+        added = ~updated
+        self._append_rows(self.directory, FeatureRows(
+            current.song_ids[added], current.artist_ids[added], current.album_ids[added],
+            [genre for genre, keep in zip(current.genres, added) if keep], current.features[added]
+        ), manifest)
+        manifest["change_id"] = change_id
+        if manifest["rows"] - manifest["live"] > COMPACT_RATIO * manifest["rows"]:
+            self._export(conn)
+        else:
+            self._write_manifest(self.directory, manifest)
+            save_checkpoint(conn, "feature store", change_id)
+        return True
+
+    def load(self) -> Optional[FeatureTable]:
+        """
+        Memory-map the live rows, or None if the store has not been exported.
+
+        The arrays are read-only views of the files while no row is dead; otherwise the
+        live rows are copied out once.
+        """
+        # A sync on another thread swaps the directory or rewrites live.npy; holding its lock
+        # keeps the manifest and the arrays from the same generation
+        with _sync_lock:
+            manifest = self.manifest()
+            if manifest is None:
+                return None
+            rows = manifest["rows"]
+            fields = {
+                field: np.load(self._path(field), mmap_mode="r")[:rows]
+                for field in ID_FIELDS + ["live", "features"]
+            }
+            live = fields.pop("live")
+            if not live.all():
+                live = np.array(live)
+                fields = {field: values[live] for field, values in fields.items()}
+        return FeatureTable(
+            change_id=manifest["change_id"],
+            song_ids=fields["song_id"],
+            artist_ids=fields["artist_id"],
+            album_ids=fields["album_id"],
+            genre_codes=fields["genre_code"],
+            genre_labels=list(manifest["genres"]),
+            features=fields["features"]
+        )
+
+def sync_feature_store(db_path: str) -> Tuple[FeatureStore, bool]:
+    """Open (and migrate, as the app would) the database and bring its store up to date"""
+    store = FeatureStore.for_database(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        # Features are only REAL values once migration 3 has run
+        migrate(conn)
+        return store, store.sync(conn)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export song features to the columnar store next to the database")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(__file__), "../../../Database/music_app.db"))
+    parser.add_argument("--full", action="store_true", help="Export every song again instead of applying changes")
+    args = parser.parse_args()
+    if args.full:
+        shutil.rmtree(FeatureStore.for_database(args.db).directory, ignore_errors=True)
+    store, _ = sync_feature_store(args.db)
+    manifest = store.manifest()
+    print(f"✅ {manifest['live']} songs in {os.path.abspath(store.directory)} (change {manifest['change_id']})")
@@ -0,0 +1,183 @@
+'''
+This file ingests listening history (play events) with write-behind buffering.
+
+Routes hand events to a HistoryBuffer, which keeps them in memory and returns at once. A
+background thread writes them in group commits (one transaction for everything pending)
+every flush_interval seconds, or sooner once batch_size events are waiting. It uses its own
+connection, so bursts of plays never occupy the database workers of interactive routes.
+When max_pending events are waiting, submit refuses more so callers can back off.
+
+Closing a buffer (on application shutdown, or at interpreter exit) writes whatever is
+still pending. A failed write puts the events back to be retried on the next flush. Events
+that can never be written (IDs outside SQLite's 64-bit range) are refused by submit, and a
+writer thread that stopped on an unexpected error is started again by the next submit.
+'''
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+import atexit
+import os
+import sqlite3
+import threading
+from app.services.database import connect, get_pool, fits_sqlite_integer
+
+PlayRow = Tuple[int, int, str]  # (user_id, song_id, played_at)
+
+MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "100000"))
+BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "5000"))
+FLUSH_INTERVAL_S = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+
+def format_played_at(played_at: Optional[datetime] = None) -> str:
+    """A play time as UTC text, in the same layout as SQLite's CURRENT_TIMESTAMP"""
+    played_at = played_at or datetime.now(timezone.utc)
+    if played_at.tzinfo is not None:
+        played_at = played_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return played_at.isoformat(sep=" ", timespec="milliseconds")
+
+class HistoryBuffer:
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_pending: int = MAX_PENDING,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL_S
+    ):
+        self.db_path = db_path
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {"written": 0, "unknown_songs": 0, "rejected": 0, "dropped": 0, "failed_flushes": 0}
+        self._pending: List[PlayRow] = []
+        self._lock = threading.Lock()
+        # Only one flush writes at a time (the background thread, or flush/close callers)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._closed = False
+
+    def pending(self) -> int:
+        """How many events are waiting to be written"""
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, rows: Sequence[PlayRow]) -> bool:
+        """Queue play events; returns False, queueing none of them, if the buffer is full"""
+        for user_id, song_id, _ in rows:
+            if not (fits_sqlite_integer(user_id) and fits_sqlite_integer(song_id)):
+                raise ValueError(f"IDs out of range in play ({user_id}, {song_id})")
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("History buffer is closed")
+            if len(self._pending) + len(rows) > self.max_pending:
+                self.stats["rejected"] += len(rows)
+                return False
+            self._pending.extend(rows)
+            ready = len(self._pending) >= self.batch_size
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+        if ready:
+            self._wake.set()
+        return True
+
+    def flush(self) -> int:
+        """Write every pending event in one transaction; returns how many rows were written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                written = self._write(batch)
+            except sqlite3.Error:
+                with self._lock:
+                    # Keep the events, ahead of newer ones, for the next attempt
+                    self._pending[:0] = batch
+                    self.stats["failed_flushes"] += 1
+                raise
+            except Exception:
+                # Not a database condition, so retrying the same batch would fail again
+                with self._lock:
+                    self.stats["dropped"] += len(batch)
+                    self.stats["failed_flushes"] += 1
+                raise
+            with self._lock:
+                self.stats["written"] += written
+                self.stats["unknown_songs"] += len(batch) - written
+            return written
+
+    def _write(self, batch: List[PlayRow]) -> int:
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Plays of songs that no longer exist are dropped (users are checked by the route)
+            cursor = conn.executemany("""
+                INSERT INTO History (user_id, song_id, played_at)
+                SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM Song WHERE song_id = ?)
+            """, [(user_id, song_id, played_at, song_id) for user_id, song_id, played_at in batch])
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"History flush failed, will retry: {e}")
+            except Exception as e:
+                # Keep the writer alive; one bad batch must not stop ingestion
+                print(f"History flush failed, batch dropped: {e!r}")
+
+    def close(self):
+        """Stop the writer thread and write everything still pending"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        self._stop.set()
+        self._wake.set()
+        if thread is not None:
+            thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"History flush on shutdown failed, {self.pending()} plays lost: {e!r}")
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+_buffers: Dict[str, HistoryBuffer] = {}
+_buffers_lock = threading.Lock()
+
+def get_history_buffer(db_path: Optional[str] = None) -> HistoryBuffer:
+    """Get the shared history buffer for a database file, creating it on first use"""
+    # Creating the pool first also migrates the schema
+    db_path = get_pool(db_path).db_path
+    with _buffers_lock:
+        buffer = _buffers.get(db_path)
+        if buffer is None:
+            buffer = HistoryBuffer(db_path)
+            _buffers[db_path] = buffer
+        return buffer
+
+def close_history_buffers():
+    """Write every pending play and stop the writer threads (on application shutdown)"""
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+        _buffers.clear()
+    for buffer in buffers:
+        buffer.close()
+
+# Also flush when the interpreter exits without the application shutdown event
+atexit.register(close_history_buffers)
@@ -0,0 +1,232 @@
+'''
+This file builds catalog insights (the API version of Database/sample_query.py) and caches them.
+
+Nothing here scans the catalog: totals, top artists and albums, and the genre distribution
+come from the trigger-maintained counter tables (migrations 5 and 8), and the feature
+histograms from the columnar feature store (feature_store.py). Requests never sync the
+store, since a sync can fall back to a full export: a background thread does, every
+INSIGHTS_SYNC_INTERVAL seconds and as soon as a request finds the store behind the
+catalog. Histograms show the store as of its last sync, and are left out (None) until
+the store has been exported for this database.
+
+Built insights are cached for INSIGHTS_TTL seconds. They are also dropped as soon as the
+catalog or the store changes: the catalog marker (last Song_Change_Log entry plus the
+catalog totals) and the store's change_id are read at most once every
+INSIGHTS_CHECK_INTERVAL seconds, and requests in between are answered from memory without
+touching the database. Renaming an artist or album does not move the marker, so new names
+show up once the TTL expires.
+'''
+from typing import Any, Dict, Optional, Tuple
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+import numpy as np
+from app.services.catalog_changes import database_id, ensure_change_log, latest_change_id
+from app.services.database import connect, get_pool
+from app.services.feature_store import FEATURE_COLUMNS, FeatureStore, FeatureTable
+from app.services.recommendation_cache import RecommendationCache
+
+INSIGHTS_TTL_S = float(os.getenv("INSIGHTS_TTL", "300"))
+CHECK_INTERVAL_S = float(os.getenv("INSIGHTS_CHECK_INTERVAL", "1.0"))
+SYNC_INTERVAL_S = float(os.getenv("INSIGHTS_SYNC_INTERVAL", "30"))
+
+TOP_ARTISTS_QUERY = """
+    SELECT ar.artist_id, ar.name, st.album_count, st.song_count
+    FROM Artist_Stats st
+    JOIN Artist ar ON ar.artist_id = st.artist_id
+    WHERE st.song_count > 0
+    ORDER BY st.song_count DESC
+    LIMIT ?
+"""
+
+TOP_ALBUMS_QUERY = """
+    SELECT al.album_id, al.name, ar.name AS artist, st.song_count
+    FROM Album_Stats st
+    JOIN Album al ON al.album_id = st.album_id
+    LEFT JOIN Artist ar ON ar.artist_id = al.artist_id
+    WHERE st.song_count > 0
+    ORDER BY st.song_count DESC
+    LIMIT ?
+"""
+
+GENRES_QUERY = """
+    SELECT genre, song_count, analyzed_songs FROM Genre_Stats
+    WHERE song_count > 0
+    ORDER BY song_count DESC, genre
+"""
+
+def catalog_marker(conn: sqlite3.Connection) -> Tuple[int, ...]:
+    """A value that changes whenever a song changes or an album or artist is added or removed"""
+    totals = conn.execute("SELECT artists, albums, songs, analyzed_songs FROM Catalog_Totals").fetchone()
+    return (latest_change_id(conn),) + tuple(totals or ())
+
+def feature_histograms(features: np.ndarray, bins: int) -> Dict[str, Dict[str, Any]]:
+    """Range, mean and an equal-width histogram of every feature; missing values are skipped"""
+    histograms = {}
+    for i, column in enumerate(FEATURE_COLUMNS):
+        values = features[:, i]
+        values = values[np.isfinite(values)]
+        if not len(values):
+            histograms[column] = {"count": 0, "min": None, "max": None, "mean": None, "edges": [], "counts": []}
+            continue
+        counts, edges = np.histogram(values, bins=bins)
+        histograms[column] = {
+            "count": int(len(values)),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "mean": float(values.mean()),
+            "edges": edges.tolist(),
+            "counts": counts.tolist()
+        }
+    return histograms
+
+def build_insights(conn: sqlite3.Connection, table: Optional[FeatureTable], top: int, bins: int) -> Dict[str, Any]:
+    """Read the counters and a loaded feature store (None leaves the histograms out) into one insights document"""
+    totals = conn.execute("SELECT artists, albums, songs, analyzed_songs FROM Catalog_Totals").fetchone()
+    artists, albums, songs, analyzed = totals if totals else (0, 0, 0, 0)
+
+    return {
+        "totals": {
+            "artists": artists,
+            "albums": albums,
+            "songs": songs,
+            "analyzed_songs": analyzed,
+            "average_songs_per_artist": round(songs / artists, 2) if artists else 0.0,
+            "average_songs_per_album": round(songs / albums, 2) if albums else 0.0,
+        },
+        "top_artists": [
+            {"id": str(row[0]), "name": row[1], "album_count": row[2], "song_count": row[3]}
+            for row in conn.execute(TOP_ARTISTS_QUERY, (top,))
+        ],
+        "top_albums": [
+            {"id": str(row[0]), "name": row[1], "artist": row[2], "song_count": row[3]}
+            for row in conn.execute(TOP_ALBUMS_QUERY, (top,))
+        ],
+        "genres": [
+            {"genre": row[0] or None, "song_count": row[1], "analyzed_songs": row[2]}
+            for row in conn.execute(GENRES_QUERY)
+        ],
+        "feature_histograms": feature_histograms(table.features, bins) if table is not None else None,
+        "generated_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+class CatalogInsights:
+    def __init__(
+        self,
+        db_path: str,
+        ttl_seconds: float = INSIGHTS_TTL_S,
+        check_interval: float = CHECK_INTERVAL_S,
+        sync_interval: float = SYNC_INTERVAL_S,
+        max_entries: int = 32
+    ):
+        self.db_path = db_path
+        self.store = FeatureStore.for_database(db_path)
+        self.check_interval = check_interval
+        self.sync_interval = sync_interval
+        # One entry per (top, bins); the version moves on every catalog change
+        self.cache = RecommendationCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.marker = None
+        self.version = 0
+        self._checked_at = -math.inf
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.syncs = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the thread that keeps the feature store in sync"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="insights-feature-sync", daemon=True)
+            self._thread.start()
+
+    def sync_store(self):
+        """Bring the feature store up to date on a connection of its own"""
+        conn = connect(self.db_path)
+        try:
+            self.store.sync(conn)
+            self.syncs += 1
+        finally:
+            conn.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_store()
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"Feature store sync for insights failed, will retry: {e}")
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+
+    def close(self):
+        """Stop the sync thread"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _store_change_id(self, conn: sqlite3.Connection) -> Optional[int]:
+        """The change the store was last synced to, or None if it was not exported for this database"""
+        manifest = self.store.manifest()
+        if manifest is None or manifest.get("database_id") != database_id(conn):
+            return None
+        return manifest["change_id"]
+
+    def cached(self, top: int, bins: int) -> Optional[Dict[str, Any]]:
+        """Insights from memory, or None if they expired or the catalog is due for a check"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            return None
+        return self.cache.get((top, bins), self.version)
+
+    def get(self, conn: sqlite3.Connection, top: int, bins: int) -> Dict[str, Any]:
+        """Check the catalog marker, then return cached insights or build them"""
+        # Concurrent requests wait for one build and then share it
+        with self._lock:
+            if self.marker is None:
+                # The recommendation service normally creates it, but may not have run yet
+                ensure_change_log(conn)
+            store_change_id = self._store_change_id(conn)
+            marker = catalog_marker(conn) + (store_change_id,)
+            if store_change_id != marker[0]:
+                # Behind the catalog: have the sync thread catch up now instead of at its interval
+                self._wake.set()
+            if marker != self.marker:
+                self.marker = marker
+                self.version += 1
+                self.cache.invalidate(self.version)
+            self._checked_at = time.monotonic()
+            insights = self.cache.get((top, bins), self.version)
+            if insights is None:
+                table = self.store.load() if store_change_id is not None else None
+                insights = build_insights(conn, table, top, bins)
+                self.builds += 1
+                self.cache.put((top, bins), self.version, insights)
+            return insights
+
+_insights: Dict[str, CatalogInsights] = {}
+_insights_lock = threading.Lock()
+
+def get_catalog_insights(db_path: Optional[str] = None) -> CatalogInsights:
+    """Get the shared insights cache for a database file, creating it on first use"""
+    # Creating the pool first also migrates the schema
+    db_path = get_pool(db_path).db_path
+    with _insights_lock:
+        insights = _insights.get(db_path)
+        if insights is None:
+            insights = CatalogInsights(db_path)
+            insights.start()
+            _insights[db_path] = insights
+        return insights
+
+def close_catalog_insights():
+    """Stop the feature store sync threads (on application shutdown)"""
+    with _insights_lock:
+        insights = list(_insights.values())
+        _insights.clear()
+    for catalog_insights in insights:
+        catalog_insights.close()
@@ -0,0 +1,441 @@
+'''
+This file upgrades existing databases to the current schema version.
+
+The applied version is kept in PRAGMA user_version. Each migration (an SQL script, or a
+function for data rewrites SQL cannot express) runs once, in order, inside its own
+transaction together with the version bump, so an interrupted upgrade leaves the database
+at the last fully applied version. The transaction takes the write lock before the version
+is read, so processes starting together never apply a step twice.
+'''
+import sqlite3
+import struct
+from typing import Callable, List, Optional, Tuple, Union
+
+# The audio feature columns of Song, in the order every feature matrix uses; the one list
+# the services and scripts import (migration 3 made them REAL)
+FEATURE_COLUMNS = [
+    "duration", "tempo", "spectral_centroid", "spectral_rolloff",
+    "spectral_contrast", "chroma_mean", "chroma_std",
+    "onset_strength", "zero_crossing_rate", "rms_energy"
+]
+
+def _decode_feature(value) -> Optional[float]:
+    """Recover a float from a feature stored as a blob or text, or None if it is unreadable"""
+    if isinstance(value, bytes):
+        # NumPy scalars and one-element arrays were written as their raw little-endian bytes
+        if len(value) == 8:
+            return struct.unpack("<d", value)[0]
+        if len(value) == 4:
+            return struct.unpack("<f", value)[0]
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _real_feature_columns(conn: sqlite3.Connection):
+    """Rewrite every non-REAL feature value as a REAL and reject non-numeric values from now on"""
+    non_real = " OR ".join(f"typeof({column}) IN ('blob', 'text')" for column in FEATURE_COLUMNS)
+    rows = conn.execute(
+        f"SELECT song_id, {', '.join(FEATURE_COLUMNS)} FROM Song WHERE {non_real}"
+    ).fetchall()
+    for row in rows:
+        conn.execute(
+            f"UPDATE Song SET {', '.join(f'{column} = ?' for column in FEATURE_COLUMNS)} WHERE song_id = ?",
+            [_decode_feature(value) for value in row[1:]] + [row[0]]
+        )
+
+    # SQLite cannot add a CHECK constraint to an existing table, so writes are checked by triggers
+    invalid = " OR ".join(f"typeof(NEW.{column}) IN ('blob', 'text')" for column in FEATURE_COLUMNS)
+    for event in ("INSERT", "UPDATE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS song_features_real_{event.lower()} BEFORE {event} ON Song
+            WHEN {invalid}
+            BEGIN
+                SELECT RAISE(ABORT, 'Song audio features must be REAL values');
+            END
+        """)
+
+# (version, description, SQL script or function of the connection); append new migrations
+# with the next version number
+MIGRATIONS: List[Tuple[int, str, Union[str, Callable[[sqlite3.Connection], None]]]] = [
+    (1, "secondary indexes for lookups, joins and the analysis work queue", """
+        -- Song -> Album joins, album track lists and the (name, album) duplicate check
+        CREATE INDEX IF NOT EXISTS idx_song_album_name ON Song(album_id, name);
+        -- Album -> Artist joins and the (name, artist) duplicate check
+        CREATE INDEX IF NOT EXISTS idx_album_artist_name ON Album(artist_id, name);
+        CREATE INDEX IF NOT EXISTS idx_user_name ON User(name);
+        -- Which playlists contain a song (playlist lookups use the primary key)
+        CREATE INDEX IF NOT EXISTS idx_playlist_song_song ON Playlist_Song(song_id);
+        -- Songs still waiting for audio analysis; the index shrinks as songs are analyzed
+        CREATE INDEX IF NOT EXISTS idx_song_unanalyzed ON Song(song_id) WHERE duration IS NULL;
+    """),
+    (2, "FTS5 name search over artists, albums and songs", """
+        -- External-content indexes: only the tokens are stored, names stay in the base tables
+        CREATE VIRTUAL TABLE IF NOT EXISTS Artist_Search USING fts5(
+            name, content='Artist', content_rowid='artist_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS artist_search_insert AFTER INSERT ON Artist BEGIN
+            INSERT INTO Artist_Search(rowid, name) VALUES (NEW.artist_id, NEW.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS artist_search_delete AFTER DELETE ON Artist BEGIN
+            INSERT INTO Artist_Search(Artist_Search, rowid, name) VALUES ('delete', OLD.artist_id, OLD.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS artist_search_update AFTER UPDATE OF artist_id, name ON Artist BEGIN
+            INSERT INTO Artist_Search(Artist_Search, rowid, name) VALUES ('delete', OLD.artist_id, OLD.name);
+            INSERT INTO Artist_Search(rowid, name) VALUES (NEW.artist_id, NEW.name);
+        END;
+        INSERT INTO Artist_Search(Artist_Search) VALUES ('rebuild');
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS Album_Search USING fts5(
+            name, content='Album', content_rowid='album_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS album_search_insert AFTER INSERT ON Album BEGIN
+            INSERT INTO Album_Search(rowid, name) VALUES (NEW.album_id, NEW.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS album_search_delete AFTER DELETE ON Album BEGIN
+            INSERT INTO Album_Search(Album_Search, rowid, name) VALUES ('delete', OLD.album_id, OLD.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS album_search_update AFTER UPDATE OF album_id, name ON Album BEGIN
+            INSERT INTO Album_Search(Album_Search, rowid, name) VALUES ('delete', OLD.album_id, OLD.name);
+            INSERT INTO Album_Search(rowid, name) VALUES (NEW.album_id, NEW.name);
+        END;
+        INSERT INTO Album_Search(Album_Search) VALUES ('rebuild');
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS Song_Search USING fts5(
+            name, content='Song', content_rowid='song_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS song_search_insert AFTER INSERT ON Song BEGIN
+            INSERT INTO Song_Search(rowid, name) VALUES (NEW.song_id, NEW.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS song_search_delete AFTER DELETE ON Song BEGIN
+            INSERT INTO Song_Search(Song_Search, rowid, name) VALUES ('delete', OLD.song_id, OLD.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS song_search_update AFTER UPDATE OF song_id, name ON Song BEGIN
+            INSERT INTO Song_Search(Song_Search, rowid, name) VALUES ('delete', OLD.song_id, OLD.name);
+            INSERT INTO Song_Search(rowid, name) VALUES (NEW.song_id, NEW.name);
+        END;
+        INSERT INTO Song_Search(Song_Search) VALUES ('rebuild');
+    """),
+    (3, "native REAL audio features, enforced on write", _real_feature_columns),
+    (4, "song name order for paginated song listings", """
+        -- Keyset pages sorted by name; song_id is the rowid, so the index also covers the tie-break.
+        -- NULL names sort as '' so the page cursor can pass them
+        CREATE INDEX IF NOT EXISTS idx_song_name ON Song(COALESCE(name, ''));
+    """),
+    (5, "trigger-maintained catalog, artist, album and playlist counters", """
+        -- Single row of catalog totals
+        CREATE TABLE IF NOT EXISTS Catalog_Totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            artists INTEGER NOT NULL DEFAULT 0,
+            albums INTEGER NOT NULL DEFAULT 0,
+            songs INTEGER NOT NULL DEFAULT 0,
+            analyzed_songs INTEGER NOT NULL DEFAULT 0
+        );
+        -- Songs referencing each album_id
+        CREATE TABLE IF NOT EXISTS Album_Stats (
+            album_id INTEGER PRIMARY KEY,
+            song_count INTEGER NOT NULL DEFAULT 0
+        );
+        -- Albums of each artist, and the songs of those albums
+        CREATE TABLE IF NOT EXISTS Artist_Stats (
+            artist_id INTEGER PRIMARY KEY,
+            album_count INTEGER NOT NULL DEFAULT 0,
+            song_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS Playlist_Stats (
+            user_id INTEGER,
+            playlist_name TEXT,
+            song_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, playlist_name)
+        );
+
+        DELETE FROM Catalog_Totals;
+        INSERT INTO Catalog_Totals (id, artists, albums, songs, analyzed_songs) VALUES (
+            1,
+            (SELECT COUNT(*) FROM Artist),
+            (SELECT COUNT(*) FROM Album),
+            (SELECT COUNT(*) FROM Song),
+            (SELECT COUNT(*) FROM Song WHERE duration IS NOT NULL)
+        );
+        DELETE FROM Album_Stats;
+        INSERT INTO Album_Stats (album_id, song_count)
+            SELECT album_id, COUNT(*) FROM Song WHERE album_id IS NOT NULL GROUP BY album_id;
+        DELETE FROM Artist_Stats;
+        INSERT INTO Artist_Stats (artist_id, album_count, song_count)
+            SELECT al.artist_id, COUNT(*), COALESCE(SUM(st.song_count), 0)
+            FROM Album al LEFT JOIN Album_Stats st ON st.album_id = al.album_id
+            WHERE al.artist_id IS NOT NULL
+            GROUP BY al.artist_id;
+        DELETE FROM Playlist_Stats;
+        INSERT INTO Playlist_Stats (user_id, playlist_name, song_count)
+            SELECT user_id, playlist_name, COUNT(*) FROM Playlist_Song GROUP BY user_id, playlist_name;
+
+        -- Counters are upserted, so they never depend on a stats row having been created first
+        CREATE TRIGGER IF NOT EXISTS artist_counts_insert AFTER INSERT ON Artist BEGIN
+            UPDATE Catalog_Totals SET artists = artists + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS artist_counts_delete AFTER DELETE ON Artist BEGIN
+            UPDATE Catalog_Totals SET artists = artists - 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS album_counts_insert AFTER INSERT ON Album BEGIN
+            UPDATE Catalog_Totals SET albums = albums + 1;
+            INSERT INTO Artist_Stats (artist_id, album_count, song_count)
+                SELECT NEW.artist_id, 1, COALESCE((SELECT song_count FROM Album_Stats WHERE album_id = NEW.album_id), 0)
+                WHERE NEW.artist_id IS NOT NULL
+                ON CONFLICT (artist_id) DO UPDATE SET
+                    album_count = album_count + 1, song_count = song_count + excluded.song_count;
+        END;
+        CREATE TRIGGER IF NOT EXISTS album_counts_delete AFTER DELETE ON Album BEGIN
+            UPDATE Catalog_Totals SET albums = albums - 1;
+            UPDATE Artist_Stats SET
+                album_count = album_count - 1,
+                song_count = song_count - COALESCE((SELECT song_count FROM Album_Stats WHERE album_id = OLD.album_id), 0)
+            WHERE artist_id = OLD.artist_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS album_counts_update AFTER UPDATE OF album_id, artist_id ON Album BEGIN
+            UPDATE Artist_Stats SET
+                album_count = album_count - 1,
+                song_count = song_count - COALESCE((SELECT song_count FROM Album_Stats WHERE album_id = OLD.album_id), 0)
+            WHERE artist_id = OLD.artist_id;
+            INSERT INTO Artist_Stats (artist_id, album_count, song_count)
+                SELECT NEW.artist_id, 1, COALESCE((SELECT song_count FROM Album_Stats WHERE album_id = NEW.album_id), 0)
+                WHERE NEW.artist_id IS NOT NULL
+                ON CONFLICT (artist_id) DO UPDATE SET
+                    album_count = album_count + 1, song_count = song_count + excluded.song_count;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS song_counts_insert AFTER INSERT ON Song BEGIN
+            UPDATE Catalog_Totals SET songs = songs + 1, analyzed_songs = analyzed_songs + (NEW.duration IS NOT NULL);
+            INSERT INTO Album_Stats (album_id, song_count) SELECT NEW.album_id, 1 WHERE NEW.album_id IS NOT NULL
+                ON CONFLICT (album_id) DO UPDATE SET song_count = song_count + 1;
+            UPDATE Artist_Stats SET song_count = song_count + 1
+            WHERE artist_id = (SELECT artist_id FROM Album WHERE album_id = NEW.album_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS song_counts_delete AFTER DELETE ON Song BEGIN
+            UPDATE Catalog_Totals SET songs = songs - 1, analyzed_songs = analyzed_songs - (OLD.duration IS NOT NULL);
+            UPDATE Album_Stats SET song_count = song_count - 1 WHERE album_id = OLD.album_id;
+            UPDATE Artist_Stats SET song_count = song_count - 1
+            WHERE artist_id = (SELECT artist_id FROM Album WHERE album_id = OLD.album_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS song_counts_update AFTER UPDATE OF album_id, duration ON Song BEGIN
+            UPDATE Catalog_Totals SET
+                analyzed_songs = analyzed_songs - (OLD.duration IS NOT NULL) + (NEW.duration IS NOT NULL);
+            UPDATE Album_Stats SET song_count = song_count - 1 WHERE album_id = OLD.album_id;
+            UPDATE Artist_Stats SET song_count = song_count - 1
+            WHERE artist_id = (SELECT artist_id FROM Album WHERE album_id = OLD.album_id);
+            INSERT INTO Album_Stats (album_id, song_count) SELECT NEW.album_id, 1 WHERE NEW.album_id IS NOT NULL
+                ON CONFLICT (album_id) DO UPDATE SET song_count = song_count + 1;
+            UPDATE Artist_Stats SET song_count = song_count + 1
+            WHERE artist_id = (SELECT artist_id FROM Album WHERE album_id = NEW.album_id);
+        END;
+
+        -- Song count of every playlist (keyed by playlist_id from migration 6 on)
+        CREATE TRIGGER IF NOT EXISTS playlist_counts_insert AFTER INSERT ON Playlist_Song BEGIN
+            INSERT INTO Playlist_Stats (user_id, playlist_name, song_count)
+                VALUES (NEW.user_id, NEW.playlist_name, 1)
+                ON CONFLICT (user_id, playlist_name) DO UPDATE SET song_count = song_count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS playlist_counts_delete AFTER DELETE ON Playlist_Song BEGIN
+            UPDATE Playlist_Stats SET song_count = song_count - 1
+            WHERE user_id = OLD.user_id AND playlist_name = OLD.playlist_name;
+        END;
+        CREATE TRIGGER IF NOT EXISTS playlist_counts_update AFTER UPDATE OF user_id, playlist_name ON Playlist_Song BEGIN
+            UPDATE Playlist_Stats SET song_count = song_count - 1
+            WHERE user_id = OLD.user_id AND playlist_name = OLD.playlist_name;
+            INSERT INTO Playlist_Stats (user_id, playlist_name, song_count)
+                VALUES (NEW.user_id, NEW.playlist_name, 1)
+                ON CONFLICT (user_id, playlist_name) DO UPDATE SET song_count = song_count + 1;
+        END;
+    """),
+    (6, "playlist_id surrogate key and gap-ordered playlist songs", """
+        CREATE TABLE Playlist_v6 (
+            playlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            date_created DATETIME,
+            image_url TEXT,
+            UNIQUE (user_id, name),
+            FOREIGN KEY (user_id) REFERENCES User(user_id)
+        );
+        INSERT INTO Playlist_v6 (user_id, name, date_created, image_url)
+            SELECT user_id, name, date_created, image_url FROM Playlist ORDER BY date_created, rowid;
+
+        -- Positions are spaced 1024 apart (playlists.POSITION_GAP) in the order songs were added
+        CREATE TABLE Playlist_Song_v6 (
+            playlist_id INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (playlist_id, song_id),
+            FOREIGN KEY (playlist_id) REFERENCES Playlist(playlist_id),
+            FOREIGN KEY (song_id) REFERENCES Song(song_id)
+        );
+        INSERT INTO Playlist_Song_v6 (playlist_id, song_id, position)
+            SELECT p.playlist_id, ps.song_id,
+                   1024 * ROW_NUMBER() OVER (PARTITION BY p.playlist_id ORDER BY ps.rowid)
+            FROM Playlist_Song ps
+            JOIN Playlist_v6 p ON p.user_id = ps.user_id AND p.name = ps.playlist_name;
+
+        DROP TABLE Playlist_Song;
+        DROP TABLE Playlist;
+        ALTER TABLE Playlist_v6 RENAME TO Playlist;
+        ALTER TABLE Playlist_Song_v6 RENAME TO Playlist_Song;
+        -- Songs of a playlist load in order straight from this index
+        CREATE UNIQUE INDEX idx_playlist_song_position ON Playlist_Song(playlist_id, position);
+        CREATE INDEX idx_playlist_song_song ON Playlist_Song(song_id);
+
+        -- Song counts follow the new key (the old counters were dropped with Playlist_Song)
+        DROP TABLE Playlist_Stats;
+        CREATE TABLE Playlist_Stats (
+            playlist_id INTEGER PRIMARY KEY,
+            song_count INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT INTO Playlist_Stats (playlist_id, song_count)
+            SELECT playlist_id, COUNT(*) FROM Playlist_Song GROUP BY playlist_id;
+        CREATE TRIGGER playlist_counts_insert AFTER INSERT ON Playlist_Song BEGIN
+            INSERT INTO Playlist_Stats (playlist_id, song_count) VALUES (NEW.playlist_id, 1)
+                ON CONFLICT (playlist_id) DO UPDATE SET song_count = song_count + 1;
+        END;
+        CREATE TRIGGER playlist_counts_delete AFTER DELETE ON Playlist_Song BEGIN
+            UPDATE Playlist_Stats SET song_count = song_count - 1 WHERE playlist_id = OLD.playlist_id;
+        END;
+        CREATE TRIGGER playlist_counts_update AFTER UPDATE OF playlist_id ON Playlist_Song BEGIN
+            UPDATE Playlist_Stats SET song_count = song_count - 1 WHERE playlist_id = OLD.playlist_id;
+            INSERT INTO Playlist_Stats (playlist_id, song_count) VALUES (NEW.playlist_id, 1)
+                ON CONFLICT (playlist_id) DO UPDATE SET song_count = song_count + 1;
+        END;
+
+        -- Deleting a playlist removes its songs and counter (foreign keys are not enforced)
+        CREATE TRIGGER playlist_delete_songs AFTER DELETE ON Playlist BEGIN
+            DELETE FROM Playlist_Song WHERE playlist_id = OLD.playlist_id;
+            DELETE FROM Playlist_Stats WHERE playlist_id = OLD.playlist_id;
+        END;
+    """),
+    (7, "History keyed by a row ID, so plays in the same second do not collide", """
+        CREATE TABLE History_v7 (
+            history_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            song_id INTEGER NOT NULL,
+            played_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES User(user_id),
+            FOREIGN KEY (song_id) REFERENCES Song(song_id)
+        );
+        INSERT INTO History_v7 (user_id, song_id, played_at)
+            SELECT user_id, song_id, COALESCE(played_at, CURRENT_TIMESTAMP) FROM History
+            WHERE user_id IS NOT NULL AND song_id IS NOT NULL
+            ORDER BY played_at;
+        DROP TABLE History;
+        ALTER TABLE History_v7 RENAME TO History;
+        -- A user's recent plays, newest first
+        CREATE INDEX idx_history_user_played ON History(user_id, played_at);
+    """),
+    (8, "trigger-maintained genre counters and song count order for catalog insights", """
+        -- Songs and analyzed songs per genre; songs without a genre are counted under ''
+        CREATE TABLE IF NOT EXISTS Genre_Stats (
+            genre TEXT PRIMARY KEY,
+            song_count INTEGER NOT NULL DEFAULT 0,
+            analyzed_songs INTEGER NOT NULL DEFAULT 0
+        );
+        DELETE FROM Genre_Stats;
+        INSERT INTO Genre_Stats (genre, song_count, analyzed_songs)
+            SELECT COALESCE(genre, ''), COUNT(*), COUNT(duration) FROM Song GROUP BY COALESCE(genre, '');
+
+        CREATE TRIGGER IF NOT EXISTS genre_counts_insert AFTER INSERT ON Song BEGIN
+            INSERT INTO Genre_Stats (genre, song_count, analyzed_songs)
+                VALUES (COALESCE(NEW.genre, ''), 1, NEW.duration IS NOT NULL)
+                ON CONFLICT (genre) DO UPDATE SET
+                    song_count = song_count + 1, analyzed_songs = analyzed_songs + excluded.analyzed_songs;
+        END;
+        CREATE TRIGGER IF NOT EXISTS genre_counts_delete AFTER DELETE ON Song BEGIN
+            UPDATE Genre_Stats SET
+                song_count = song_count - 1, analyzed_songs = analyzed_songs - (OLD.duration IS NOT NULL)
+            WHERE genre = COALESCE(OLD.genre, '');
+        END;
+        CREATE TRIGGER IF NOT EXISTS genre_counts_update AFTER UPDATE OF genre, duration ON Song BEGIN
+            UPDATE Genre_Stats SET
+                song_count = song_count - 1, analyzed_songs = analyzed_songs - (OLD.duration IS NOT NULL)
+            WHERE genre = COALESCE(OLD.genre, '');
+            INSERT INTO Genre_Stats (genre, song_count, analyzed_songs)
+                VALUES (COALESCE(NEW.genre, ''), 1, NEW.duration IS NOT NULL)
+                ON CONFLICT (genre) DO UPDATE SET
+                    song_count = song_count + 1, analyzed_songs = analyzed_songs + excluded.analyzed_songs;
+        END;
+
+        -- Top artists and albums by song count, read from the end of the index
+        CREATE INDEX IF NOT EXISTS idx_artist_stats_song_count ON Artist_Stats(song_count);
+        CREATE INDEX IF NOT EXISTS idx_album_stats_song_count ON Album_Stats(song_count);
+    """),
+    (9, "index artists and albums by name for the catalog pages", """
+        -- Pages are ordered by (name, ID); NULL names sort as '' so the cursor can pass them
+        CREATE INDEX IF NOT EXISTS idx_artist_page ON Artist(COALESCE(name, ''));
+        CREATE INDEX IF NOT EXISTS idx_album_page ON Album(COALESCE(name, ''));
+    """),
+    (10, "database identity and change log consumer checkpoints", """
+        -- A random ID per database, so state saved for one database is never loaded for another
+        CREATE TABLE IF NOT EXISTS Database_Identity (
+            database_id TEXT NOT NULL
+        );
+        INSERT INTO Database_Identity (database_id)
+            SELECT lower(hex(randomblob(16))) WHERE NOT EXISTS (SELECT 1 FROM Database_Identity);
+        -- The last change each consumer of Song_Change_Log saved; older changes can be pruned
+        CREATE TABLE IF NOT EXISTS Change_Log_Consumer (
+            name TEXT PRIMARY KEY,
+            change_id INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Get the version the database was last migrated to"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _statements(script: str) -> List[str]:
+    """Split an SQL script into complete statements (trigger bodies stay whole)"""
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current)
+            current = ""
+    return statements
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply every migration newer than the database's version.
+
+    Returns:
+        The schema version after migrating
+    """
+    version = schema_version(conn)
+    for target, description, script in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            # Take the write lock first, then check again: another process may have applied it
+            conn.execute("BEGIN IMMEDIATE")
+            version = schema_version(conn)
+            if target <= version:
+                conn.rollback()
+                continue
+            print(f"Migrating database to version {target}: {description}")
+            if callable(script):
+                script(conn)
+            else:
+                # Statement by statement: executescript would commit the open transaction
+                for statement in _statements(script):
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        version = target
+    return version
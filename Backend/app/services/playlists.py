@@ -0,0 +1,242 @@
+'''
+This file stores the songs of a playlist in order.
+
+Playlists are keyed by an integer playlist_id, and every Playlist_Song row has a position.
+Positions are spaced POSITION_GAP apart, so a song is inserted or moved between two
+neighbours by giving it the midpoint of their positions and no other row is touched. Only
+when two neighbours have no gap left is the playlist renumbered.
+
+Bulk changes take the write lock first, so the positions and songs they read cannot change
+before they write. They check every requested song ID in one query, write with executemany
+and report an outcome for each ID; IDs that are not 64-bit integers are reported "invalid".
+Callers commit.
+'''
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from app.services.database import fits_sqlite_integer
+
+POSITION_GAP = 1024
+
+def get_playlist_id(conn: sqlite3.Connection, user_id: int, name: str) -> Optional[int]:
+    """Look up a playlist by owner and name"""
+    row = conn.execute(
+        "SELECT playlist_id FROM Playlist WHERE user_id = ? AND name = ?", (user_id, name)
+    ).fetchone()
+    return row[0] if row else None
+
+def playlist_song_ids(conn: sqlite3.Connection, playlist_id: int) -> List[int]:
+    """The songs of a playlist in order"""
+    return [row[0] for row in conn.execute(
+        "SELECT song_id FROM Playlist_Song WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+    )]
+
+def _begin_write(conn: sqlite3.Connection):
+    """Take the database write lock before reading what the change depends on"""
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+def _check_songs(conn: sqlite3.Connection, playlist_id: int, song_ids: Sequence) -> Tuple[List[Optional[int]], Set[int], Set[int]]:
+    """
+    Look up the requested songs in one query, through a temporary table of their IDs.
+
+    Returns:
+        The IDs as integers (None where an ID is not a 64-bit integer), the IDs that exist
+        in Song, and the IDs already in the playlist
+    """
+    _begin_write(conn)
+    ids = []
+    for song_id in song_ids:
+        try:
+            song_id = int(song_id)
+        except (TypeError, ValueError):
+            song_id = None
+        ids.append(song_id if song_id is not None and fits_sqlite_integer(song_id) else None)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS Requested_Song (song_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.Requested_Song")
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp.Requested_Song (song_id) VALUES (?)",
+        [(song_id,) for song_id in ids if song_id is not None]
+    )
+    # Playlist entries are looked up on their own: one whose song was deleted without the
+    # foreign key cascade is still in the playlist, so it can be removed
+    rows = conn.execute("""
+        SELECT r.song_id, s.song_id IS NOT NULL, ps.song_id IS NOT NULL
+        FROM temp.Requested_Song r
+        LEFT JOIN Song s ON s.song_id = r.song_id
+        LEFT JOIN Playlist_Song ps ON ps.playlist_id = ? AND ps.song_id = r.song_id
+    """, (playlist_id,)).fetchall()
+    conn.execute("DELETE FROM temp.Requested_Song")
+    return ids, {row[0] for row in rows if row[1]}, {row[0] for row in rows if row[2]}
+
+def _write_order(conn: sqlite3.Connection, playlist_id: int, song_ids: List[int]):
+    """Give song_ids positions POSITION_GAP apart in the given order, inserting any that are new"""
+    # Negate first so no new position collides with an old one in the unique index
+    conn.execute("UPDATE Playlist_Song SET position = -position WHERE playlist_id = ?", (playlist_id,))
+    conn.executemany("""
+        INSERT INTO Playlist_Song (playlist_id, song_id, position) VALUES (?, ?, ?)
+        ON CONFLICT (playlist_id, song_id) DO UPDATE SET position = excluded.position
+    """, [(playlist_id, song_id, (i + 1) * POSITION_GAP) for i, song_id in enumerate(song_ids)])
+
+def renumber(conn: sqlite3.Connection, playlist_id: int):
+    """Space a playlist's positions POSITION_GAP apart again, keeping its order"""
+    _write_order(conn, playlist_id, playlist_song_ids(conn, playlist_id))
+
+def add_songs(
+    conn: sqlite3.Connection,
+    playlist_id: int,
+    song_ids: Sequence,
+    index: Optional[int] = None
+) -> List[Dict[str, str]]:
+    """
+    Add songs to a playlist in the given order, at the end or starting at index (0 = first).
+
+    Returns:
+        One {"song_id", "status"} per requested ID, where status is "added", "invalid",
+        "not_found", "already_in_playlist" or "duplicate" (repeated in the request)
+    """
+    ids, known, present = _check_songs(conn, playlist_id, song_ids)
+    outcomes, new_ids, seen = [], [], set()
+    for song_id, requested in zip(ids, song_ids):
+        if song_id is None:
+            status = "invalid"
+        elif song_id not in known:
+            status = "not_found"
+        elif song_id in present:
+            status = "already_in_playlist"
+        elif song_id in seen:
+            status = "duplicate"
+        else:
+            status = "added"
+            new_ids.append(song_id)
+        seen.add(song_id)
+        outcomes.append({"song_id": str(requested), "status": status})
+    if not new_ids:
+        return outcomes
+
+    count = conn.execute("SELECT COUNT(*) FROM Playlist_Song WHERE playlist_id = ?", (playlist_id,)).fetchone()[0]
+    if index is None or index >= count:
+        last = conn.execute(
+            "SELECT COALESCE(MAX(position), 0) FROM Playlist_Song WHERE playlist_id = ?", (playlist_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO Playlist_Song (playlist_id, song_id, position) VALUES (?, ?, ?)",
+            [(playlist_id, song_id, last + (i + 1) * POSITION_GAP) for i, song_id in enumerate(new_ids)]
+        )
+        return outcomes
+
+    # Spread the new songs evenly over the gap they go into, or renumber if it is too small
+    neighbour = "SELECT position FROM Playlist_Song WHERE playlist_id = ? ORDER BY position LIMIT 1 OFFSET ?"
+    before = conn.execute(neighbour, (playlist_id, index - 1)).fetchone()[0] if index > 0 else 0
+    after = conn.execute(neighbour, (playlist_id, index)).fetchone()[0]
+    step = (after - before) // (len(new_ids) + 1)
+    if step:
+        conn.executemany(
+            "INSERT INTO Playlist_Song (playlist_id, song_id, position) VALUES (?, ?, ?)",
+            [(playlist_id, song_id, before + (i + 1) * step) for i, song_id in enumerate(new_ids)]
+        )
+    else:
+        order = playlist_song_ids(conn, playlist_id)
+        _write_order(conn, playlist_id, order[:index] + new_ids + order[index:])
+    return outcomes
+
+def remove_songs(conn: sqlite3.Connection, playlist_id: int, song_ids: Sequence) -> List[Dict[str, str]]:
+    """
+    Remove songs from a playlist.
+
+    Returns:
+        One {"song_id", "status"} per requested ID, where status is "removed", "invalid",
+        "not_in_playlist" or "duplicate" (repeated in the request)
+    """
+    ids, _, present = _check_songs(conn, playlist_id, song_ids)
+    outcomes, seen = [], set()
+    for song_id, requested in zip(ids, song_ids):
+        if song_id is None:
+            status = "invalid"
+        elif song_id not in present:
+            status = "not_in_playlist"
+        elif song_id in seen:
+            status = "duplicate"
+        else:
+            status = "removed"
+        seen.add(song_id)
+        outcomes.append({"song_id": str(requested), "status": status})
+    conn.executemany(
+        "DELETE FROM Playlist_Song WHERE playlist_id = ? AND song_id = ?",
+        [(playlist_id, song_id) for song_id in present]
+    )
+    return outcomes
+
+def replace_songs(conn: sqlite3.Connection, playlist_id: int, song_ids: Sequence) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Make a playlist exactly the given songs, in order, skipping IDs that are not songs.
+
+    Returns:
+        One {"song_id", "status"} per requested ID, where status is "added", "kept",
+        "invalid", "not_found" or "duplicate", and how many songs were dropped from the playlist
+    """
+    ids, known, present = _check_songs(conn, playlist_id, song_ids)
+    outcomes, order, seen = [], [], set()
+    for song_id, requested in zip(ids, song_ids):
+        if song_id is None:
+            status = "invalid"
+        elif song_id not in known:
+            status = "not_found"
+        elif song_id in seen:
+            status = "duplicate"
+        else:
+            status = "kept" if song_id in present else "added"
+            order.append(song_id)
+        seen.add(song_id)
+        outcomes.append({"song_id": str(requested), "status": status})
+
+    kept = set(order)
+    dropped = [song_id for song_id in playlist_song_ids(conn, playlist_id) if song_id not in kept]
+    conn.executemany(
+        "DELETE FROM Playlist_Song WHERE playlist_id = ? AND song_id = ?",
+        [(playlist_id, song_id) for song_id in dropped]
+    )
+    _write_order(conn, playlist_id, order)
+    return outcomes, len(dropped)
+
+def _position_at(conn: sqlite3.Connection, playlist_id: int, song_id, index: int) -> Optional[int]:
+    """A free position between the songs that will surround index, or None if there is no gap"""
+    # Neighbours are counted without the song itself, so moving it never lands next to itself
+    neighbours = [row[0] for row in conn.execute("""
+        SELECT position FROM Playlist_Song
+        WHERE playlist_id = ? AND song_id != ?
+        ORDER BY position LIMIT 2 OFFSET ?
+    """, (playlist_id, song_id, max(index - 1, 0)))]
+    if index == 0:
+        before, after = 0, neighbours[0] if neighbours else None
+    else:
+        before = neighbours[0] if neighbours else None
+        after = neighbours[1] if len(neighbours) > 1 else None
+        if before is None:
+            # Past the end: append
+            before = conn.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM Playlist_Song WHERE playlist_id = ? AND song_id != ?",
+                (playlist_id, song_id)
+            ).fetchone()[0]
+    if after is None:
+        return before + POSITION_GAP
+    if after - before > 1:
+        return (before + after) // 2
+    return None
+
+def place_song(conn: sqlite3.Connection, playlist_id: int, song_id, index: int) -> bool:
+    """Move a song of a playlist to index (0 = first); False if the song is not in the playlist"""
+    # Checked under the write lock, so a song removed concurrently is never put back
+    _begin_write(conn)
+    if conn.execute(
+        "SELECT 1 FROM Playlist_Song WHERE playlist_id = ? AND song_id = ?", (playlist_id, song_id)
+    ).fetchone() is None:
+        return False
+    position = _position_at(conn, playlist_id, song_id, index)
+    if position is None:
+        renumber(conn, playlist_id)
+        position = _position_at(conn, playlist_id, song_id, index)
+    cursor = conn.execute(
+        "UPDATE Playlist_Song SET position = ? WHERE playlist_id = ? AND song_id = ?",
+        (position, playlist_id, song_id)
+    )
+    return cursor.rowcount > 0
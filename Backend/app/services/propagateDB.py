@@ -2,7 +2,7 @@
 This file is used to populate the database with data from Spotify.
 '''
 import os
-import sqlite3
+import sys
 import random
 import string
 import time
@@ -11,6 +11,11 @@ from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 
+# Add the Backend directory to the Python path, so the script also runs on its own
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.database import connect
+
 # Load environment variables from .env file
 env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), '.env')
 load_dotenv(env_path)
@@ -28,7 +33,7 @@ sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 DB_PATH = os.path.join(root_dir, "Database/music_app.db")
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-conn = sqlite3.connect(DB_PATH)
+conn = connect(DB_PATH)
 cur = conn.cursor()
 
 def get_random_query():
@@ -0,0 +1,76 @@
+'''
+This file defines a bounded LRU + TTL cache for built recommendation responses.
+
+Every entry remembers the index version it was computed against. When the recommendation
+index is rebuilt, entries from older versions are dropped, so a cached response can never
+outlive the catalog state it describes.
+'''
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import threading
+import time
+
+class RecommendationCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        """Return the cached value for key, or None if it is missing, expired or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, entry_version, expires_at, size = entry
+                if entry_version == version and time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, version: int, value: Any, size: int = 0):
+        """Store a value computed against the given index version"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, version, time.monotonic() + self.ttl_seconds, size)
+            self.memory_bytes += size
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, version: int):
+        """Drop every entry computed against a version other than the current one"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] != version]
+            for key in stale:
+                self._drop(key)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.memory_bytes = 0
+
+    def _drop(self, key: Hashable):
+        self.memory_bytes -= self._entries.pop(key)[3]
+
+    def stats(self) -> Dict[str, Any]:
+        """Report the cache size and effectiveness"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self.memory_bytes,
+        }
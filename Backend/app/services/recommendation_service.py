@@ -1,78 +1,404 @@
 '''
-This file is used to recommend songs based on the k-d tree nearest neighbors algorithm.
+This file is used to recommend songs based on nearest neighbors in audio feature space.
+The index backend is pluggable (see ann_index.py): an exact k-d tree by default, or an
+approximate IVF index for very large catalogs.
+
+The service keeps one connection and one in-memory index, so its public methods run on a
+single worker thread of their own, one call at a time, and never block the event loop.
 '''
-from app.models.song import Song, RecommendationResponse
-from typing import List, Optional, Tuple, Union
+from app.models.song import (
+    Song,
+    RecommendationResponse,
+    RecommendationFilters,
+    SimilarArtist,
+    SimilarArtistsResponse
+)
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple, TypeVar, Union
+import functools
 import random
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime
+from collections import deque
+from itertools import islice, zip_longest
 import numpy as np
-from scipy.spatial import cKDTree
+from app.services.ann_index import IncrementalIndex, kmeans
+from app.services.catalog_changes import (
+    changes_available, database_id, ensure_change_log, fetch_changes, latest_change_id, save_checkpoint
+)
+from app.services.feature_stats import FeatureStats
+from app.services.recommendation_cache import RecommendationCache
+from app.services.artist_centroids import ArtistCentroids, NO_ARTIST
+from app.services.diversity import mmr_rerank
+from app.services.song_embeddings import ensure_embedding_table, load_embeddings, read_embeddings
+from app.services.database import DatabaseExecutor, connect
+from app.services.feature_store import FEATURE_COLUMNS, FeatureStore, read_feature_rows, scan_feature_table
+from app.services.migrations import migrate
+
+DEFAULT_FEATURE_WEIGHTS = {column: 1.0 for column in FEATURE_COLUMNS}
+
+T = TypeVar("T")
+
+def off_loop(method: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    """Make a blocking service method awaitable; it runs on the service's worker thread"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        def call():
+            with self._lock:
+                return method(self, *args, **kwargs)
+        return await self._executor.run(call, with_connection=False)
+    return wrapper
 
 class RecommendationService:
-    def __init__(self):
+    def __init__(
+        self,
+        index_backend: Optional[str] = None,
+        index_options: Optional[dict] = None,
+        db_path: Optional[str] = None,
+        drift_threshold: float = 0.05,
+        refresh_interval: float = 5.0,
+        cache_size: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+        diversity_pool_size: int = 200,
+        cascade: Optional[bool] = None,
+        cascade_pool_size: int = 300
+    ):
+        # Nearest neighbor backend: "kdtree" (exact) or "ivf" (approximate, for large catalogs)
+        self.index_backend = index_backend or os.getenv("RECOMMENDATION_INDEX_BACKEND", "kdtree")
+        self.index_options = index_options or {}
+        # Reproject every song only once the normalization stats move this far (see FeatureStats.drift)
+        self.drift_threshold = drift_threshold
+        # Minimum seconds between two checks of the change log
+        self.refresh_interval = refresh_interval
+        self.feature_weights = dict(DEFAULT_FEATURE_WEIGHTS)
+        # Nearest neighbors fetched before diversity reranking picks the final list
+        self.diversity_pool_size = diversity_pool_size
+        # Cascade mode: coarse candidates from the index, reranked exactly on MFCC/chroma embeddings
+        self.cascade = cascade if cascade is not None else os.getenv("RECOMMENDATION_CASCADE", "0").lower() in ("1", "true", "yes")
+        self.cascade_pool_size = cascade_pool_size
+
+        # Built responses, dropped automatically whenever the index version changes
+        self.cache = RecommendationCache(
+            max_entries=cache_size if cache_size is not None else int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024")),
+            ttl_seconds=cache_ttl if cache_ttl is not None else float(os.getenv("RECOMMENDATION_CACHE_TTL", "300"))
+        )
+
         # Connect to the SQLite database
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        db_path = os.path.join(root_dir, "../Database/music_app.db")
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row  # This enables column access by name
+        if db_path is None:
+            root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+            db_path = os.path.join(root_dir, "../Database/music_app.db")
+        self.db_path = db_path
+        self.index_path = os.path.splitext(db_path)[0] + "_index.npz"
+        self.feature_store = FeatureStore.for_database(db_path)
+        # Long-lived tuned connection (WAL, mmap, statement cache); it also returns sqlite3.Row rows
+        self.conn = connect(db_path)
         self.cursor = self.conn.cursor()
-        self._build_feature_tree()
+        # Every use of the connection and the index holds the lock; off_loop methods run here
+        self._lock = threading.RLock()
+        self._executor = DatabaseExecutor(db_path, max_workers=1)
+        ensure_change_log(self.conn)
+        ensure_embedding_table(self.conn)
+        migrate(self.conn)
+        self.database_id = database_id(self.conn)
+
+        self.index_version = 0
+        self._last_refresh_check = time.monotonic()
+        if not self._load_index():
+            self._build_feature_tree()
+            self._save_index()
+
+    def _read_index_rows(self, where: str = "", params: tuple = ()) -> Tuple[np.ndarray, ...]:
+        """
+        Read analyzed songs for the index.
+
+        Returns:
+            Song IDs, artist IDs (NO_ARTIST if unknown), album IDs, genre strings and
+            the raw feature matrix
+        """
+        return tuple(read_feature_rows(self.conn, where, params))
 
     def _build_feature_tree(self):
-        """Build a k-d tree of song features for efficient nearest neighbor search"""
-        # Get all songs and their features
-        self.cursor.execute("""
-            SELECT song_id, duration, tempo, spectral_centroid, spectral_rolloff,
-                   spectral_contrast, chroma_mean, chroma_std,
-                   onset_strength, zero_crossing_rate, rms_energy
-            FROM Song
-            WHERE duration IS NOT NULL 
-              AND tempo IS NOT NULL
-              AND spectral_centroid IS NOT NULL
-        """)
-        rows = self.cursor.fetchall()
-        
-        # Store song IDs for later reference
-        self.song_ids = [row['song_id'] for row in rows]
-        
-        # Create feature matrix
-        features = np.array([
-            [
-                float.fromhex(row['duration'].hex()) if isinstance(row['duration'], bytes) else float(row['duration']),
-                float.fromhex(row['tempo'].hex()) if isinstance(row['tempo'], bytes) else float(row['tempo']),
-                float.fromhex(row['spectral_centroid'].hex()) if isinstance(row['spectral_centroid'], bytes) else float(row['spectral_centroid']),
-                float.fromhex(row['spectral_rolloff'].hex()) if isinstance(row['spectral_rolloff'], bytes) else float(row['spectral_rolloff']),
-                float.fromhex(row['spectral_contrast'].hex()) if isinstance(row['spectral_contrast'], bytes) else float(row['spectral_contrast']),
-                float.fromhex(row['chroma_mean'].hex()) if isinstance(row['chroma_mean'], bytes) else float(row['chroma_mean']),
-                float.fromhex(row['chroma_std'].hex()) if isinstance(row['chroma_std'], bytes) else float(row['chroma_std']),
-                float.fromhex(row['onset_strength'].hex()) if isinstance(row['onset_strength'], bytes) else float(row['onset_strength']),
-                float.fromhex(row['zero_crossing_rate'].hex()) if isinstance(row['zero_crossing_rate'], bytes) else float(row['zero_crossing_rate']),
-                float.fromhex(row['rms_energy'].hex()) if isinstance(row['rms_energy'], bytes) else float(row['rms_energy'])
+        """Build the nearest neighbor index from the columnar feature store"""
+        # The store catches up on the change log, then its files are mapped instead of scanning Song
+        try:
+            self.feature_store.sync(self.conn)
+            table = self.feature_store.load()
+        except (OSError, ValueError) as e:
+            print(f"Could not use the feature store {self.feature_store.directory}, scanning Song: {e}")
+            table = None
+        if table is None:
+            table = scan_feature_table(self.conn)
+        self.change_id = table.change_id
+
+        # Song, artist and album IDs are stored by index position for later reference;
+        # copies, because refresh() updates them in place
+        self.song_ids = np.array(table.song_ids)
+        self.song_artist_ids = np.array(table.artist_ids)
+        self.song_album_ids = np.array(table.album_ids)
+        self.song_genre_codes = np.array(table.genre_codes)
+        self.genre_labels = table.genre_labels
+        self.genre_codes = {label: code for code, label in enumerate(self.genre_labels)}
+        self.features = np.array(table.features)
+
+        self.stats = FeatureStats.from_matrix(self.features)
+        self.artists = ArtistCentroids.from_songs(self.song_artist_ids, self.features)
+        self._reproject()
+        self._build_index()
+
+    def _reproject(self):
+        """Freeze the current stats as the normalization and renormalize every song"""
+        self.feature_mean = self.stats.mean.copy()
+        self.feature_std = self.stats.std
+        self.normalized_features = self._normalize_matrix(self.features)
+
+    def _normalize_matrix(self, features: np.ndarray) -> np.ndarray:
+        """Normalize raw feature vectors (one per row) with the current projection"""
+        return (features - self.feature_mean) / self.feature_std
+
+    def _build_index(self):
+        """Build the nearest neighbor indexes over the normalized features (once, at startup)"""
+        self.positions = {int(song_id): pos for pos, song_id in enumerate(self.song_ids)}
+        self.feature_index = IncrementalIndex(self.normalized_features, self.index_backend, **self.index_options)
+        # The index owns the normalized rows from now on and updates them in place
+        self.normalized_features = self.feature_index.data
+        self.artists.rebuild_tree(self._normalize_matrix)
+        if self.cascade:
+            self.embeddings, self.has_embedding, self.embedding_scale = load_embeddings(self.conn, self.song_ids)
+        self._index_changed()
+
+    def _update_embeddings(self, positions: np.ndarray, removed: np.ndarray):
+        """Read the embeddings of changed songs only, keeping the standardization of the full load"""
+        added = len(self.song_ids) - len(self.embeddings)
+        if added:
+            self.embeddings = np.concatenate([self.embeddings, np.zeros((added, self.embeddings.shape[1]), dtype=np.float32)])
+            self.has_embedding = np.concatenate([self.has_embedding, np.zeros(added, dtype=bool)])
+        self.has_embedding[removed] = False
+        vectors, present = read_embeddings(self.conn, self.song_ids[positions], self.embedding_scale)
+        self.embeddings[positions] = vectors
+        self.has_embedding[positions] = present
+
+    def _index_changed(self):
+        """Drop the cached responses and per-genre masks after the index changed"""
+        # Per-genre position masks are rebuilt lazily for the new positions
+        self._genre_masks = {}
+        self.index_version += 1
+        self.cache.invalidate(self.index_version)
+
+    def _load_index(self) -> bool:
+        """Load the persisted features and stats, then catch up on changes made since"""
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path) as saved:
+                change_id = int(saved["change_id"])
+                saved_database_id = str(saved["database_id"]) if "database_id" in saved.files else None
+                if (saved_database_id != self.database_id
+                        or change_id > latest_change_id(self.conn)
+                        or not changes_available(self.conn, change_id)):
+                    # Saved for another (or a recreated) database, or the changes since were pruned
+                    return False
+                self.change_id = change_id
+                self.song_ids = saved["song_ids"]
+                self.song_artist_ids = saved["song_artist_ids"]
+                self.song_album_ids = saved["song_album_ids"]
+                self.song_genre_codes = saved["song_genre_codes"]
+                self.genre_labels = [str(label) for label in saved["genre_labels"]]
+                self.genre_codes = {label: code for code, label in enumerate(self.genre_labels)}
+                self.features = saved["features"]
+                self.stats = FeatureStats.from_arrays(saved)
+                self.feature_mean = saved["feature_mean"]
+                self.feature_std = saved["feature_std"]
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Ignoring unreadable recommendation index {self.index_path}: {e}")
+            return False
+
+        self.artists = ArtistCentroids.from_songs(self.song_artist_ids, self.features)
+        self.normalized_features = self._normalize_matrix(self.features)
+        self._build_index()
+        self.refresh(force=True)
+        return True
+
+    def _save_index(self):
+        """Persist the features and normalization stats of the live songs next to the database"""
+        temp_path = self.index_path + ".tmp.npz"
+        live = ~self.feature_index.removed
+        try:
+            np.savez(
+                temp_path,
+                database_id=np.array(self.database_id),
+                change_id=np.array(self.change_id),
+                song_ids=self.song_ids[live],
+                song_artist_ids=self.song_artist_ids[live],
+                song_album_ids=self.song_album_ids[live],
+                song_genre_codes=self.song_genre_codes[live],
+                genre_labels=np.array(self.genre_labels, dtype=str),
+                features=self.features[live],
+                feature_mean=self.feature_mean,
+                feature_std=self.feature_std,
+                **self.stats.to_arrays()
+            )
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not persist recommendation index: {e}")
+            return
+        # Changes up to here are no longer needed to rebuild this index after a restart
+        try:
+            save_checkpoint(self.conn, "recommendation index", self.change_id)
+        except sqlite3.Error as e:
+            print(f"Could not save the recommendation index checkpoint: {e}")
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Apply songs inserted, updated or deleted since the last refresh.
+
+        Only the changed songs are read, and the normalization stats, artist centroids
+        and nearest neighbor index are updated incrementally: positions never move, so
+        removed songs are only left out of searches, and the index rebuilds itself in the
+        background once enough songs changed (see IncrementalIndex). Every song is
+        reprojected only when the stats drift past drift_threshold; otherwise changed
+        songs are normalized with the current stats.
+
+        Returns:
+            True if the index changed
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh_check < self.refresh_interval:
+            return False
+        self._last_refresh_check = now
+
+        changed_ids, change_id = fetch_changes(self.conn, self.change_id)
+        if not changed_ids:
+            return False
+
+        # Current state of every changed song; missing or unanalyzed songs leave the index
+        current = {}
+        for start in range(0, len(changed_ids), 500):
+            chunk = changed_ids[start:start + 500]
+            song_ids, artist_ids, album_ids, genres, features = self._read_index_rows(
+                f"AND s.song_id IN ({', '.join('?' * len(chunk))})", tuple(chunk)
+            )
+            for row in zip(song_ids, artist_ids, album_ids, genres, features):
+                current[int(row[0])] = (int(row[1]), int(row[2]), self._genre_code(row[3]), row[4])
+
+        removed = []
+        updated = []
+        new_ids = []
+        new_artist_ids = []
+        new_album_ids = []
+        new_genre_codes = []
+        new_features = []
+        for song_id in changed_ids:
+            pos = self.positions.get(song_id)
+            artist_id, album_id, genre_code, vector = current.get(song_id, (NO_ARTIST, 0, 0, None))
+            if pos is not None:
+                self.stats.remove(self.features[pos])
+                self.artists.remove(int(self.song_artist_ids[pos]), self.features[pos])
+                if vector is None:
+                    # The row stays until the index is saved and loaded again, owned by no one
+                    del self.positions[song_id]
+                    self.song_artist_ids[pos] = NO_ARTIST
+                    removed.append(pos)
+                    continue
+                self.features[pos] = vector
+                self.song_artist_ids[pos] = artist_id
+                self.song_album_ids[pos] = album_id
+                self.song_genre_codes[pos] = genre_code
+                updated.append(pos)
+            elif vector is None:
+                continue
+            else:
+                new_ids.append(song_id)
+                new_artist_ids.append(artist_id)
+                new_album_ids.append(album_id)
+                new_genre_codes.append(genre_code)
+                new_features.append(vector)
+            self.stats.add(vector)
+            self.artists.add(artist_id, vector)
+
+        first = len(self.song_ids)
+        new_features = np.array(new_features, dtype=np.float64).reshape(-1, len(FEATURE_COLUMNS))
+        self.song_ids = np.concatenate([self.song_ids, np.array(new_ids, dtype=np.int64)])
+        self.song_artist_ids = np.concatenate([self.song_artist_ids, np.array(new_artist_ids, dtype=np.int64)])
+        self.song_album_ids = np.concatenate([self.song_album_ids, np.array(new_album_ids, dtype=np.int64)])
+        self.song_genre_codes = np.concatenate([self.song_genre_codes, np.array(new_genre_codes, dtype=np.int64)])
+        self.features = np.concatenate([self.features, new_features])
+        self.positions.update({song_id: first + i for i, song_id in enumerate(new_ids)})
+        self.change_id = change_id
+
+        removed = np.array(removed, dtype=np.intp)
+        updated = np.array(updated, dtype=np.intp)
+        self.feature_index.remove(removed)
+        if self.stats.drift(self.feature_mean, self.feature_std) > self.drift_threshold:
+            self._reproject()
+            self.feature_index.add(self.normalized_features[first:])
+            self.feature_index.replace(self.normalized_features)
+        else:
+            self.feature_index.update(updated, self._normalize_matrix(self.features[updated]))
+            self.feature_index.add(self._normalize_matrix(new_features))
+        self.normalized_features = self.feature_index.data
+        self.artists.rebuild_tree(self._normalize_matrix)
+        if self.cascade:
+            self._update_embeddings(np.concatenate([updated, np.arange(first, len(self.song_ids))]), removed)
+        self._index_changed()
+        self._save_index()
+        return True
+
+    def _genre_code(self, genre: str) -> int:
+        """Intern a raw genre string; songs with the same genre string share one code"""
+        code = self.genre_codes.get(genre)
+        if code is None:
+            code = len(self.genre_labels)
+            self.genre_codes[genre] = code
+            self.genre_labels.append(genre)
+        return code
+
+    def _genre_mask(self, genre: str) -> np.ndarray:
+        """Positions of songs tagged with a genre, cached until the index is rebuilt"""
+        genre = genre.strip().lower()
+        mask = self._genre_masks.get(genre)
+        if mask is None:
+            matching = [
+                code for code, label in enumerate(self.genre_labels)
+                if genre in (part.strip().lower() for part in label.split(','))
             ]
-            for row in rows
-        ], dtype=np.float64)
-        
-        # Normalize features to [0,1] range
-        self.feature_min = features.min(axis=0)
-        self.feature_max = features.max(axis=0)
-        normalized_features = (features - self.feature_min) / (self.feature_max - self.feature_min)
-        
-        # Build k-d tree
-        self.feature_tree = cKDTree(normalized_features)
+            mask = np.isin(self.song_genre_codes, matching)
+            self._genre_masks[genre] = mask
+        return mask
+
+    def _filter_exclude_mask(self, filters: Optional[RecommendationFilters]) -> Optional[np.ndarray]:
+        """Turn filter predicates into a mask of index positions the search must skip"""
+        if filters is None:
+            return None
+        allowed = np.ones(len(self.song_ids), dtype=bool)
+        if filters.genres:
+            genre_allowed = np.zeros(len(self.song_ids), dtype=bool)
+            for genre in filters.genres:
+                genre_allowed |= self._genre_mask(genre)
+            allowed &= genre_allowed
+        for column, low, high in (
+            ("duration", filters.min_duration, filters.max_duration),
+            ("tempo", filters.min_tempo, filters.max_tempo),
+        ):
+            values = self.features[:, FEATURE_COLUMNS.index(column)]
+            if low is not None:
+                allowed &= values >= low
+            if high is not None:
+                allowed &= values <= high
+        return ~allowed
 
     def _normalize_features(self, features: List[float]) -> np.ndarray:
         """Normalize a single song's features"""
-        return (np.array(features) - self.feature_min) / (self.feature_max - self.feature_min)
+        return (np.array(features) - self.feature_mean) / self.feature_std
 
     def _get_song_from_row(self, row) -> Song:
         """Convert a database row to a Song object"""
         return Song(
             id=str(row['song_id']),
             title=row['name'],
-            artist=self._get_artist_name(row['album_id']),
-            album=self._get_album_name(row['album_id']),
+            artist=(row['artist_name'] or "Unknown Artist") if 'artist_name' in row.keys() else self._get_artist_name(row['album_id']),
+            album=(row['album_name'] or "Unknown Album") if 'album_name' in row.keys() else self._get_album_name(row['album_id']),
             genre=row['genre'].split(',') if row['genre'] else [],
             duration=row['duration'],
             tempo=row['tempo'],
@@ -107,7 +433,11 @@ class RecommendationService:
         result = self.cursor.fetchone()
         return result['name'] if result else "Unknown Album"
 
-    async def get_song(self, song_id: str) -> Optional[Song]:
+    @off_loop
+    def get_song(self, song_id: str) -> Optional[Song]:
+        return self._fetch_song(song_id)
+
+    def _fetch_song(self, song_id: str) -> Optional[Song]:
         self.cursor.execute("""
             SELECT * FROM Song WHERE song_id = ?
         """, (song_id,))
@@ -129,54 +459,140 @@ class RecommendationService:
             song.rms_energy
         ])
 
-    async def _get_recommendations_by_features(
+    def _get_recommendations_by_features(
         self,
         features: np.ndarray,
         limit: int = 10,
-        exclude_song_id: Optional[str] = None
+        exclude_song_id: Optional[str] = None,
+        diversity: Optional[float] = None,
+        max_per_artist: Optional[int] = None,
+        max_per_album: Optional[int] = None,
+        exclude: Optional[np.ndarray] = None,
+        seed_positions: Optional[np.ndarray] = None
     ) -> List[Song]:
-        """Get recommendations based on a feature vector"""
+        """
+        Get recommendations based on a feature vector.
+
+        With diversity or a per-artist/per-album cap, an over-fetched pool of nearest
+        neighbors is reranked with maximal marginal relevance before taking the top limit.
+        exclude is a boolean mask over index positions that the search skips entirely.
+        In cascade mode the pool is ranked by embedding distance to the mean embedding of
+        seed_positions instead; candidates without an embedding go last in coarse order.
+        """
+        if len(self.song_ids) == 0:
+            return []
+
         # Normalize the features
         normalized_features = self._normalize_features(features)
-        
-        # Query the k-d tree for nearest neighbors
+        rerank = bool(diversity) or max_per_artist is not None or max_per_album is not None
+        cascade_query = self._cascade_query(seed_positions)
+
+        # Query the index for nearest neighbors
         # Add 1 to limit if we need to exclude a song
-        k = limit + 1 if exclude_song_id else limit
-        distances, indices = self.feature_tree.query(
-            normalized_features,
-            k=k,
-            p=2  # Euclidean distance
-        )
-        
-        # Get the recommended songs
-        recommended_song_ids = [self.song_ids[idx] for idx in indices]
-        recommendations = []
-        
-        for rec_id in recommended_song_ids:
-            # Skip if this is the song we want to exclude
-            if exclude_song_id and str(rec_id) == exclude_song_id:
-                continue
-                
-            self.cursor.execute("""
-                SELECT * FROM Song WHERE song_id = ?
-            """, (rec_id,))
-            row = self.cursor.fetchone()
-            if row:
-                recommendations.append(self._get_song_from_row(row))
-                
-            if len(recommendations) >= limit:
-                break
-                
-        return recommendations
-
-    async def get_recommendations_by_song(
+        k = max(self.diversity_pool_size, limit) if rerank else limit
+        k = max(self.cascade_pool_size, k) if cascade_query is not None else k
+        k = k + 1 if exclude_song_id else k
+        distances, indices = self.feature_index.query(normalized_features, k=k, exclude=exclude)
+        if exclude_song_id:
+            indices = indices[self.song_ids[indices] != int(exclude_song_id)]
+
+        query, vectors = normalized_features, self.normalized_features
+        if cascade_query is not None:
+            has_embedding = self.has_embedding[indices]
+            indices, coarse_only = indices[has_embedding], indices[~has_embedding]
+            query, vectors = cascade_query, self.embeddings
+            if not rerank:
+                candidates = self.embeddings[indices] - cascade_query
+                order = np.argsort(np.einsum("ij,ij->i", candidates, candidates), kind="stable")
+                indices = indices[order[:limit]]
+
+        if rerank:
+            # Songs without a known artist are not one artist; each is capped on its own
+            artist_ids = self.song_artist_ids[indices]
+            artist_ids = np.where(artist_ids == NO_ARTIST, -self.song_ids[indices], artist_ids)
+            picked = mmr_rerank(
+                query,
+                vectors[indices],
+                limit,
+                diversity=diversity or 0.0,
+                artist_ids=artist_ids,
+                album_ids=self.song_album_ids[indices],
+                max_per_artist=max_per_artist,
+                max_per_album=max_per_album
+            )
+            indices = indices[picked]
+
+        if cascade_query is not None:
+            indices = np.concatenate([indices, coarse_only])
+        return self._songs_at_positions(indices[:limit])
+
+    def _cascade_query(self, seed_positions: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Mean embedding of the seed songs, or None if cascade reranking does not apply"""
+        if not self.cascade or seed_positions is None:
+            return None
+        seeds = seed_positions[self.has_embedding[seed_positions]]
+        if len(seeds) == 0:
+            return None
+        return self.embeddings[seeds].mean(axis=0)
+
+    def _songs_at_positions(self, positions: np.ndarray) -> List[Song]:
+        """Load the songs at the given index positions, in order, with one query"""
+        return self._songs_by_ids([int(self.song_ids[pos]) for pos in positions])
+
+    def _songs_by_ids(self, song_ids: List[int]) -> List[Song]:
+        """Load songs by ID, in order, with one query"""
+        if not song_ids:
+            return []
+        self.cursor.execute(f"""
+            SELECT s.*, ar.name AS artist_name, al.name AS album_name
+            FROM Song s
+            LEFT JOIN Album al ON s.album_id = al.album_id
+            LEFT JOIN Artist ar ON al.artist_id = ar.artist_id
+            WHERE s.song_id IN ({", ".join("?" * len(song_ids))})
+        """, song_ids)
+        rows = {row['song_id']: row for row in self.cursor.fetchall()}
+        return [self._get_song_from_row(rows[song_id]) for song_id in song_ids if song_id in rows]
+
+    def _seed_positions(self, song_ids: List[int]) -> np.ndarray:
+        """Index positions of the given songs that are in the index"""
+        return np.array([self.positions[song_id] for song_id in song_ids if song_id in self.positions], dtype=np.intp)
+
+    def _algorithm_name(self, kind: str) -> str:
+        """Describe the retrieval pipeline for response metadata"""
+        rerank = " + exact embedding rerank" if self.cascade and self.has_embedding.any() else ""
+        return f"{self.feature_index.name}{rerank} ({kind})"
+
+    def _weights_key(self) -> tuple:
+        """Hashable form of the feature weights for cache keys"""
+        return tuple(self.feature_weights[column] for column in FEATURE_COLUMNS)
+
+    def _cache_response(self, key: tuple, response: RecommendationResponse):
+        """Cache a built response, sized by its serialized length"""
+        self.cache.put(key, self.index_version, response, size=len(response.model_dump_json()))
+
+    @off_loop
+    def get_recommendations_by_song(
         self,
         song_id: str,
-        limit: int = 10
+        limit: int = 10,
+        diversity: Optional[float] = None,
+        max_per_artist: Optional[int] = None,
+        max_per_album: Optional[int] = None,
+        filters: Optional[RecommendationFilters] = None
     ) -> RecommendationResponse:
         """Get recommendations for a specific song"""
+        self.refresh()
+        cache_key = (
+            "song", str(song_id), limit, self._weights_key(),
+            diversity, max_per_artist, max_per_album,
+            filters.model_dump_json() if filters else None
+        )
+        cached = self.cache.get(cache_key, self.index_version)
+        if cached is not None:
+            return cached
+
         # Get the base song
-        base_song = await self.get_song(song_id)
+        base_song = self._fetch_song(song_id)
         if not base_song:
             raise ValueError("Song not found")
 
@@ -184,93 +600,296 @@ class RecommendationService:
         features = self._get_song_features(base_song)
         
         # Get recommendations excluding the base song
-        recommendations = await self._get_recommendations_by_features(
+        recommendations = self._get_recommendations_by_features(
             features,
             limit=limit,
-            exclude_song_id=song_id
+            exclude_song_id=song_id,
+            seed_positions=self._seed_positions([int(song_id)]),
+            diversity=diversity,
+            max_per_artist=max_per_artist,
+            max_per_album=max_per_album,
+            exclude=self._filter_exclude_mask(filters)
         )
 
-        return RecommendationResponse(
+        response = RecommendationResponse(
             recommendations=recommendations,
             metadata={
                 "base_song": base_song.title,
                 "total_recommendations": len(recommendations),
-                "algorithm": "k-d tree nearest neighbors (song-based)",
-                "feature_weights": {
-                    "duration": 1.0,
-                    "tempo": 1.0,
-                    "spectral_centroid": 1.0,
-                    "spectral_rolloff": 1.0,
-                    "spectral_contrast": 1.0,
-                    "chroma_mean": 1.0,
-                    "chroma_std": 1.0,
-                    "onset_strength": 1.0,
-                    "zero_crossing_rate": 1.0,
-                    "rms_energy": 1.0
-                }
+                "diversity": diversity,
+                "filters": filters.model_dump(exclude_none=True) if filters else None,
+                "algorithm": self._algorithm_name("song-based"),
+                "feature_weights": dict(self.feature_weights)
             }
         )
+        self._cache_response(cache_key, response)
+        return response
         
-    async def get_recommendations_by_artist(
+    @off_loop
+    def get_recommendations_by_artist(
         self,
         artist_id: int,
-        limit: int = 10
+        limit: int = 10,
+        diversity: Optional[float] = None,
+        max_per_artist: Optional[int] = None,
+        max_per_album: Optional[int] = None,
+        filters: Optional[RecommendationFilters] = None
     ) -> RecommendationResponse:
         """Get recommendations based on an artist's average song features"""
-        # Get all songs by the artist
-        self.cursor.execute("""
-            SELECT s.* 
-            FROM Song s
-            JOIN Album al ON s.album_id = al.album_id
-            WHERE al.artist_id = ?
-            AND s.duration IS NOT NULL 
-            AND s.tempo IS NOT NULL
-            AND s.spectral_centroid IS NOT NULL
-        """, (artist_id,))
-        rows = self.cursor.fetchall()
-        
-        if not rows:
+        self.refresh()
+        cache_key = (
+            "artist", int(artist_id), limit, self._weights_key(),
+            diversity, max_per_artist, max_per_album,
+            filters.model_dump_json() if filters else None
+        )
+        cached = self.cache.get(cache_key, self.index_version)
+        if cached is not None:
+            return cached
+
+        # Look up the artist's precomputed centroid
+        centroid = self.artists.centroid(int(artist_id))
+        if centroid is None:
             raise ValueError("No songs found for artist")
-            
+        average_features, song_count = centroid
+
         # Get artist name for metadata
         self.cursor.execute("""
             SELECT name FROM Artist WHERE artist_id = ?
         """, (artist_id,))
         artist_row = self.cursor.fetchone()
         artist_name = artist_row['name'] if artist_row else "Unknown Artist"
-            
-        # Convert rows to songs and extract features
-        songs = [self._get_song_from_row(row) for row in rows]
-        features_list = [self._get_song_features(song) for song in songs]
-        
-        # Calculate average features
-        average_features = np.mean(features_list, axis=0)
-        
+
         # Get recommendations based on average features
-        recommendations = await self._get_recommendations_by_features(
+        recommendations = self._get_recommendations_by_features(
             average_features,
-            limit=limit
+            seed_positions=np.flatnonzero(self.song_artist_ids == int(artist_id)),
+            limit=limit,
+            diversity=diversity,
+            max_per_artist=max_per_artist,
+            max_per_album=max_per_album,
+            exclude=self._filter_exclude_mask(filters)
         )
 
-        return RecommendationResponse(
+        response = RecommendationResponse(
             recommendations=recommendations,
             metadata={
                 "base_artist": artist_name,
-                "songs_analyzed": len(songs),
+                "songs_analyzed": song_count,
                 "total_recommendations": len(recommendations),
-                "algorithm": "k-d tree nearest neighbors (artist-based)",
-                "feature_weights": {
-                    "duration": 1.0,
-                    "tempo": 1.0,
-                    "spectral_centroid": 1.0,
-                    "spectral_rolloff": 1.0,
-                    "spectral_contrast": 1.0,
-                    "chroma_mean": 1.0,
-                    "chroma_std": 1.0,
-                    "onset_strength": 1.0,
-                    "zero_crossing_rate": 1.0,
-                    "rms_energy": 1.0
-                }
+                "diversity": diversity,
+                "filters": filters.model_dump(exclude_none=True) if filters else None,
+                "algorithm": self._algorithm_name("artist-based"),
+                "feature_weights": dict(self.feature_weights)
+            }
+        )
+        self._cache_response(cache_key, response)
+        return response
+
+    @off_loop
+    def get_recommendations_by_playlist(
+        self,
+        username: str,
+        playlist_name: str,
+        limit: int = 10,
+        n_centroids: int = 1,
+        filters: Optional[RecommendationFilters] = None
+    ) -> RecommendationResponse:
+        """
+        Get songs that continue a stored playlist.
+
+        The playlist's analyzed songs are clustered into n_centroids groups (one group is
+        their plain mean), and each centroid gets a share of the limit proportional to its
+        group size. Songs already in the playlist, and songs picked for another centroid,
+        are excluded inside the neighbor search through a mask over index positions.
+        """
+        self.refresh()
+
+        self.cursor.execute("SELECT user_id FROM User WHERE name = ?", (username,))
+        user_row = self.cursor.fetchone()
+        if not user_row:
+            raise ValueError(f"User '{username}' not found")
+        self.cursor.execute("""
+            SELECT ps.song_id FROM Playlist p
+            JOIN Playlist_Song ps ON ps.playlist_id = p.playlist_id
+            WHERE p.user_id = ? AND p.name = ?
+        """, (user_row['user_id'], playlist_name))
+        member_ids = [row['song_id'] for row in self.cursor.fetchall()]
+        if not member_ids:
+            raise ValueError("Playlist not found or empty")
+
+        member_positions = np.array(
+            [self.positions[song_id] for song_id in member_ids if song_id in self.positions],
+            dtype=np.intp
+        )
+        if len(member_positions) == 0:
+            raise ValueError("No analyzed songs in playlist")
+
+        exclude = self._filter_exclude_mask(filters)
+        if exclude is None:
+            exclude = np.zeros(len(self.song_ids), dtype=bool)
+        exclude[member_positions] = True
+
+        centroids, labels = kmeans(self.normalized_features[member_positions], n_centroids)
+        sizes = np.bincount(labels, minlength=len(centroids))
+        # Split the limit across centroids by group size (largest remainder)
+        shares = sizes / sizes.sum() * limit
+        quotas = np.floor(shares).astype(int)
+        quotas[np.argsort(quotas - shares)[:limit - quotas.sum()]] += 1
+
+        picks = []
+        for centroid, quota in zip(centroids, quotas):
+            if quota == 0:
+                continue
+            _, positions = self.feature_index.query(centroid, k=int(quota), exclude=exclude)
+            exclude[positions] = True
+            picks.append(positions)
+
+        # Interleave the centroids' picks so the continuation alternates between groups
+        order = [pos for rank in zip_longest(*picks) for pos in rank if pos is not None]
+        recommendations = self._songs_at_positions(np.array(order, dtype=np.intp))
+
+        return RecommendationResponse(
+            recommendations=recommendations,
+            metadata={
+                "base_playlist": playlist_name,
+                "songs_analyzed": len(member_positions),
+                "centroids": len(centroids),
+                "filters": filters.model_dump(exclude_none=True) if filters else None,
+                "total_recommendations": len(recommendations),
+                "algorithm": f"{self.feature_index.name} (playlist-based)",
+                "feature_weights": dict(self.feature_weights)
+            }
+        )
+
+    def _radio_positions(
+        self,
+        seed_position: int,
+        length: int,
+        seed_weight: float,
+        artist_spacing: int,
+        exclude: np.ndarray
+    ) -> Iterator[int]:
+        """
+        Walk the feature space from a seed song, yielding one index position per step.
+
+        Each step queries the nearest unvisited song to a target that is pulled from the
+        last pick back toward the seed by seed_weight, so the station wanders without
+        drifting away. Songs by the last artist_spacing artists are skipped while any
+        other candidate remains. The walk keeps the index it started on, so a refresh
+        between two steps does not move the positions under it.
+        """
+        # Bound now: a generator body would only read them at its first step
+        feature_index, vectors, song_artist_ids = self.feature_index, self.normalized_features, self.song_artist_ids
+
+        def walk():
+            seed = vectors[seed_position]
+            visited = exclude.copy()
+            visited[seed_position] = True
+            spaced = np.zeros_like(visited)
+            recent_artists = deque()
+            current = seed
+
+            for _ in range(length):
+                if visited.all():
+                    return
+                target = current + seed_weight * (seed - current)
+                _, found = feature_index.query(target, k=1, exclude=visited | spaced if recent_artists else visited)
+                if len(found) == 0:
+                    # Only recently played artists are left, so relax the spacing
+                    _, found = feature_index.query(target, k=1, exclude=visited)
+                    if len(found) == 0:
+                        return
+                position = int(found[0])
+                visited[position] = True
+                current = vectors[position]
+                yield position
+
+                artist_id = int(song_artist_ids[position])
+                if artist_spacing > 0 and artist_id != NO_ARTIST:
+                    recent_artists.append(artist_id)
+                    spaced |= song_artist_ids == artist_id
+                    if len(recent_artists) > artist_spacing:
+                        dropped = recent_artists.popleft()
+                        if dropped not in recent_artists:
+                            spaced &= song_artist_ids != dropped
+
+        return walk()
+
+    @off_loop
+    def generate_radio(
+        self,
+        song_id: str,
+        length: int = 100,
+        seed_weight: float = 0.3,
+        artist_spacing: int = 0,
+        filters: Optional[RecommendationFilters] = None,
+        batch_size: int = 25
+    ) -> Iterator[List[Song]]:
+        """
+        Generate a long radio station seeded by a song.
+
+        The station is produced lazily: songs are looked up and yielded in batches of
+        batch_size as the walk goes, so callers can stream them out immediately. Iterating
+        blocks, so async callers should iterate on a thread (iterate_in_threadpool).
+        Raises ValueError up front if the seed song is not in the index.
+        """
+        self.refresh()
+        seed_position = self.positions.get(int(song_id))
+        if seed_position is None:
+            raise ValueError("Song not found or not analyzed")
+        exclude = self._filter_exclude_mask(filters)
+        if exclude is None:
+            exclude = np.zeros(len(self.song_ids), dtype=bool)
+        walk = self._radio_positions(seed_position, length, seed_weight, artist_spacing, exclude)
+        song_ids = self.song_ids
+
+        def batches():
+            while True:
+                # Each batch holds the lock, so the caller may iterate from any thread
+                with self._lock:
+                    batch = [int(song_ids[position]) for position in islice(walk, batch_size)]
+                    songs = self._songs_by_ids(batch)
+                if not batch:
+                    return
+                yield songs
+
+        return batches()
+
+    @off_loop
+    def get_similar_artists(
+        self,
+        artist_id: int,
+        limit: int = 10
+    ) -> SimilarArtistsResponse:
+        """Get the artists whose average song features are closest to an artist's"""
+        self.refresh()
+
+        centroid = self.artists.centroid(int(artist_id))
+        if centroid is None:
+            raise ValueError("No songs found for artist")
+
+        similar = self.artists.similar(int(artist_id), limit, self._normalize_matrix)
+        ids = [int(artist_id)] + [similar_id for similar_id, _, _ in similar]
+        self.cursor.execute(f"""
+            SELECT artist_id, name FROM Artist WHERE artist_id IN ({", ".join("?" * len(ids))})
+        """, ids)
+        names = {row['artist_id']: row['name'] for row in self.cursor.fetchall()}
+
+        return SimilarArtistsResponse(
+            artists=[
+                SimilarArtist(
+                    id=similar_id,
+                    name=names.get(similar_id, "Unknown Artist"),
+                    song_count=song_count,
+                    distance=distance
+                )
+                for similar_id, distance, song_count in similar
+            ],
+            metadata={
+                "base_artist": names.get(int(artist_id), "Unknown Artist"),
+                "songs_analyzed": centroid[1],
+                "total_artists": len(similar),
+                "algorithm": "k-d tree over artist centroids"
             }
         )
 
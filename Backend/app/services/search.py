@@ -0,0 +1,123 @@
+'''
+This file searches artist, album and song names through the FTS5 indexes.
+
+The Artist_Search, Album_Search and Song_Search tables (see migrations.py) index the names
+and are kept in sync by triggers. Every word of a query is matched as a prefix and results
+are ranked with bm25 unless a sort order is requested. Each entity is paginated on its own
+with an opaque cursor holding the sort key and ID of the last row returned (keyset
+pagination), so later pages cost the same as the first. Song counts come from the
+trigger-maintained Artist_Stats and Album_Stats tables.
+'''
+import base64
+import json
+import re
+import sqlite3
+from typing import Any, List, Optional, Tuple
+
+# Sort option -> (expression over the entity query's columns, descending); names can be NULL,
+# and a cursor comparison with NULL is never true, so they sort as ''
+SORT_KEYS = {
+    None: ("rank", False),
+    "relevance": ("rank", False),
+    "name_asc": ("COALESCE(name, '')", False),
+    "name_desc": ("COALESCE(name, '')", True),
+    "song_count_asc": ("song_count", False),
+    "song_count_desc": ("song_count", True),
+}
+
+ARTIST_QUERY = """
+    SELECT ar.artist_id AS id, ar.name AS name, m.rank AS rank,
+           COALESCE(st.song_count, 0) AS song_count
+    FROM (SELECT rowid, bm25(Artist_Search) AS rank FROM Artist_Search WHERE Artist_Search MATCH ?) m
+    JOIN Artist ar ON ar.artist_id = m.rowid
+    LEFT JOIN Artist_Stats st ON st.artist_id = ar.artist_id
+"""
+
+ALBUM_QUERY = """
+    SELECT a.album_id AS id, a.name AS name, m.rank AS rank,
+           ar.name AS artist_name, a.album_url AS album_url,
+           COALESCE(st.song_count, 0) AS song_count
+    FROM (SELECT rowid, bm25(Album_Search) AS rank FROM Album_Search WHERE Album_Search MATCH ?) m
+    JOIN Album a ON a.album_id = m.rowid
+    JOIN Artist ar ON a.artist_id = ar.artist_id
+    LEFT JOIN Album_Stats st ON st.album_id = a.album_id
+"""
+
+SONG_QUERY = """
+    SELECT s.song_id AS id, s.name AS name, m.rank AS rank,
+           ar.name AS artist_name, al.name AS album_name, al.album_url AS album_url,
+           s.duration AS duration
+    FROM (SELECT rowid, bm25(Song_Search) AS rank FROM Song_Search WHERE Song_Search MATCH ?) m
+    JOIN Song s ON s.song_id = m.rowid
+    JOIN Album al ON s.album_id = al.album_id
+    JOIN Artist ar ON al.artist_id = ar.artist_id
+"""
+
+def build_match_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching every word as a prefix, or None if empty"""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    # Quoting each word keeps FTS5 operators and punctuation in user input from being parsed
+    return " ".join(f'"{word}"*' for word in words)
+
+def encode_cursor(key: Any, row_id: int) -> str:
+    """Pack the sort key and ID of the last returned row"""
+    return base64.urlsafe_b64encode(json.dumps([key, row_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """Unpack a cursor from encode_cursor; raises ValueError if it is malformed"""
+    try:
+        key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return key, int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _page(
+    conn: sqlite3.Connection,
+    entity_query: str,
+    params: list,
+    sort: Optional[str],
+    limit: int,
+    cursor: Optional[str],
+    having: str = ""
+) -> Tuple[List[sqlite3.Row], Optional[str]]:
+    """Run one entity query with keyset pagination on (sort key, id)"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort order '{sort}'")
+    key, descending = SORT_KEYS[sort]
+    sql = f"SELECT *, {key} AS sort_key FROM ({entity_query}) WHERE 1 = 1 {having}"
+    params = list(params)
+    if cursor:
+        last_key, last_id = decode_cursor(cursor)
+        sql += f" AND ({key} {'<' if descending else '>'} ? OR ({key} = ? AND id > ?))"
+        params += [last_key, last_key, last_id]
+    sql += f" ORDER BY {key} {'DESC' if descending else 'ASC'}, id ASC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["sort_key"], rows[-1]["id"])
+    return rows, next_cursor
+
+def search_artists(conn, match: str, limit: int = 20, cursor: Optional[str] = None,
+                   sort: Optional[str] = None, min_songs: Optional[int] = None):
+    """Matching artists with their song counts, and the cursor of the next page"""
+    having, params = "", [match]
+    if min_songs is not None:
+        having, params = "AND song_count >= ?", [match, min_songs]
+    return _page(conn, ARTIST_QUERY, params, sort, limit, cursor, having)
+
+def search_albums(conn, match: str, limit: int = 20, cursor: Optional[str] = None,
+                  sort: Optional[str] = None):
+    """Matching albums with their artist and song count, and the cursor of the next page"""
+    return _page(conn, ALBUM_QUERY, [match], sort, limit, cursor)
+
+def search_songs(conn, match: str, limit: int = 20, cursor: Optional[str] = None,
+                 sort: Optional[str] = None):
+    """Matching songs with their artist and album, and the cursor of the next page"""
+    if sort and sort.startswith("song_count"):
+        raise ValueError(f"Unknown sort order '{sort}'")
+    return _page(conn, SONG_QUERY, [match], sort, limit, cursor)
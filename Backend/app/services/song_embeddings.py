@@ -0,0 +1,95 @@
+'''
+This file stores the rich per-song vectors used to rerank recommendation candidates.
+
+The 10 summary columns on Song are cheap to search but coarse. AudioAnalyzer also computes
+13 MFCC means and a 12-bin chroma profile; those are packed into one float32 vector per
+song in Song_Embedding, and loaded into a contiguous matrix aligned with the index
+positions so a candidate pool can be reranked exactly with one vectorized distance pass.
+Both analyze_songs.py and the Spotify import store them. After the first load only the
+embeddings of changed songs are read (read_embeddings), standardized like the rest.
+'''
+import sqlite3
+from typing import Any, Dict, Iterable, Optional, Tuple
+import numpy as np
+
+EMBEDDING_COLUMNS = [f"mfcc_{i}" for i in range(1, 14)] + [f"chroma_{i}" for i in range(1, 13)]
+
+EMBEDDING_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Song_Embedding (
+        song_id INTEGER PRIMARY KEY,
+        vector BLOB NOT NULL,
+        FOREIGN KEY (song_id) REFERENCES Song(song_id) ON DELETE CASCADE
+    );
+"""
+
+def ensure_embedding_table(conn: sqlite3.Connection):
+    """Create the embedding table if the database does not have it yet"""
+    conn.executescript(EMBEDDING_SCHEMA)
+    conn.commit()
+
+def embedding_from_features(features: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Pack AudioAnalyzer output into an embedding, or None if any component is missing"""
+    if any(features.get(column) is None for column in EMBEDDING_COLUMNS):
+        return None
+    return np.array([float(np.ravel(features[column])[0]) for column in EMBEDDING_COLUMNS], dtype=np.float32)
+
+def save_embedding(cursor: sqlite3.Cursor, song_id: int, vector: np.ndarray):
+    """Store a song's embedding (the caller commits)"""
+    cursor.execute(
+        "INSERT OR REPLACE INTO Song_Embedding (song_id, vector) VALUES (?, ?)",
+        (int(song_id), np.asarray(vector, dtype="<f4").tobytes())
+    )
+
+def _read(rows: Iterable[Tuple[int, bytes]], song_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Place (song_id, vector) rows into a matrix aligned with song_ids"""
+    dims = len(EMBEDDING_COLUMNS)
+    matrix = np.zeros((len(song_ids), dims), dtype=np.float32)
+    present = np.zeros(len(song_ids), dtype=bool)
+    positions = {int(song_id): row for row, song_id in enumerate(song_ids)}
+    for song_id, blob in rows:
+        row = positions.get(song_id)
+        if row is not None and len(blob) == dims * 4:
+            matrix[row] = np.frombuffer(blob, dtype="<f4")
+            present[row] = True
+    return matrix, present
+
+def read_embeddings(
+    conn: sqlite3.Connection,
+    song_ids: np.ndarray,
+    scale: Tuple[np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read the embeddings of a few songs by ID, standardized with the (mean, std) of load_embeddings"""
+    song_ids = [int(song_id) for song_id in song_ids]
+    rows = []
+    for start in range(0, len(song_ids), 500):
+        chunk = song_ids[start:start + 500]
+        rows += conn.execute(
+            f"SELECT song_id, vector FROM Song_Embedding WHERE song_id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall()
+    matrix, present = _read(rows, song_ids)
+    mean, std = scale
+    matrix[present] = (matrix[present] - mean) / std
+    return matrix, present
+
+def load_embeddings(
+    conn: sqlite3.Connection,
+    song_ids: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Load the embeddings of the given songs, standardized per dimension.
+
+    Returns:
+        A float32 matrix with one row per song ID (zeros where a song has no embedding),
+        a boolean mask of the rows that have one, and the (mean, std) they were
+        standardized with
+    """
+    matrix, present = _read(conn.execute("SELECT song_id, vector FROM Song_Embedding"), song_ids)
+    mean = np.zeros(len(EMBEDDING_COLUMNS), dtype=np.float32)
+    std = np.ones(len(EMBEDDING_COLUMNS), dtype=np.float32)
+    if present.any():
+        # Standardize so MFCC and chroma dimensions weigh the same in distances
+        mean = matrix[present].mean(axis=0)
+        std = matrix[present].std(axis=0)
+        std[std <= 1e-6] = 1.0
+        matrix[present] = (matrix[present] - mean) / std
+    return matrix, present, (mean, std)
@@ -2,7 +2,6 @@
 This service handles importing songs from Spotify links into our database.
 '''
 import re
-import sqlite3
 import os
 import time
 import yt_dlp
@@ -10,6 +9,8 @@ from typing import Optional, Dict
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 from app.services.audio_analyzer import AudioAnalyzer
+from app.services.database import connect
+from app.services.song_embeddings import ensure_embedding_table, embedding_from_features, save_embedding
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -42,9 +43,9 @@ class SpotifyImportService:
         
         # Connect to the database
         db_path = os.path.join(self.root_dir, "../Database/music_app.db")
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
+        self.conn = connect(db_path)
         self.cursor = self.conn.cursor()
+        ensure_embedding_table(self.conn)
         
         # Initialize audio analyzer
         self.audio_analyzer = AudioAnalyzer()
@@ -249,6 +250,10 @@ class SpotifyImportService:
                     zero_crossing_rate, rms_energy,
                     genre
                 ))
+                # The MFCC/chroma embedding for cascade reranking, committed together with the song
+                embedding = embedding_from_features(features)
+                if embedding is not None:
+                    save_embedding(self.cursor, self.cursor.lastrowid, embedding)
                 self.conn.commit()
                 
                 logger.info(f"Successfully imported: {song_name}")
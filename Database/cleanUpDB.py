@@ -2,37 +2,21 @@
 This script removes:
 1. Albums with no songs
 2. Artists with no albums
+
+Rows are deleted in small batches (see maintenance.py), so the app keeps working meanwhile.
 '''
-import sqlite3
+from maintenance import DEFAULT_DB_PATH, ORPHAN_CLEANUPS, connect, delete_in_batches
 
-def cleanup_orphaned_data(db_path="music_app.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def cleanup_orphaned_data(db_path=DEFAULT_DB_PATH):
+    conn = connect(db_path)
 
     try:
         print("\n🧹 Cleaning up orphaned albums and artists...\n")
 
-        # Delete albums with no songs
-        cursor.execute("""
-            DELETE FROM Album
-            WHERE album_id NOT IN (
-                SELECT DISTINCT album_id FROM Song
-            );
-        """)
-        deleted_albums = cursor.rowcount
-        print(f"🗑️ Deleted {deleted_albums} album(s) with no songs.")
-
-        # Delete artists with no albums
-        cursor.execute("""
-            DELETE FROM Artist
-            WHERE artist_id NOT IN (
-                SELECT DISTINCT artist_id FROM Album
-            );
-        """)
-        deleted_artists = cursor.rowcount
-        print(f"🗑️ Deleted {deleted_artists} artist(s) with no albums.")
+        for cleanup in ORPHAN_CLEANUPS:
+            if cleanup.table in ("Album", "Artist"):
+                delete_in_batches(conn, cleanup)
 
-        conn.commit()
         print("\n✅ Cleanup complete.\n")
 
     except Exception as e:
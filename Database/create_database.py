@@ -3,22 +3,36 @@ This file is used to create the database.
 '''
 import sqlite3
 import os
+import sys
 
-def create_music_app_db():
-    # Target the database in the Database directory
-    db_path = os.path.join(os.path.dirname(__file__), "music_app.db")
+# The change log and embedding schemas live with their readers in Backend/app/services
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+from app.services.catalog_changes import ensure_change_log
+from app.services.song_embeddings import ensure_embedding_table
+
+def create_music_app_db(db_path=None):
+    # Target the database in the Database directory unless another path is given
+    if db_path is None:
+        db_path = os.path.join(os.path.dirname(__file__), "music_app.db")
     print(f"Creating database at: {db_path}")
     
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    # Lets maintenance.py release free pages with incremental vacuum (only applies to a new file)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
     # Drop existing tables if they exist
     tables = [
         "User", "Artist", "Album", "Song", 
-        "Playlist", "Playlist_Song", "History"
+        "Playlist", "Playlist_Song", "History", "Song_Change_Log",
+        "Song_Embedding", "Artist_Search", "Album_Search", "Song_Search",
+        "Catalog_Totals", "Artist_Stats", "Album_Stats", "Playlist_Stats", "Genre_Stats",
+        "Database_Identity", "Change_Log_Consumer"
     ]
     for table in tables:
         cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    # The app's migrations (indexes, search tables) run again on the fresh schema
+    cursor.execute("PRAGMA user_version = 0")
     conn.commit()
 
     cursor.execute("""
@@ -100,6 +114,10 @@ def create_music_app_db():
     );
     """)
 
+    # Every change to Song is logged so the recommendation index can refresh incrementally
+    ensure_change_log(conn)
+    ensure_embedding_table(conn)
+
     conn.commit()
     conn.close()
 
@@ -1,26 +1,24 @@
 '''
 This script deletes all songs from the database that do not have analyzed features (i.e., duration is NULL).
+Songs that are in a playlist or in the listening history are kept. Rows are deleted in
+small batches (see maintenance.py), so the app keeps working meanwhile.
 '''
-import sqlite3
+from maintenance import DEFAULT_DB_PATH, UNANALYZED_SONGS, connect, delete_in_batches
 
-def delete_unanalyzed_songs(db_path="music_app.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def delete_unanalyzed_songs(db_path=DEFAULT_DB_PATH):
+    conn = connect(db_path)
 
     try:
         print("\n🧹 Deleting songs with no analyzed data (NULL duration)...")
 
         # Count how many will be deleted
-        cursor.execute("SELECT COUNT(*) FROM Song WHERE duration IS NULL;")
-        count = cursor.fetchone()[0]
+        count = conn.execute(f"SELECT COUNT(*) FROM Song t WHERE {UNANALYZED_SONGS.orphan}").fetchone()[0]
         print(f"Found {count} song(s) to delete.")
 
         if count == 0:
             print("✅ No unanalyzed songs to delete.")
         else:
-            cursor.execute("DELETE FROM Song WHERE duration IS NULL;")
-            conn.commit()
-            print(f"🗑️ Deleted {count} unanalyzed song(s).")
+            delete_in_batches(conn, UNANALYZED_SONGS)
 
     except Exception as e:
         print(f"❌ Error deleting unanalyzed songs: {e}")
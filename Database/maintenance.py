@@ -0,0 +1,254 @@
+'''
+This script runs routine maintenance on the database without holding long locks.
+
+1. Orphaned rows are deleted in bounded batches: each batch takes the next batch_size keys
+   of a table and deletes the orphans among them with NOT EXISTS, in its own short
+   transaction. Readers never wait in WAL mode, and writers only wait for one batch.
+   Songs that are in a playlist or in the listening history are never deleted.
+   Song_Change_Log entries are pruned once every consumer has saved past them and they
+   are older than the retention period.
+2. Free pages are returned to the file system with incremental vacuum, a few at a time.
+3. Planner statistics are refreshed with ANALYZE / PRAGMA optimize.
+4. The file is checked with integrity_check and foreign_key_check.
+
+Run 'python Database/maintenance.py --help' for the options.
+'''
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "music_app.db")
+BATCH_SIZE = 500
+VACUUM_PAGES = 1000
+PAUSE_S = 0.01          # Between batches, so waiting writers get the lock
+BUSY_TIMEOUT_S = 5.0
+ANALYSIS_LIMIT = 1000   # Rows sampled per index by ANALYZE
+# Change log entries stay at least this long, for app processes that have not saved yet
+CHANGE_LOG_RETENTION_DAYS = 1.0
+# The cleanups need playlist_id and the rebuilt History (Backend/app/services/migrations.py)
+REQUIRED_SCHEMA_VERSION = 7
+
+class Cleanup(NamedTuple):
+    label: str
+    table: str
+    key: str       # Unique column to walk the table in batches
+    orphan: str    # Condition on the row (aliased t) that marks it for deletion
+
+UNANALYZED_SONGS = Cleanup(
+    "unanalyzed songs", "Song", "song_id", """
+        t.duration IS NULL
+        AND NOT EXISTS (SELECT 1 FROM Playlist_Song ps WHERE ps.song_id = t.song_id)
+        AND NOT EXISTS (SELECT 1 FROM History h WHERE h.song_id = t.song_id)
+    """
+)
+
+ORPHAN_CLEANUPS = [
+    Cleanup("playlist entries of missing songs or playlists", "Playlist_Song", "rowid", """
+        NOT EXISTS (SELECT 1 FROM Song s WHERE s.song_id = t.song_id)
+        OR NOT EXISTS (SELECT 1 FROM Playlist p WHERE p.playlist_id = t.playlist_id)
+    """),
+    Cleanup("embeddings of missing songs", "Song_Embedding", "song_id", """
+        NOT EXISTS (SELECT 1 FROM Song s WHERE s.song_id = t.song_id)
+    """),
+    Cleanup("albums with no songs", "Album", "album_id", """
+        NOT EXISTS (SELECT 1 FROM Song s WHERE s.album_id = t.album_id)
+    """),
+    Cleanup("artists with no albums", "Artist", "artist_id", """
+        NOT EXISTS (SELECT 1 FROM Album al WHERE al.artist_id = t.artist_id)
+    """),
+]
+
+def change_log_cleanup(retention_days: float = CHANGE_LOG_RETENTION_DAYS) -> Cleanup:
+    """Change log entries before the oldest consumer checkpoint (none if no consumer saved yet)"""
+    return Cleanup("change log entries every consumer has saved", "Song_Change_Log", "change_id", f"""
+        t.change_id < (SELECT MIN(change_id) FROM Change_Log_Consumer)
+        AND t.changed_at <= datetime('now', '-{float(retention_days)} days')
+    """)
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open the database in WAL mode, waiting up to BUSY_TIMEOUT_S for locks"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S)
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+def delete_in_batches(
+    conn: sqlite3.Connection,
+    cleanup: Cleanup,
+    batch_size: int = BATCH_SIZE,
+    pause: float = PAUSE_S,
+    progress: Callable[[str], None] = print
+) -> int:
+    """Delete the rows matching cleanup.orphan, batch_size keys per transaction; returns how many"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (cleanup.table,)).fetchone():
+        # Song_Embedding is only created once songs are analyzed
+        progress(f"⏭️ Skipped {cleanup.label}: no {cleanup.table} table")
+        return 0
+    total = conn.execute(f"SELECT COUNT(*) FROM {cleanup.table}").fetchone()[0]
+    scanned = deleted = 0
+    last = None
+    reported = time.monotonic()
+    while True:
+        if last is None:
+            keys = conn.execute(
+                f"SELECT {cleanup.key} FROM {cleanup.table} ORDER BY {cleanup.key} LIMIT ?", (batch_size,)
+            ).fetchall()
+        else:
+            keys = conn.execute(
+                f"SELECT {cleanup.key} FROM {cleanup.table} WHERE {cleanup.key} > ? ORDER BY {cleanup.key} LIMIT ?",
+                (last, batch_size)
+            ).fetchall()
+        if not keys:
+            break
+        first, last = keys[0][0], keys[-1][0]
+        with conn:
+            cursor = conn.execute(f"""
+                DELETE FROM {cleanup.table} AS t
+                WHERE t.{cleanup.key} BETWEEN ? AND ? AND ({cleanup.orphan})
+            """, (first, last))
+        scanned += len(keys)
+        deleted += cursor.rowcount
+        if time.monotonic() - reported >= 1.0:
+            progress(f"   {cleanup.label}: checked {scanned}/{total}, deleted {deleted}")
+            reported = time.monotonic()
+        time.sleep(pause)
+    progress(f"🗑️ Deleted {deleted} {cleanup.label} (checked {scanned})")
+    return deleted
+
+def enable_incremental_vacuum(conn: sqlite3.Connection, progress: Callable[[str], None] = print):
+    """Switch the file to auto_vacuum=INCREMENTAL; the VACUUM this needs rewrites the whole file once"""
+    progress("🧱 Rewriting the database with VACUUM to enable incremental vacuum...")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def incremental_vacuum(
+    conn: sqlite3.Connection,
+    pages: int = VACUUM_PAGES,
+    pause: float = PAUSE_S,
+    progress: Callable[[str], None] = print
+) -> int:
+    """Release free pages, pages at a time; returns how many were released"""
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        progress(f"ℹ️ {free} free page(s) kept: auto_vacuum is not INCREMENTAL "
+                 "(run once with --enable-incremental-vacuum to switch)")
+        return 0
+    released = 0
+    while free:
+        conn.execute(f"PRAGMA incremental_vacuum({min(pages, free)})").fetchall()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free:
+            break
+        released += free - remaining
+        free = remaining
+        time.sleep(pause)
+    progress(f"📉 Released {released} free page(s)")
+    return released
+
+def refresh_statistics(conn: sqlite3.Connection, full: bool = False, progress: Callable[[str], None] = print):
+    """ANALYZE (sampled) if there are no statistics yet or full is set, then PRAGMA optimize"""
+    has_statistics = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if full or not has_statistics:
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE")
+        progress("📊 Planner statistics rebuilt with ANALYZE")
+    conn.execute("PRAGMA optimize")
+    progress("📊 PRAGMA optimize done")
+
+def check_integrity(conn: sqlite3.Connection, quick: bool = False, progress: Callable[[str], None] = print) -> Dict[str, List[str]]:
+    """
+    Run integrity_check (quick_check if quick) and foreign_key_check.
+
+    Returns:
+        "errors": corruption reported by SQLite, "warnings": tables with rows that
+        reference missing parent rows
+    """
+    errors = [row[0] for row in conn.execute("PRAGMA quick_check" if quick else "PRAGMA integrity_check")]
+    errors = [] if errors == ["ok"] else errors
+    violations: Dict[str, int] = {}
+    for table, _, parent, _ in conn.execute("PRAGMA foreign_key_check"):
+        violations[f"{table} -> {parent}"] = violations.get(f"{table} -> {parent}", 0) + 1
+    warnings = [f"{count} row(s) of {link} reference missing rows" for link, count in violations.items()]
+
+    progress("✅ Integrity check passed" if not errors else f"❌ Integrity check failed: {errors[:10]}")
+    for warning in warnings:
+        progress(f"⚠️ {warning}")
+    return {"errors": errors, "warnings": warnings}
+
+def run_maintenance(
+    db_path: str = DEFAULT_DB_PATH,
+    batch_size: int = BATCH_SIZE,
+    delete_unanalyzed: bool = False,
+    vacuum: bool = True,
+    switch_to_incremental_vacuum: bool = False,
+    full_analyze: bool = False,
+    quick_check: bool = False,
+    change_log_retention_days: float = CHANGE_LOG_RETENTION_DAYS,
+    pause: float = PAUSE_S,
+    progress: Callable[[str], None] = print
+) -> dict:
+    """Run every maintenance step on one database and return a summary"""
+    conn = connect(db_path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < REQUIRED_SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Database schema is at version {version}; start the app once to migrate it "
+                f"to version {REQUIRED_SCHEMA_VERSION} before running maintenance"
+            )
+        progress(f"\n🧹 Maintaining {db_path}\n")
+        cleanups = ([UNANALYZED_SONGS] if delete_unanalyzed else []) + ORPHAN_CLEANUPS
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Change_Log_Consumer'").fetchone():
+            # Consumer checkpoints arrive with schema version 10
+            cleanups.append(change_log_cleanup(change_log_retention_days))
+        deleted = {
+            cleanup.label: delete_in_batches(conn, cleanup, batch_size, pause, progress)
+            for cleanup in cleanups
+        }
+        if switch_to_incremental_vacuum:
+            enable_incremental_vacuum(conn, progress)
+        released = incremental_vacuum(conn, pause=pause, progress=progress) if vacuum else 0
+        refresh_statistics(conn, full_analyze, progress)
+        checks = check_integrity(conn, quick_check, progress)
+        # Move the batches from the WAL into the database file without waiting on readers
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return {"deleted": deleted, "released_pages": released, **checks}
+    finally:
+        conn.close()
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Clean up, vacuum, analyze and check the music database")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Database file (default: Database/music_app.db)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows checked per transaction")
+    parser.add_argument("--delete-unanalyzed", action="store_true",
+                        help="Also delete songs without features that are in no playlist or history")
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip incremental vacuum")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Switch the file to auto_vacuum=INCREMENTAL (one full VACUUM that blocks writers)")
+    parser.add_argument("--full-analyze", action="store_true", help="Rebuild statistics even if they exist")
+    parser.add_argument("--quick-check", action="store_true", help="Use quick_check instead of integrity_check")
+    parser.add_argument("--change-log-retention-days", type=float, default=CHANGE_LOG_RETENTION_DAYS,
+                        help="Keep change log entries at least this many days (default 1)")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run_maintenance(
+            args.db,
+            batch_size=args.batch_size,
+            delete_unanalyzed=args.delete_unanalyzed,
+            vacuum=not args.no_vacuum,
+            switch_to_incremental_vacuum=args.enable_incremental_vacuum,
+            full_analyze=args.full_analyze,
+            quick_check=args.quick_check,
+            change_log_retention_days=args.change_log_retention_days
+        )
+    except (RuntimeError, sqlite3.Error) as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"\n{'✅ Maintenance complete.' if not summary['errors'] else '❌ Maintenance found corruption.'}\n")
+    return 1 if summary["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
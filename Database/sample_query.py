@@ -1,7 +1,35 @@
 '''
 This file prints insights from the music_app database: totals, top artists/albums, etc.
 '''
+import json
+import os
 import sqlite3
+import sys
+import numpy as np
+
+# The feature column list lives with the schema migrations in Backend/app/services
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Backend"))
+from app.services.migrations import FEATURE_COLUMNS
+from app.services.catalog_changes import database_id, latest_change_id
+
+def load_feature_store(conn, db_path):
+    """Map the features of the live rows in the store next to the database, or None if it is stale"""
+    directory = os.path.splitext(db_path)[0] + "_features"
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("columns") != FEATURE_COLUMNS:
+            return None
+        # Exported from another (or a recreated) database, or songs changed since the last sync
+        if (manifest.get("database_id") != database_id(conn)
+                or manifest.get("change_id") != latest_change_id(conn)):
+            return None
+        rows = manifest["rows"]
+        features = np.load(os.path.join(directory, "features.npy"), mmap_mode="r")[:rows]
+        live = np.load(os.path.join(directory, "live.npy"), mmap_mode="r")[:rows]
+    except (OSError, ValueError, KeyError, sqlite3.Error):
+        return None
+    return features if live.all() else features[np.array(live)]
 
 def print_database_insights(db_path="music_app.db"):
     conn = sqlite3.connect(db_path)
@@ -10,13 +38,17 @@ def print_database_insights(db_path="music_app.db"):
     print("\n=== 🎵 Music Database Insights ===\n")
 
     try:
-        # 1. Total counts
-        cursor.execute("SELECT COUNT(*) FROM Artist;")
-        artist_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM Album;")
-        album_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM Song;")
-        song_count = cursor.fetchone()[0]
+        # 1. Total counts (kept by triggers once the backend has migrated the database)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Catalog_Totals';")
+        if cursor.fetchone():
+            cursor.execute("SELECT artists, albums, songs, analyzed_songs FROM Catalog_Totals;")
+            artist_count, album_count, song_count, analyzed_count = cursor.fetchone()
+        else:
+            cursor.execute("""
+                SELECT (SELECT COUNT(*) FROM Artist), (SELECT COUNT(*) FROM Album),
+                       (SELECT COUNT(*) FROM Song), (SELECT COUNT(*) FROM Song WHERE duration IS NOT NULL);
+            """)
+            artist_count, album_count, song_count, analyzed_count = cursor.fetchone()
 
         print(f"👤 Total Artists: {artist_count}")
         print(f"💿 Total Albums: {album_count}")
@@ -25,8 +57,6 @@ def print_database_insights(db_path="music_app.db"):
 
         # 2. Songs with analyzed features
         print("📊 Songs with Analyzed Features:")
-        cursor.execute("SELECT COUNT(*) FROM Song WHERE duration IS NOT NULL;")
-        analyzed_count = cursor.fetchone()[0]
         print(f"🔬 Analyzed Songs: {analyzed_count}")
         print("-" * 60)
 
@@ -129,6 +159,23 @@ def print_database_insights(db_path="music_app.db"):
             print("No analyzed songs found.")
         print("-" * 60)
 
+        # 8. Average audio features, from the feature store when it is up to date
+        features = load_feature_store(conn, db_path)
+        if features is not None:
+            print(f"📈 Average Audio Features (feature store, {len(features)} songs):")
+            averages = features.mean(axis=0) if len(features) else [None] * len(FEATURE_COLUMNS)
+        else:
+            print("📈 Average Audio Features:")
+            cursor.execute(f"""
+                SELECT {", ".join(f"AVG({column})" for column in FEATURE_COLUMNS)}
+                FROM Song
+                WHERE duration IS NOT NULL AND tempo IS NOT NULL AND spectral_centroid IS NOT NULL;
+            """)
+            averages = cursor.fetchone()
+        for column, average in zip(FEATURE_COLUMNS, averages):
+            print(f"   {column}: {average:.4f}" if average is not None else f"   {column}: -")
+        print("-" * 60)
+
     except Exception as e:
         print(f"❌ Error querying database: {e}")
     finally: